@@ -0,0 +1,135 @@
+'''
+Helpers of offline separation of many WAV files, see "separate" mode
+'''
+import os
+import glob
+
+import numpy as np
+import scipy.io.wavfile
+
+import app.utils as utils
+
+
+def list_inputs(input_dir=None, manifest=None):
+    '''
+    Args:
+        input_dir: None or string, directory searched recursively
+            for "*.wav" files
+        manifest: None or string, text file with one WAV path per line
+
+    Returns:
+        list of string, paths of input files
+    '''
+    filenames = []
+    if input_dir is not None:
+        filenames.extend(sorted(glob.glob(
+            os.path.join(glob.escape(input_dir), '**', '*.wav'),
+            recursive=True)))
+    if manifest is not None:
+        with open(manifest, 'r') as f:
+            filenames.extend(
+                line.strip() for line in f
+                if line.strip() and not line.startswith('#'))
+    return filenames
+
+
+def output_names(filename, input_dir, output_dir, num_signals):
+    '''
+    Output paths of separated signals, mirroring the layout of
+    `input_dir` within `output_dir`
+
+    Returns:
+        list of string
+    '''
+    if input_dir is not None and os.path.abspath(filename).startswith(
+            os.path.abspath(input_dir) + os.sep):
+        rel_name = os.path.relpath(filename, input_dir)
+    else:
+        rel_name = os.path.basename(filename)
+    stem, ext = os.path.splitext(os.path.join(output_dir, rel_name))
+    return [
+        stem + ('_separated_%d' % (i+1)) + ext for i in range(num_signals)]
+
+
+def make_buckets(lengths, batch_size):
+    '''
+    Groups items of similar length into batches, so little padding
+    is needed
+
+    Args:
+        lengths: list of int
+        batch_size: int
+
+    Returns:
+        list of list of int, indices of items in each batch,
+        last batch may be smaller
+    '''
+    order = np.argsort(lengths, kind='stable')
+    return [
+        order[i:i+batch_size].tolist()
+        for i in range(0, len(order), batch_size)]
+
+
+def pad_batch(spectra_li, batch_size, length_align):
+    '''
+    Zero pads spectra at the end into a batch
+
+    Args:
+        spectra_li: list of arrays of shape [length, feature_size]
+        batch_size: integer, missing items are all zero
+        length_align: integer, padded length is a multiple of this
+
+    Returns:
+        array of shape [batch_size, max_length, feature_size]
+    '''
+    max_len = max(len(x) for x in spectra_li)
+    max_len += (-max_len) % length_align
+    batch = np.zeros(
+        (batch_size, max_len, spectra_li[0].shape[-1]),
+        dtype=spectra_li[0].dtype)
+    for i, x in enumerate(spectra_li):
+        batch[i, :len(x)] = x
+    return batch
+
+
+def batch_lengths(spectra_li, batch):
+    '''
+    Args:
+        spectra_li: list of arrays of shape [length, feature_size]
+        batch: array, as returned by `pad_batch(spectra_li, ...)`
+
+    Returns:
+        int32 array of shape [batch_size], valid frames of each row,
+        to feed Model.infer_feed_keys, unused rows are all valid
+    '''
+    lengths = np.full(len(batch), batch.shape[1], dtype=np.int32)
+    lengths[:len(spectra_li)] = [len(x) for x in spectra_li]
+    return lengths
+
+
+def write_separated(out_names_li, signals_li, stride, window, smprate):
+    '''
+    Reconstructs and writes separated signals as float32 WAV files,
+    runs in worker processes
+
+    Args:
+        out_names_li: list of list of string, output paths per input file
+        signals_li: list of arrays of shape
+            [num_signals, length, feature_size], padding removed
+        stride: integer, STFT stride
+        window: 1D array, STFT window
+        smprate: integer
+
+    Returns:
+        float, seconds of audio written per source
+    '''
+    audio_sec = 0.
+    for out_names, signals in zip(out_names_li, signals_li):
+        data = utils.istft(signals, stride=stride, window=window)
+        for out_name, d in zip(out_names, data):
+            out_dir = os.path.dirname(out_name)
+            if out_dir and not os.path.exists(out_dir):
+                os.makedirs(out_dir, exist_ok=True)
+            scipy.io.wavfile.write(out_name, smprate, d.astype(np.float32))
+        audio_sec += data.shape[-1] / smprate
+    return audio_sec
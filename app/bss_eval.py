@@ -0,0 +1,180 @@
+'''
+Vectorized BSS-eval (SDR / SIR / SAR) and SI-SNR of separated waveforms
+
+Follows BSS-eval v3 with time-invariant distortion filters, as
+`bss_eval_sources` of mir_eval, except estimates are taken as already
+matched to references (PIT order), so no permutation search is done.
+
+All projections of a batch are solved together: the Gram matrix of
+shifted references is shared by every estimate of the same utterance,
+and built from FFT cross-correlations by indexing.
+'''
+import numpy as np
+
+import app.utils as utils
+
+
+# columns of per-utterance results, "_i" being improvement over mixture
+METRICS = ('sdr', 'sir', 'sar', 'si_snr', 'sdr_i', 'si_snr_i')
+
+
+def _db(num, den, eps):
+    return 10. * np.log10((num + eps) / (den + eps))
+
+
+def si_snr(refs, ests, eps=1e-8):
+    '''
+    Scale-invariant SNR
+
+    Args:
+        refs: array of shape [..., length]
+        ests: array of same shape as refs
+
+    Returns:
+        array of shape [...], in dB
+    '''
+    refs = refs - np.mean(refs, axis=-1, keepdims=True)
+    ests = ests - np.mean(ests, axis=-1, keepdims=True)
+    scale = np.sum(refs * ests, axis=-1, keepdims=True) / (
+        np.sum(refs ** 2, axis=-1, keepdims=True) + eps)
+    s_target = scale * refs
+    e_noise = ests - s_target
+    return _db(
+        np.sum(s_target ** 2, axis=-1), np.sum(e_noise ** 2, axis=-1), eps)
+
+
+def bss_eval(refs, ests, target_idx, filter_len=512, eps=1e-8):
+    '''
+    SDR, SIR and SAR of estimates, batched
+
+    Args:
+        refs: array of shape [batch_size, num_refs, length]
+        ests: array of shape [batch_size, num_ests, length]
+        target_idx: integer array of shape [num_ests],
+            which reference each estimate is scored against
+        filter_len: integer, length of distortion filters
+        eps: float, regularizes projections of silent references
+
+    Returns:
+        (sdr, sir, sar), each array of shape [batch_size, num_ests], in dB
+    '''
+    batch_size, num_refs, length = refs.shape
+    num_ests = ests.shape[1]
+    L = filter_len
+    out_len = length + L - 1
+    n_fft = 1 << int(np.ceil(np.log2(out_len)))
+    target_idx = np.asarray(target_idx)
+
+    R = np.fft.rfft(refs, n=n_fft)  # [B, R, F]
+    E = np.fft.rfft(ests, n=n_fft)  # [B, E, F]
+
+    # xcorr[i, j, k] = sum_t r_i(t) * r_j(t+k), negative k wraps around
+    rr_corr = np.fft.irfft(
+        np.conj(R)[:, :, None] * R[:, None], n=n_fft)  # [B, R, R, n_fft]
+    re_corr = np.fft.irfft(
+        np.conj(R)[:, :, None] * E[:, None], n=n_fft)  # [B, R, E, n_fft]
+
+    # Gram matrix of references delayed by 0..L-1 samples
+    # <r_i(t-a), r_j(t-b)> = xcorr[i, j, a-b]
+    lag = (np.arange(L)[:, None] - np.arange(L)[None, :]) % n_fft
+    G = rr_corr[:, :, :, lag]  # [B, R, R, L, L]
+    G = np.transpose(G, [0, 1, 3, 2, 4]).reshape(
+        batch_size, num_refs * L, num_refs * L)
+    # <r_i(t-a), e_j(t)> = xcorr[i, j, a]
+    D = re_corr[:, :, :, :L]  # [B, R, E, L]
+    D = np.transpose(D, [0, 1, 3, 2]).reshape(
+        batch_size, num_refs * L, num_ests)
+
+    def ridge(G):
+        scale = np.trace(G, axis1=-2, axis2=-1)[..., None, None] / G.shape[-1]
+        return G + (eps * scale + eps) * np.eye(G.shape[-1])
+
+    # projection onto all references
+    coef_all = np.linalg.solve(ridge(G), D)  # [B, R*L, E]
+    coef_all = coef_all.reshape(batch_size, num_refs, L, num_ests)
+    P_all = np.einsum(
+        'bref,brf->bef',
+        np.fft.rfft(coef_all, n=n_fft, axis=2).transpose([0, 1, 3, 2]), R)
+    p_all = np.fft.irfft(P_all, n=n_fft)[..., :out_len]
+
+    # projection onto target reference only, diagonal blocks of G
+    G_tgt = rr_corr[:, target_idx, target_idx][:, :, lag]  # [B, E, L, L]
+    D_tgt = re_corr[:, target_idx, np.arange(num_ests), :L]  # [B, E, L]
+    coef_tgt = np.linalg.solve(ridge(G_tgt), D_tgt[..., None])[..., 0]
+    s_target = np.fft.irfft(
+        np.fft.rfft(coef_tgt, n=n_fft) * R[:, target_idx],
+        n=n_fft)[..., :out_len]
+
+    ests_pad = np.pad(ests, [(0, 0), (0, 0), (0, L - 1)], mode='constant')
+    e_interf = p_all - s_target
+    e_artif = ests_pad - p_all
+
+    energy = lambda x: np.sum(x ** 2, axis=-1)
+    sdr = _db(energy(s_target), energy(e_interf + e_artif), eps)
+    sir = _db(energy(s_target), energy(e_interf), eps)
+    sar = _db(energy(s_target + e_interf), energy(e_artif), eps)
+    return sdr, sir, sar
+
+
+def evaluate_batch(
+        src_spectra, sep_spectra, utt_offset, stride, window, filter_len=512):
+    '''
+    Reconstructs waveforms of a batch, then scores separated signals
+    and unprocessed mixture against sources
+
+    This runs in worker processes, so STFT settings are passed
+    explicitly instead of read from hparams.
+
+    Args:
+        src_spectra: complex array of shape
+            [batch_size, num_signals, length, feature_size]
+        sep_spectra: complex array of same shape as `src_spectra`,
+            separated signals in same order as sources
+        utt_offset: integer, index of first utterance in batch
+        stride: integer, STFT stride
+        window: 1D array, STFT window
+        filter_len: integer, length of BSS-eval distortion filters
+
+    Returns:
+        list of dict, one row per utterance and source
+    '''
+    batch_size, num_signals = src_spectra.shape[:2]
+    to_wav = lambda spectra: utils.istft(
+        spectra.reshape((-1,) + spectra.shape[2:]),
+        stride, window).reshape(batch_size, num_signals, -1)
+    refs = to_wav(src_spectra)
+    ests = to_wav(sep_spectra)
+    mixture = np.sum(refs, axis=1, keepdims=True)
+
+    # separated signals, then mixture scored against each source
+    all_ests = np.concatenate(
+        [ests, np.repeat(mixture, num_signals, axis=1)], axis=1)
+    target_idx = np.tile(np.arange(num_signals), 2)
+    sdr, sir, sar = bss_eval(refs, all_ests, target_idx, filter_len)
+    snr = si_snr(refs[:, target_idx], all_ests)
+
+    rows = []
+    for i in range(batch_size):
+        for j in range(num_signals):
+            k = num_signals + j
+            rows.append(dict(
+                utt=utt_offset + i, src=j,
+                sdr=float(sdr[i, j]), sir=float(sir[i, j]),
+                sar=float(sar[i, j]), si_snr=float(snr[i, j]),
+                sdr_i=float(sdr[i, j] - sdr[i, k]),
+                si_snr_i=float(snr[i, j] - snr[i, k])))
+    return rows
+
+
+def aggregate(rows):
+    '''
+    Returns:
+        dict, mean and median of each metric over rows
+    '''
+    result = {}
+    for key in METRICS:
+        values = np.asarray([r[key] for r in rows])
+        result[key + '_mean'] = float(np.mean(values))
+        result[key + '_median'] = float(np.median(values))
+    result['num_utt'] = len({r['utt'] for r in rows})
+    return result
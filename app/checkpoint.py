@@ -0,0 +1,301 @@
+'''
+Checkpoint writing off the training loop, with retention policy
+'''
+import os
+import re
+import glob
+import json
+import random
+import threading
+from queue import Queue
+
+import numpy as np
+import tensorflow as tf
+
+
+MANIFEST_FILE = 'checkpoints.json'
+# suffix of JSON file holding training loop state, next to checkpoint files
+STATE_SUFFIX = '.state.json'
+# names of checkpoints done by evaluator process
+EVALUATED_FILE = 'evaluated.json'
+# created once training is over, no more checkpoints to come
+DONE_FILE = 'training.done'
+# checkpoints saved at end of each epoch, which the evaluator validates
+EPOCH_CHECKPOINT_RE = re.compile(r'.*_e\d+$')
+
+
+def _checkpoint_files(prefix):
+    return glob.glob(glob.escape(prefix) + '.*')
+
+
+def get_rng_state():
+    '''
+    Returns:
+        JSON serializable state of numpy and python RNGs
+    '''
+    np_state = np.random.get_state()
+    py_state = random.getstate()
+    return dict(
+        numpy=[np_state[0], np_state[1].tolist()] + list(np_state[2:]),
+        python=[py_state[0], list(py_state[1]), py_state[2]])
+
+
+def set_rng_state(state):
+    '''
+    Args:
+        state: as returned by get_rng_state()
+    '''
+    np_state = state['numpy']
+    np.random.set_state((
+        np_state[0], np.asarray(np_state[1], dtype=np.uint32)
+        ) + tuple(np_state[2:]))
+    py_state = state['python']
+    random.setstate((py_state[0], tuple(py_state[1]), py_state[2]))
+
+
+def _read_json(filename, default):
+    if not os.path.exists(filename):
+        return default
+    with open(filename, 'r') as f:
+        return json.load(f)
+
+
+def _write_json(filename, obj):
+    tmp_file = filename + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(obj, f, indent=2)
+    os.replace(tmp_file, filename)
+
+
+def latest_checkpoint(save_dir):
+    '''
+    Returns:
+        string, prefix of most recent checkpoint in manifest of
+        `save_dir`, or None
+    '''
+    manifest = _read_json(os.path.join(save_dir, MANIFEST_FILE), [])
+    if not manifest:
+        return None
+    return os.path.join(save_dir, manifest[-1]['name'])
+
+
+def read_evaluated(save_dir):
+    '''
+    Returns:
+        set of checkpoint names already validated by evaluator
+    '''
+    return set(_read_json(os.path.join(save_dir, EVALUATED_FILE), []))
+
+
+def mark_evaluated(save_dir, name):
+    evaluated = read_evaluated(save_dir)
+    evaluated.add(name)
+    _write_json(
+        os.path.join(save_dir, EVALUATED_FILE), sorted(evaluated))
+
+
+def pending_evaluation(save_dir):
+    '''
+    Returns:
+        list of epoch checkpoint names not validated yet, oldest first
+    '''
+    evaluated = read_evaluated(save_dir)
+    manifest = _read_json(os.path.join(save_dir, MANIFEST_FILE), [])
+    return [
+        e['name'] for e in manifest
+        if EPOCH_CHECKPOINT_RE.match(e['name'])
+        and e['name'] not in evaluated]
+
+
+def load_state(prefix):
+    '''
+    Returns:
+        dict, training loop state saved with checkpoint, or None
+    '''
+    state_file = prefix + STATE_SUFFIX
+    if not os.path.exists(state_file):
+        return None
+    with open(state_file, 'r') as f:
+        return json.load(f)
+
+
+class AsyncCheckpointer(object):
+    '''
+    Saves checkpoints in a background thread
+
+    `save()` only fetches current variable values, the values are then
+    written by a private session, as a regular TF checkpoint loadable with
+    `Model.load_params`. Files are first written under a temporary prefix,
+    then renamed, index file last, so a checkpoint is either complete or
+    not visible at all.
+
+    Checkpoints are tracked in "checkpoints.json" in `save_dir`. After
+    each save, only the `keep_last` most recent ones and the `keep_best`
+    ones with lowest metric are kept, others are deleted. `keep_last`
+    applies to epoch checkpoints (see EPOCH_CHECKPOINT_RE) and other
+    ones separately, so frequent step checkpoints don't evict epoch ones.
+
+    Optional training loop state is written as JSON next to the
+    checkpoint, see `load_state()`.
+
+    Args:
+        var_list: list of tf.Variable to save
+        save_dir: string, directory of checkpoints
+        keep_last: integer, or None to keep all
+        keep_best: integer, or None to keep all
+        max_pending: integer, `save()` blocks when this many
+            checkpoints are waiting to be written
+        protect: None or function (name -> bool), checkpoints it returns
+            true for are never deleted by retention
+    '''
+    def __init__(
+            self, var_list, save_dir,
+            keep_last=None, keep_best=None, max_pending=1, protect=None):
+        self.var_list = var_list
+        self.save_dir = save_dir
+        self.keep_last = keep_last
+        self.keep_best = keep_best
+        self.protect = protect
+        if not os.path.exists(save_dir):
+            os.makedirs(save_dir)
+        self.manifest_file = os.path.join(save_dir, MANIFEST_FILE)
+        self.manifest = _read_json(self.manifest_file, [])
+
+        # shadow variables in a private graph, so writing doesn't touch
+        # the training session
+        self.graph = tf.Graph()
+        with self.graph.as_default(), tf.device('/cpu:0'):
+            self.assign_ops = []
+            self.placeholders = []
+            shadow_vars = {}
+            for v in var_list:
+                dtype = v.dtype.base_dtype
+                shape = v.get_shape()
+                s_value = tf.placeholder(dtype, shape)
+                v_shadow = tf.Variable(
+                    tf.zeros(shape, dtype=dtype), name=v.op.name)
+                shadow_vars[v.op.name] = v_shadow
+                self.placeholders.append(s_value)
+                self.assign_ops.append(tf.assign(v_shadow, s_value))
+            self.saver = tf.train.Saver(
+                var_list=shadow_vars, max_to_keep=None)
+        self.sess = tf.Session(
+            graph=self.graph,
+            config=tf.ConfigProto(
+                device_count={'CPU': 1},
+                intra_op_parallelism_threads=1,
+                inter_op_parallelism_threads=1))
+
+        self.queue = Queue(maxsize=max_pending)
+        self.error = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                break
+            try:
+                self._write(*item)
+            except Exception as e:
+                self.error = e
+            self.queue.task_done()
+
+    def _write(self, name, values, metric, state):
+        self.sess.run(
+            self.assign_ops, dict(zip(self.placeholders, values)))
+        prefix = os.path.join(self.save_dir, name)
+        tmp_prefix = os.path.join(self.save_dir, '.tmp-' + name)
+        self.saver.save(
+            self.sess, tmp_prefix,
+            write_meta_graph=False, write_state=False)
+        if state is not None:
+            with open(tmp_prefix + STATE_SUFFIX, 'w') as f:
+                json.dump(state, f)
+        tmp_files = sorted(
+            _checkpoint_files(tmp_prefix),
+            key=lambda f: f.endswith('.index'))
+        for tmp_file in tmp_files:
+            os.replace(tmp_file, prefix + tmp_file[len(tmp_prefix):])
+
+        self.manifest = [e for e in self.manifest if e['name'] != name]
+        self.manifest.append(dict(name=name, metric=metric))
+        self._apply_retention()
+
+    def _apply_retention(self):
+        keep = set()
+        for is_epoch in (True, False):
+            names = [
+                e['name'] for e in self.manifest
+                if bool(EPOCH_CHECKPOINT_RE.match(e['name'])) == is_epoch]
+            if self.keep_last is not None:
+                names = names[max(0, len(names) - self.keep_last):]
+            keep.update(names)
+        rated = [e for e in self.manifest if e['metric'] is not None]
+        if self.keep_best is None:
+            keep.update(e['name'] for e in rated)
+        else:
+            rated.sort(key=lambda e: e['metric'])
+            keep.update(e['name'] for e in rated[:self.keep_best])
+        if self.protect is not None:
+            keep.update(
+                e['name'] for e in self.manifest if self.protect(e['name']))
+        for e in self.manifest:
+            if e['name'] not in keep:
+                for f in _checkpoint_files(
+                        os.path.join(self.save_dir, e['name'])):
+                    os.remove(f)
+        self.manifest = [e for e in self.manifest if e['name'] in keep]
+        _write_json(self.manifest_file, self.manifest)
+
+    def save(self, sess, name, metric=None, state=None):
+        '''
+        Snapshots variables, then returns while they are written
+
+        Args:
+            sess: tf.Session holding variables
+            name: string, file prefix of checkpoint within save_dir
+            metric: None or float, lower is better, for keep_best
+            state: None or JSON serializable dict, written along
+        '''
+        if self.error is not None:
+            raise self.error
+        values = sess.run(self.var_list)
+        self.queue.put((name, values, metric, state))
+
+    def wait(self):
+        '''
+        Blocks until pending checkpoints are written
+        '''
+        self.queue.join()
+        if self.error is not None:
+            raise self.error
+
+    def latest(self, name_re=None):
+        '''
+        Args:
+            name_re: None or compiled regex, only consider checkpoints
+                with matching name, such as EPOCH_CHECKPOINT_RE
+
+        Returns:
+            string, prefix of most recent written checkpoint, or None
+        '''
+        self.wait()
+        names = [
+            e['name'] for e in self.manifest
+            if name_re is None or name_re.match(e['name'])]
+        if not names:
+            return None
+        return os.path.join(self.save_dir, names[-1])
+
+    def close(self):
+        '''
+        Writes pending checkpoints, then stops background thread
+        '''
+        self.queue.put(None)
+        self.thread.join()
+        self.sess.close()
+        if self.error is not None:
+            raise self.error
@@ -0,0 +1,174 @@
+'''
+Separation of arbitrarily long recordings in overlapping chunks
+
+Each chunk of STFT frames is separated independently, so memory only
+depends on chunk length. The order of separated signals is arbitrary
+per chunk, so every chunk is permuted to match the previous one by
+similarity within the frames they share, then the shared frames are
+cross-faded.
+'''
+import struct
+from itertools import permutations
+
+import numpy as np
+
+import app.batch_infer as batch_infer
+
+
+def iter_windows(blocks, chunk_frames, overlap):
+    '''
+    Cuts a stream of frame blocks into overlapping windows
+
+    Args:
+        blocks: iterable of arrays of shape [length, feature_size]
+        chunk_frames: integer, frames per window
+        overlap: integer, frames shared by consecutive windows,
+            at least 1 so separated signals can be aligned
+
+    Yields:
+        (window, is_last), window being array of shape
+        [chunk_frames, feature_size], last one may be shorter,
+        but still longer than `overlap` unless it is the only one
+    '''
+    assert 0 < overlap < chunk_frames
+    hop = chunk_frames - overlap
+    buf = None
+    for block in blocks:
+        buf = block if buf is None else np.concatenate([buf, block])
+        # next window exists only if there are frames past this one
+        while len(buf) > chunk_frames:
+            yield buf[:chunk_frames], False
+            buf = buf[hop:]
+    if buf is not None:
+        yield buf, True
+
+
+def align_permutation(prev, cur, eps=1e-8):
+    '''
+    Finds order of signals in `cur` most similar to `prev`
+
+    Args:
+        prev: complex array of shape [num_signals, length, feature_size]
+        cur: complex array of same shape as `prev`
+
+    Returns:
+        integer array of shape [num_signals], `cur[perm]` matches `prev`
+    '''
+    num_signals = len(prev)
+    a = np.abs(prev).reshape(num_signals, -1)
+    b = np.abs(cur).reshape(num_signals, -1)
+    a = a / (np.linalg.norm(a, axis=-1, keepdims=True) + eps)
+    b = b / (np.linalg.norm(b, axis=-1, keepdims=True) + eps)
+    sim = np.dot(a, b.T)
+    perms = list(permutations(range(num_signals)))
+    scores = [sim[range(num_signals), perm].sum() for perm in perms]
+    return np.asarray(perms[int(np.argmax(scores))])
+
+
+class ChunkStitcher(object):
+    '''
+    Joins separated windows given by `iter_windows` order into a
+    continuous stream, with permutation alignment and linear cross-fade
+    over the overlapping frames
+
+    Args:
+        overlap: integer, same as given to `iter_windows`
+    '''
+    def __init__(self, overlap):
+        self.overlap = overlap
+        self.fade_in = ((np.arange(overlap) + .5) / overlap)[:, None]
+        self.tail = None
+
+    def push(self, signals, is_last=False):
+        '''
+        Args:
+            signals: complex array of shape
+                [num_signals, length, feature_size], separated window
+            is_last: bool
+
+        Returns:
+            complex array of shape [num_signals, num_frames, feature_size],
+            frames that are final, following previous ones
+        '''
+        ov = self.overlap
+        if self.tail is not None:
+            signals = signals[align_permutation(self.tail, signals[:, :ov])]
+            head = (
+                self.tail * (1. - self.fade_in) +
+                signals[:, :ov] * self.fade_in)
+            signals = np.concatenate(
+                [head.astype(signals.dtype), signals[:, ov:]], axis=1)
+        if is_last:
+            self.tail = None
+            return signals
+        self.tail = signals[:, len(signals[0]) - ov:]
+        return signals[:, :len(signals[0]) - ov]
+
+
+def separate_stream(
+        run_batch, blocks, chunk_frames, overlap, batch_size, length_align):
+    '''
+    Separates a stream of mixture frames chunk by chunk
+
+    Args:
+        run_batch: function, takes mixture batch of shape
+            [batch_size, length, feature_size] and valid frames of each
+            row, as given by `batch_infer.batch_lengths`, returns
+            separated batch of shape
+            [batch_size, num_signals, length, feature_size]
+        blocks: iterable of arrays of shape [length, feature_size],
+            such as given by `utils.stream_wavfile`
+        chunk_frames: integer, frames separated at once
+        overlap: integer, frames shared by consecutive chunks
+        batch_size: integer, chunks are run this many at once
+        length_align: integer, see `batch_infer.pad_batch`
+
+    Yields:
+        complex arrays of shape [num_signals, num_frames, feature_size],
+        separated frames in order
+    '''
+    stitcher = ChunkStitcher(overlap)
+    pending = []
+    for window, is_last in iter_windows(blocks, chunk_frames, overlap):
+        pending.append(window)
+        if len(pending) < batch_size and not is_last:
+            continue
+        batch = batch_infer.pad_batch(pending, batch_size, length_align)
+        signals = run_batch(
+            batch, batch_infer.batch_lengths(pending, batch))
+        for i, x in enumerate(pending):
+            yield stitcher.push(
+                signals[i, :, :len(x)],
+                is_last=is_last and i == len(pending) - 1)
+        pending = []
+
+
+class WavWriter(object):
+    '''
+    Writes a float32 WAV file incrementally, sizes in header are
+    filled in by `close()`
+
+    Args:
+        filename: string
+        smprate: integer
+    '''
+    def __init__(self, filename, smprate):
+        self.file = open(filename, 'wb')
+        self.num_bytes = 0
+        # RIFF header, "fmt " chunk of IEEE float mono, then "data" chunk
+        self.file.write(struct.pack(
+            '<4sI4s4sIHHIIHH4sI',
+            b'RIFF', 0, b'WAVE', b'fmt ', 16, 3, 1,
+            smprate, smprate * 4, 4, 32, b'data', 0))
+
+    def write(self, data):
+        data = np.asarray(data, dtype='<f4')
+        self.file.write(data.tobytes())
+        self.num_bytes += data.nbytes
+
+    def close(self):
+        self.file.seek(4)
+        self.file.write(struct.pack('<I', 36 + self.num_bytes))
+        self.file.seek(40)
+        self.file.write(struct.pack('<I', self.num_bytes))
+        self.file.close()
@@ -0,0 +1,91 @@
+'''
+Between-graph replicated training over a tf.train.ClusterSpec
+
+Every worker process builds its own copy of the model graph under
+`device_setter()`, variables live on parameter servers.
+'''
+import tensorflow as tf
+
+
+def make_cluster(ps_hosts, worker_hosts):
+    '''
+    Args:
+        ps_hosts: string, comma separated list of "host:port"
+        worker_hosts: string, comma separated list of "host:port"
+
+    Returns:
+        tf.train.ClusterSpec
+    '''
+    if not ps_hosts or not worker_hosts:
+        raise ValueError(
+            'Both --ps-hosts and --worker-hosts must be given'
+            ' for distributed training.')
+    return tf.train.ClusterSpec(dict(
+        ps=ps_hosts.split(','),
+        worker=worker_hosts.split(',')))
+
+
+def worker_device(task_index):
+    return '/job:worker/task:%d' % task_index
+
+
+def device_setter(cluster, task_index):
+    '''
+    Places variables on parameter servers round-robin,
+    other ops on this worker
+    '''
+    return tf.train.replica_device_setter(
+        worker_device=worker_device(task_index),
+        cluster=cluster)
+
+
+def create_session(server, model, is_chief, config=None, restore_file=None):
+    '''
+    Creates a session on the cluster, chief initializes variables
+    (optionally restoring parameters), other workers wait for it.
+
+    Args:
+        server: tf.train.Server of this worker
+        model: Model instance, already built
+        is_chief: bool
+        config: tf.ConfigProto or None
+        restore_file: string or None, parameter file restored by chief
+
+    Returns:
+        tf.Session
+    '''
+    ozer = model.ozer
+    is_sync = isinstance(ozer, tf.train.SyncReplicasOptimizer)
+    op_local_init = tf.local_variables_initializer()
+    s_ready_for_local_init = None
+    if is_sync:
+        # local step of sync optimizer is a local variable,
+        # set it after generic local init
+        with tf.control_dependencies([op_local_init]):
+            op_local_init = tf.group(
+                ozer.chief_init_op if is_chief else ozer.local_step_init_op)
+        s_ready_for_local_init = ozer.ready_for_local_init_op
+        if is_chief:
+            op_init_tokens = ozer.get_init_tokens_op()
+            chief_queue_runner = ozer.get_chief_queue_runner()
+
+    sess_manager = tf.train.SessionManager(
+        local_init_op=op_local_init,
+        ready_op=tf.report_uninitialized_variables(),
+        ready_for_local_init_op=s_ready_for_local_init)
+    if is_chief:
+        init_fn = None
+        if restore_file is not None:
+            init_fn = lambda sess: model.saver.restore(sess, restore_file)
+        sess = sess_manager.prepare_session(
+            server.target,
+            init_op=tf.global_variables_initializer(),
+            init_fn=init_fn,
+            config=config)
+        if is_sync:
+            sess.run(op_init_tokens)
+            chief_queue_runner.create_threads(
+                sess, coord=tf.train.Coordinator(), daemon=True, start=True)
+    else:
+        sess = sess_manager.wait_for_session(server.target, config=config)
+    return sess
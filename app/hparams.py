@@ -37,6 +37,31 @@ class Hyperparameter:
         self.FEATURE_SIZE = 1 + self.FFT_SIZE // 2
         assert isinstance(self.DROPOUT_KEEP_PROB, float)
         assert 0. < self.DROPOUT_KEEP_PROB <= 1.
+        assert isinstance(self.GRAD_ACCUM_STEPS, int)
+        assert self.GRAD_ACCUM_STEPS >= 1
+        assert isinstance(self.NUM_REPLICA, int)
+        assert self.NUM_REPLICA >= 1
+        assert isinstance(self.SUMMARY_STEPS, int)
+        assert self.SUMMARY_STEPS >= 1
+        assert self.SUMMARY_QUEUE_SIZE >= 1
+        assert isinstance(self.TELEMETRY_STEPS, int)
+        assert self.TELEMETRY_STEPS >= 1
+        for keep in (self.SAVE_KEEP_LAST, self.SAVE_KEEP_BEST):
+            assert keep is None or (isinstance(keep, int) and keep >= 0)
+        assert self.SAVE_STEPS is None or (
+            isinstance(self.SAVE_STEPS, int) and self.SAVE_STEPS >= 1)
+        assert self.INTRA_OP_THREADS >= 0
+        assert self.INTER_OP_THREADS >= 0
+        assert self.GRAPH_OPT_LEVEL in ('L0', 'L1')
+        assert isinstance(self.WAVEFORM_INFER, bool)
+        assert isinstance(self.STREAM_INFER, bool)
+        assert self.INFER_CACHE_MAX_MB > 0
+        assert self.INFER_CACHE_MEMORY_MB >= 0
+        assert isinstance(self.QUANT_TABLE, (str, type(None)))
+        assert isinstance(self.XLA_JIT, (str, type(None)))
+        if self.XLA_JIT not in (None, 'global'):
+            from app.runtime import JIT_SCOPES
+            assert set(self.XLA_JIT.split(',')) <= set(JIT_SCOPES)
 
         # FIXME: security concern by using eval?
         self.FFT_WND = eval(self.FFT_WND)
@@ -195,6 +220,8 @@ NUM_ANCHOR = 6
 ENCODER_TYPE = 'toy'
 # SEPARATOR_TYPE options:
 #   dot-orig
+#   dot-sigmoid-fused
+#   dot-softmax-fused
 SEPARATOR_TYPE = 'dot-sigmoid-orig'
 # OPTIMIZER_TYPE options:
 #   adam
@@ -0,0 +1,184 @@
+'''
+Cache of separation results, keyed by content hash of input spectra,
+model checkpoint and hyperparameters affecting inference
+
+Results are kept in two LRU tiers: a small in-memory one in front of a
+larger on-disk one. Disk entries are ".npy" files, their modification
+time is used as last access time, so the disk tier survives restarts.
+'''
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+# hyperparameters that change what inference returns for same input
+KEY_HPARAMS = (
+    'FLOATX', 'FFT_SIZE', 'FFT_STRIDE', 'SMPRATE', 'MAX_N_SIGNAL',
+    'LENGTH_ALIGN', 'EMBED_SIZE', 'NUM_ANCHOR', 'ENCODER_TYPE',
+    'SEPARATOR_TYPE', 'TRAIN_ESTIMATOR_METHOD', 'INFER_ESTIMATOR_METHOD')
+
+
+def model_key(checkpoint, hparams):
+    '''
+    Args:
+        checkpoint: string, prefix of checkpoint parameters are loaded from
+        hparams: hyperparameters object, its QUANT_TABLE file is hashed
+            too if given
+
+    Returns:
+        string, hex digest identifying model and its inference setup
+    '''
+    h = hashlib.sha256()
+    # index file holds checksums of all tensors
+    index_file = checkpoint + '.index'
+    with open(index_file if os.path.exists(index_file) else checkpoint,
+              'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    h.update(json.dumps(
+        {k: getattr(hparams, k) for k in KEY_HPARAMS},
+        sort_keys=True).encode('utf-8'))
+    h.update(np.asarray(hparams.FFT_WND).tobytes())
+    if hparams.QUANT_TABLE is not None:
+        with open(hparams.QUANT_TABLE, 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+class InferenceCache(object):
+    '''
+    Thread-safe two-tier LRU cache of arrays
+
+    Args:
+        cache_dir: string, directory of disk tier
+        model_key: string, as returned by `model_key()`
+        max_disk_bytes: integer, least recently used files are deleted
+            beyond this total size
+        max_memory_bytes: integer, size of in-memory tier
+    '''
+    def __init__(
+            self, cache_dir, model_key,
+            max_disk_bytes=1 << 30, max_memory_bytes=1 << 27):
+        self.cache_dir = cache_dir
+        self.model_key = model_key
+        self.max_disk_bytes = max_disk_bytes
+        self.max_memory_bytes = max_memory_bytes
+        self.lock = threading.Lock()
+        self.memory = OrderedDict()
+        self.memory_bytes = 0
+        self.stats = dict(
+            memory_hits=0, disk_hits=0, misses=0,
+            memory_evictions=0, disk_evictions=0)
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir, exist_ok=True)
+        # existing disk entries, least recently used first
+        entries = []
+        for name in os.listdir(cache_dir):
+            if not name.endswith('.npy'):
+                continue
+            st = os.stat(os.path.join(cache_dir, name))
+            entries.append((st.st_mtime, name[:-4], st.st_size))
+        entries.sort()
+        self.disk = OrderedDict((key, size) for _, key, size in entries)
+        self.disk_bytes = sum(self.disk.values())
+
+    def key(self, spectra):
+        '''
+        Returns:
+            string, hex digest of input spectra and model
+        '''
+        spectra = np.ascontiguousarray(spectra)
+        h = hashlib.sha256(self.model_key.encode('ascii'))
+        h.update(str((spectra.dtype.str, spectra.shape)).encode('ascii'))
+        h.update(spectra.data)
+        return h.hexdigest()
+
+    def _filename(self, key):
+        return os.path.join(self.cache_dir, key + '.npy')
+
+    def _put_memory(self, key, value):
+        if value.nbytes > self.max_memory_bytes:
+            return
+        if key in self.memory:
+            self.memory_bytes -= self.memory.pop(key).nbytes
+        self.memory[key] = value
+        self.memory_bytes += value.nbytes
+        while self.memory_bytes > self.max_memory_bytes:
+            _, old = self.memory.popitem(last=False)
+            self.memory_bytes -= old.nbytes
+            self.stats['memory_evictions'] += 1
+
+    def get(self, key):
+        '''
+        Returns:
+            cached array, or None
+        '''
+        with self.lock:
+            value = self.memory.get(key)
+            if value is not None:
+                self.memory.move_to_end(key)
+                self.stats['memory_hits'] += 1
+                return value
+            if key not in self.disk:
+                self.stats['misses'] += 1
+                return None
+            self.disk.move_to_end(key)
+        try:
+            value = np.load(self._filename(key))
+            os.utime(self._filename(key))
+        except (IOError, ValueError):
+            # deleted or truncated by another process
+            with self.lock:
+                self.disk_bytes -= self.disk.pop(key, 0)
+                self.stats['misses'] += 1
+            return None
+        with self.lock:
+            self.stats['disk_hits'] += 1
+            self._put_memory(key, value)
+        return value
+
+    def put(self, key, value):
+        '''
+        Args:
+            key: string, as returned by `key()`
+            value: array
+        '''
+        value = np.ascontiguousarray(value)
+        filename = self._filename(key)
+        tmp_file = os.path.join(
+            self.cache_dir, '.tmp-%d-%d-%s' % (
+                os.getpid(), threading.get_ident(), key))
+        with open(tmp_file, 'wb') as f:
+            np.save(f, value)
+        size = os.path.getsize(tmp_file)
+        os.replace(tmp_file, filename)
+        with self.lock:
+            self._put_memory(key, value)
+            self.disk_bytes += size - self.disk.pop(key, 0)
+            self.disk[key] = size
+            while self.disk_bytes > self.max_disk_bytes and len(self.disk) > 1:
+                old_key, old_size = self.disk.popitem(last=False)
+                self.disk_bytes -= old_size
+                self.stats['disk_evictions'] += 1
+                try:
+                    os.remove(self._filename(old_key))
+                except OSError:
+                    pass
+
+    def report(self):
+        '''
+        Returns:
+            dict, JSON serializable hit / miss counts and tier sizes
+        '''
+        with self.lock:
+            result = dict(self.stats)
+            result.update(
+                memory_items=len(self.memory),
+                memory_bytes=self.memory_bytes,
+                disk_items=len(self.disk),
+                disk_bytes=self.disk_bytes)
+            return result
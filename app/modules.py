@@ -1,5 +1,6 @@
 from math import sqrt
 from functools import partial
+import itertools
 
 import numpy as np
 import tensorflow as tf
@@ -29,6 +30,8 @@ class Encoder(ModelModule):
     '''
     maps log-magnitude-spectra to embedding
     '''
+    CAN_STREAM=False  # set this to true if it accepts "stream"
+    CAN_MASK=False  # set this to true if it accepts "s_lengths"
     def __init__(self, model, name):
         super(Encoder, self).__init__(model, name)
 
@@ -41,6 +44,13 @@ class Encoder(ModelModule):
             s_dropout_keep: scalar const or variable
                 keep probability for dropout layer
 
+            stream: bool, only if CAN_STREAM, treat input as next block
+                of each stream, carrying state in Model.stream_state
+
+            s_lengths: only if CAN_MASK, int tensor of shape [batch_size],
+                frames past it are zero padding, which must not change
+                output of valid frames
+
         Returns:
             [batch_size, length, feature_size, embedding_size]
 
@@ -56,6 +66,8 @@ class Estimator(ModelModule):
     or true source
     '''
     USE_TRUTH=True  # set this to true if it uses ground truth
+    CAN_STREAM=False  # set this to true if it accepts "stream"
+    CAN_MASK=False  # set this to true if it accepts "s_lengths"
     def __init__(self, model, name):
         super(Estimator, self).__init__(model, name)
 
@@ -63,6 +75,8 @@ class Estimator(ModelModule):
         '''
         Args:
             s_embed: tensor of shape [batch_size, length, feature_size, embedding_size]
+            s_lengths: only if CAN_MASK, int tensor of shape [batch_size],
+                embedding of frames past it is ignored
 
         Returns:
             s_attractors: tensor of shape [batch_size, num_signals, embedding_size]
@@ -75,6 +89,7 @@ class Separator(ModelModule):
     Given mixture power spectra, attractors, and embedding,
     produce power spectra of separated signals
     '''
+    CAN_RETURN_MASKS=False  # set this to true if it accepts "masks_only"
     def __init__(self, model, name):
         super(Separator, self).__init__(model, name)
 
@@ -89,6 +104,9 @@ class Separator(ModelModule):
 
             s_embed_flat:
                 tensor of shape [batch_size, num_signals, length, feature_size]
+
+        Returns:
+            tensor of shape [batch_size, num_signals, length, feature_size]
         '''
         raise NotImplementedError()
 
@@ -97,11 +115,14 @@ class Separator(ModelModule):
 class ToyEncoder(Encoder):
     '''
     This encoder is a 3 layer MLP for debugging purposes
+
+    Frames are encoded independently, so padding doesn't matter.
     '''
+    CAN_MASK = True
     def __init__(self, model, name):
         super(ToyEncoder, self).__init__(model, name)
 
-    def __call__(self, s_signals, s_dropout_keep=1.):
+    def __call__(self, s_signals, s_dropout_keep=1., s_lengths=None):
         with tf.variable_scope(self.name):
             s_mid = ops.lyr_linear(
                 'linear0', s_signals, hparams.FFT_SIZE*2, axis=-1)
@@ -122,18 +143,25 @@ def _lyr_bilstm(
         s_input_, hdim_,
         t_axis_, axis_,
         w_init_, b_init_,
-        s_dropout_keep_):
+        s_dropout_keep_, s_lengths_=None):
     ndim = len(s_input_.get_shape().as_list())
     t_axis_ %= ndim
-    rev_signal = (slice(None),)*t_axis_ + (slice(None, None, -1),)
+    if s_lengths_ is None:
+        rev_signal = (slice(None),)*t_axis_ + (slice(None, None, -1),)
+        fn_reverse = lambda s_x: s_x[rev_signal]
+    else:
+        # only valid frames are reversed, so backward pass starts at
+        # last valid frame, padding stays at the end
+        fn_reverse = lambda s_x: tf.reverse_sequence(
+            s_x, s_lengths_, seq_axis=t_axis_, batch_axis=0)
     s_output_fwd = model_.lyr_lstm(
         name_+'_fwd', s_input_, hdim_,
         t_axis=t_axis_, w_init=w_init_, b_init=b_init_)
     s_output_bwd = model_.lyr_lstm(
-        name_+'_bwd', s_input_[rev_signal], hdim_,
+        name_+'_bwd', fn_reverse(s_input_), hdim_,
         t_axis=t_axis_, w_init=w_init_, b_init=b_init_)
     s_output = tf.concat(
-        [s_output_fwd, s_output_bwd[rev_signal]], axis=axis_)
+        [s_output_fwd, fn_reverse(s_output_bwd)], axis=axis_)
     return tf.nn.dropout(s_output, keep_prob=s_dropout_keep_)
 
 
@@ -141,14 +169,54 @@ def _lyr_bilstm(
 class LstmEncoder(Encoder):
     '''
     LSTM network as in original paper
+
+    In streaming mode, means are taken over all frames of the stream
+    so far instead of whole utterance. With frame lengths given, means
+    are taken over valid frames only, LSTM is causal so padding at the
+    end doesn't reach valid frames.
     '''
+    CAN_STREAM = True
+    CAN_MASK = True
     def __init__(self, model, name):
         super(LstmEncoder, self).__init__(model, name)
 
-    def __call__(self, s_signals, s_dropout_keep=1.):
+    def _mean(self, name, s_x, stream, s_mask=None):
+        '''
+        Mean over time and feature axes, keeps dims
+
+        Args:
+            s_mask: None or tensor of shape [batch_size, length],
+                as given by ops.frame_mask, mean of valid frames only
+        '''
+        if s_mask is not None:
+            s_mask = tf.expand_dims(s_mask, -1)
+            s_count = tf.reduce_sum(s_mask, axis=(1,2), keep_dims=True) * (
+                tf.cast(tf.shape(s_x)[2], hparams.FLOATX))
+            return tf.reduce_sum(
+                s_x * s_mask, axis=(1,2), keep_dims=True) / s_count
+        if not stream:
+            return tf.reduce_mean(s_x, axis=(1,2), keep_dims=True)
+        v_sum = self.model.stream_state(name + '_sum', [hparams.BATCH_SIZE])
+        v_count = self.model.stream_state(
+            name + '_count', [hparams.BATCH_SIZE])
+        s_shp = tf.shape(s_x)
+        s_sum = v_sum + tf.reduce_sum(s_x, axis=(1,2))
+        s_count = v_count + tf.cast(s_shp[1] * s_shp[2], hparams.FLOATX)
+        with tf.control_dependencies([
+                self.model.update_stream_state(v_sum, s_sum),
+                self.model.update_stream_state(v_count, s_count)]):
+            s_mean = tf.identity(s_sum / s_count)
+        return tf.reshape(s_mean, [hparams.BATCH_SIZE, 1, 1])
+
+    def __call__(
+            self, s_signals, s_dropout_keep=1., stream=False, s_lengths=None):
+        s_mask = None
+        if s_lengths is not None:
+            assert not stream
+            s_mask = ops.frame_mask(s_lengths, s_signals)
         with tf.variable_scope(self.name):
-            s_signals = s_signals - tf.reduce_mean(
-                s_signals, axis=(1,2), keep_dims=True)
+            s_signals = s_signals - self._mean(
+                'in_mean', s_signals, stream, s_mask)
 
             hdim = 600
             init_range = 1.15 / sqrt(hdim)
@@ -164,22 +232,21 @@ class LstmEncoder(Encoder):
             s_mid0 = self.model.lyr_lstm(
                 'lstm0', s_signals, hdim,
                 t_axis=-2, axis=-1,
-                w_init=w_initer, b_init=b_initer)
+                w_init=w_initer, b_init=b_initer, stream=stream)
             s_mid1 = self.model.lyr_lstm(
                 'lstm1', s_mid0, hdim,
                 t_axis=-2, axis=-1,
-                w_init=w_initer, b_init=b_initer)
+                w_init=w_initer, b_init=b_initer, stream=stream)
             s_mid2 = self.model.lyr_lstm(
                 'lstm2', s_mid1, hdim,
                 t_axis=-2, axis=-1,
-                w_init=w_initer, b_init=b_initer)
+                w_init=w_initer, b_init=b_initer, stream=stream)
             s_out = self.model.lyr_lstm(
                 'lstm3', s_mid2, hdim,
                 t_axis=-2, axis=-1,
-                w_init=w_initer, b_init=b_initer)
+                w_init=w_initer, b_init=b_initer, stream=stream)
 
-            s_out = s_out - tf.reduce_mean(
-                s_out, axis=(1,2), keep_dims=True)
+            s_out = s_out - self._mean('out_mean', s_out, stream, s_mask)
 
             init_range = 1.85
             s_out = ops.lyr_linear(
@@ -201,13 +268,18 @@ class BiLstmEncoder(LstmEncoder):
     '''
     Bi-LSTM network as in original paper
     '''
+    CAN_STREAM = False
+    CAN_MASK = True
     def __init__(self, model, name):
         super(LstmEncoder, self).__init__(model, name)
 
-    def __call__(self, s_signals, s_dropout_keep=1.):
+    def __call__(self, s_signals, s_dropout_keep=1., s_lengths=None):
+        s_mask = None
+        if s_lengths is not None:
+            s_mask = ops.frame_mask(s_lengths, s_signals)
         with tf.variable_scope(self.name):
-            s_signals = s_signals - tf.reduce_mean(
-                s_signals, axis=(1,2), keep_dims=True)
+            s_signals = s_signals - self._mean(
+                'in_mean', s_signals, False, s_mask)
 
             hdim = 300
             init_range = .75 / sqrt(hdim)
@@ -224,25 +296,24 @@ class BiLstmEncoder(LstmEncoder):
                 'lstm0', self.model,
                 s_signals, hdim,
                 -2, -1,
-                w_initer, b_initer, s_dropout_keep)
+                w_initer, b_initer, s_dropout_keep, s_lengths)
             s_mid1 = _lyr_bilstm(
                 'lstm1', self.model,
                 s_mid0, hdim,
                 -2, -1,
-                w_initer, b_initer, s_dropout_keep)
+                w_initer, b_initer, s_dropout_keep, s_lengths)
             s_mid2 = _lyr_bilstm(
                 'lstm2', self.model,
                 s_mid1, hdim,
                 -2, -1,
-                w_initer, b_initer, s_dropout_keep)
+                w_initer, b_initer, s_dropout_keep, s_lengths)
             s_out = _lyr_bilstm(
                 'lstm3', self.model,
                 s_mid2, hdim,
                 -2, -1,
-                w_initer, b_initer, s_dropout_keep)
+                w_initer, b_initer, s_dropout_keep, s_lengths)
 
-            s_out = s_out - tf.reduce_mean(
-                s_out, axis=(1,2), keep_dims=True)
+            s_out = s_out - self._mean('out_mean', s_out, False, s_mask)
 
             # init_range = 2. / sqrt(300)
             init_range = 1.85
@@ -492,13 +563,47 @@ class AnchoredEstimator(Estimator):
     '''
     Estimate attractor from best combination from
     anchors, then perform 1-step EM
+
+    In streaming mode, sums of equation (7) are accumulated over all
+    blocks of the stream so far, and attractors are reordered to match
+    those of previous block, so separated signals keep their order.
+
+    With frame lengths given, padding frames are left out of the sums
+    of equation (7).
     '''
     USE_TRUTH = False
+    CAN_STREAM = True
+    CAN_MASK = True
     def __init__(self, model, name):
         super(AnchoredEstimator, self).__init__(model, name)
         self.name = name
 
-    def __call__(self, s_embed, s_src_pwr=None, s_mix_pwr=None, s_embed_flat=None):
+    def _align(self, s_attractors):
+        '''
+        Permutes attractors to be most similar to previous ones
+        '''
+        num_signal = hparams.MAX_N_SIGNAL
+        perms = list(itertools.permutations(range(num_signal)))
+        perm_mats = np.zeros(
+            [len(perms), num_signal, num_signal], dtype=hparams.FLOATX)
+        for i, perm in enumerate(perms):
+            perm_mats[i, np.arange(num_signal), perm] = 1.
+        c_perm_mats = tf.constant(perm_mats)
+        v_prev = self.model.stream_state('prev_attractors', [
+            hparams.BATCH_SIZE, num_signal, hparams.EMBED_SIZE])
+        # at first block, v_prev is zero, so identity is chosen
+        s_similarities = tf.matmul(v_prev, s_attractors, transpose_b=True)
+        s_choice = tf.argmax(tf.einsum(
+            'bij,pij->bp', s_similarities, c_perm_mats), axis=1)
+        s_aligned = tf.matmul(
+            tf.gather(c_perm_mats, s_choice), s_attractors)
+        with tf.control_dependencies([
+                self.model.update_stream_state(v_prev, s_aligned)]):
+            return tf.identity(s_aligned)
+
+    def __call__(
+            self, s_embed, s_src_pwr=None, s_mix_pwr=None, s_embed_flat=None,
+            stream=False, s_lengths=None):
         with tf.variable_scope(self.name):
             v_anchors = tf.get_variable(
                 'anchors', [hparams.NUM_ANCHOR, hparams.EMBED_SIZE],
@@ -514,13 +619,36 @@ class AnchoredEstimator(Estimator):
                 'btfe,pce->bptfc',
                 s_embed, s_anchor_sets)
             s_anchor_assignment = tf.nn.softmax(s_anchor_assignment)
+            if s_lengths is not None:
+                assert not stream
+                s_mask = ops.frame_mask(s_lengths, s_embed)
+                s_anchor_assignment *= tf.reshape(
+                    s_mask, [hparams.BATCH_SIZE, 1, -1, 1, 1])
 
             # equation (7)
             s_attractor_sets = tf.einsum(
                 'bptfc,btfe->bpce',
                 s_anchor_assignment, s_embed)
-            s_attractor_sets /= tf.expand_dims(
-                tf.reduce_sum(s_anchor_assignment, axis=(2,3)), -1)
+            s_assignment_sum = tf.reduce_sum(
+                s_anchor_assignment, axis=(2,3))
+            if stream:
+                sets_shape = [
+                    hparams.BATCH_SIZE,
+                    s_anchor_sets.get_shape().as_list()[0],
+                    hparams.MAX_N_SIGNAL]
+                v_sets_sum = self.model.stream_state(
+                    'attractor_sets_sum', sets_shape + [hparams.EMBED_SIZE])
+                v_assignment_sum = self.model.stream_state(
+                    'assignment_sum', sets_shape)
+                s_attractor_sets += v_sets_sum
+                s_assignment_sum += v_assignment_sum
+                with tf.control_dependencies([
+                        self.model.update_stream_state(
+                            v_sets_sum, s_attractor_sets),
+                        self.model.update_stream_state(
+                            v_assignment_sum, s_assignment_sum)]):
+                    s_attractor_sets = tf.identity(s_attractor_sets)
+            s_attractor_sets /= tf.expand_dims(s_assignment_sum, -1)
 
             # equation (8)
             s_in_set_similarities = tf.reduce_max(
@@ -535,6 +663,8 @@ class AnchoredEstimator(Estimator):
                 tf.range(hparams.BATCH_SIZE, dtype=tf.int64),
                 s_subset_choice]))
             s_attractors = tf.gather_nd(s_attractor_sets, s_subset_choice)
+            if stream:
+                s_attractors = self._align(s_attractors)
 
         if hparams.DEBUG:
             self.debug_fetches = dict(
@@ -602,3 +732,65 @@ class DotSeparatorSoftmax(Separator):
             return tf.transpose(
                 s_separated_signals_pwr, [0, 3, 1, 2])
 
+
+class _FusedDotSeparator(Separator):
+    '''
+    Dot product similarity, computed source-major in one batched matmul,
+    so no transpose of full-size spectra is needed.
+    '''
+    CAN_RETURN_MASKS = True
+    def __init__(self, model, name):
+        super(_FusedDotSeparator, self).__init__(model, name)
+
+    def _logits_to_masks(self, s_logits):
+        raise NotImplementedError()
+
+    def __call__(
+            self, s_mixed_signals_pwr, s_attractors, s_embed_flat,
+            masks_only=False):
+        '''
+        Args:
+            masks_only: bool, return masks instead of separated power
+                spectra, of the same shape
+        '''
+        with tf.variable_scope(self.name):
+            # [B, C, E] x [B, T*F, E] -> [B, C, T*F]
+            s_logits = tf.matmul(
+                s_attractors, s_embed_flat, transpose_b=True)
+            s_logits = tf.reshape(
+                s_logits, [
+                    hparams.BATCH_SIZE,
+                    hparams.MAX_N_SIGNAL,
+                    -1, hparams.FEATURE_SIZE])
+            s_masks = self._logits_to_masks(s_logits)
+
+            if hparams.DEBUG:
+                self.debug_fetches['masks'] = s_masks
+
+            if masks_only:
+                return s_masks
+            return tf.expand_dims(s_mixed_signals_pwr, 1) * s_masks
+
+
+@hparams.register_separator('dot-sigmoid-fused')
+class FusedDotSeparatorSigmoid(_FusedDotSeparator):
+    '''
+    Same as "dot-sigmoid-orig", but source-major
+    '''
+    def __init__(self, model, name):
+        super(FusedDotSeparatorSigmoid, self).__init__(model, name)
+
+    def _logits_to_masks(self, s_logits):
+        return tf.nn.sigmoid(s_logits)
+
+
+@hparams.register_separator('dot-softmax-fused')
+class FusedDotSeparatorSoftmax(_FusedDotSeparator):
+    '''
+    Same as "dot-softmax-orig", but source-major
+    '''
+    def __init__(self, model, name):
+        super(FusedDotSeparatorSoftmax, self).__init__(model, name)
+
+    def _logits_to_masks(self, s_logits):
+        return tf.nn.softmax(s_logits, dim=1)
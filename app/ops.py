@@ -9,6 +9,7 @@ import numpy as np
 import tensorflow as tf
 
 from app.hparams import hparams
+import app.quantize as quantize
 
 
 def dimshuffle(s_x, *axes, name='dimshuffle'):
@@ -60,12 +61,14 @@ def lyr_linear(
             'W', [idim, odim],
             initializer=w_init,
             dtype=hparams.FLOATX)
+        # differs within quantize.quant_scope
+        op_matmul = quantize.get_matmul(v_w)
         if ndim == 1:
             s_y = tf.matmul(tf.expand_dims(s_x, 0), v_w)
             s_y = tf.squeeze(s_y, 0)
         elif ndim == 2:
             if axis % 2 == 1:
-                s_y = tf.matmul(s_x, v_w)
+                s_y = op_matmul(s_x, v_w)
             else:
                 s_y = tf.matmul(tf.transpose(s_x), v_w)
                 s_y = tf.transpose(s_x)
@@ -74,7 +77,7 @@ def lyr_linear(
             s_x = tf.reshape(
                 s_x,
                 [tf.reduce_prod(s_batch_shp, axis=None), x_shape[-1]])
-            s_y = tf.matmul(s_x, v_w)
+            s_y = op_matmul(s_x, v_w)
             s_y = tf.reshape(s_y, tf.concat([s_batch_shp, [odim]], axis=0))
         else:
             s_y = tf.tensordot(s_x, v_w, [[axis], [0]])
@@ -188,6 +191,115 @@ def lyr_gru_flat(
     return (s_cell_tp1,)
 
 
+def unit_phasor(s_x, name='unit_phasor'):
+    '''
+    Phase of complex tensor as unit phasor x / |x|, avoids atan2/cos/sin
+
+    Args:
+        s_x: complex tensor
+        name: string
+
+    Returns:
+        (s_phasor, s_abs)
+
+        s_phasor: 2-tuple of float tensor, real and imaginary part of
+            x / |x|, entries with zero magnitude get 1 + 0j (phase 0)
+        s_abs: float tensor, |x|
+    '''
+    with tf.name_scope(name):
+        s_re = tf.real(s_x)
+        s_im = tf.imag(s_x)
+        s_abs = tf.abs(s_x)
+        s_nonzero = tf.greater(s_abs, 0.)
+        s_inv_abs = 1. / tf.where(s_nonzero, s_abs, tf.ones_like(s_abs))
+        s_phasor = (
+            tf.where(s_nonzero, s_re * s_inv_abs, tf.ones_like(s_re)),
+            s_im * s_inv_abs)
+    return s_phasor, s_abs
+
+
+def apply_phasor(s_mag, s_phasor, name='apply_phasor'):
+    '''
+    Complex tensor from magnitude and unit phasor
+
+    Args:
+        s_mag: float tensor
+        s_phasor: 2-tuple of float tensor, see unit_phasor()
+            must broadcast against s_mag
+        name: string
+
+    Returns:
+        complex tensor
+    '''
+    with tf.name_scope(name):
+        s_re, s_im = s_phasor
+        return tf.complex(s_re * s_mag, s_im * s_mag)
+
+
+def stft(s_wav, name='stft'):
+    '''
+    Short-time fourier transform, same as `scipy.signal.stft` used by
+    `utils.load_wavfile`, with hparams.FFT_SIZE, FFT_STRIDE and FFT_WND
+
+    Args:
+        s_wav: float tensor of shape [batch_size, num_samples]
+        name: string
+
+    Returns:
+        complex tensor of shape [batch_size, length, FEATURE_SIZE],
+        with length = ceil(num_samples / FFT_STRIDE) + 1
+    '''
+    fft_size = hparams.FFT_SIZE
+    stride = hparams.FFT_STRIDE
+    window = hparams.FFT_WND
+    with tf.name_scope(name):
+        # zero boundary of half a frame on both sides, then zero pad
+        # end so frames fit exactly
+        s_len = tf.shape(s_wav)[1]
+        s_num_frames = (s_len + stride - 1) // stride + 1
+        s_pad_end = (
+            (s_num_frames - 1) * stride + fft_size // 2 - s_len)
+        s_wav = tf.pad(s_wav, [[0, 0], [fft_size // 2, s_pad_end]])
+        s_spectra = tf.contrib.signal.stft(
+            s_wav, fft_size, stride, fft_length=fft_size,
+            window_fn=lambda _, dtype: tf.constant(window, dtype=dtype))
+        s_spectra = tf.cast(s_spectra, hparams.COMPLEXX)
+        return s_spectra / np.sum(window).astype(hparams.COMPLEXX)
+
+
+def istft(s_spectra, s_len, name='istft'):
+    '''
+    Inverse of stft()
+
+    Unlike `utils.istft`, this undoes window scaling and boundary
+    padding of stft(), so waveforms are aligned with input of stft()
+
+    Args:
+        s_spectra: complex tensor of shape [..., length, FEATURE_SIZE]
+        s_len: integer scalar tensor, number of samples of output
+        name: string
+
+    Returns:
+        float tensor of shape [..., s_len]
+    '''
+    fft_size = hparams.FFT_SIZE
+    stride = hparams.FFT_STRIDE
+    window = hparams.FFT_WND
+    with tf.name_scope(name):
+        s_frames = tf.spectral.irfft(
+            s_spectra * np.sum(window).astype(hparams.COMPLEXX),
+            fft_length=[fft_size])
+        s_frames = tf.cast(s_frames, hparams.FLOATX) * window
+        s_wav = tf.contrib.signal.overlap_and_add(s_frames, stride)
+        s_wsum = tf.contrib.signal.overlap_and_add(
+            tf.tile(
+                tf.expand_dims(tf.constant(window ** 2.), 0),
+                [tf.shape(s_spectra)[-2], 1]), stride)
+        s_wav /= tf.where(
+            s_wsum > 0., s_wsum, tf.ones_like(s_wsum))
+        return s_wav[..., fft_size // 2:fft_size // 2 + s_len]
+
+
 def batch_snr(clear_signal, noisy_signal):
     '''
     batched signal to noise ratio, assuming zero mean
@@ -270,6 +382,22 @@ def batch_segment_mean(s_data, s_indices, n):
     return s_results / tf.cast(tf.expand_dims(s_weights, -1), hparams.FLOATX)
 
 
+def frame_mask(s_lengths, s_x, t_axis=1):
+    '''
+    Args:
+        s_lengths: int tensor of shape [batch_size], valid frames of
+            each row, frames past it are padding
+        s_x: tensor of shape [batch_size, ...], to take number of
+            frames from
+        t_axis: integer, time axis of s_x
+
+    Returns:
+        float tensor of shape [batch_size, length], 1 for valid frames
+    '''
+    return tf.sequence_mask(
+        s_lengths, tf.shape(s_x)[t_axis], dtype=hparams.FLOATX)
+
+
 def combinations(s_data, subset_size, total_size=None, name=None):
     assert isinstance(subset_size, int)
     assert subset_size > 0
@@ -430,3 +558,30 @@ def pit_mse_loss(s_x, s_y, pit_axis=1, perm_size=None, name='pit_loss'):
         s_loss = tf.reduce_mean(s_loss)
     return s_loss, v_perms, s_loss_sets_idx
 
+
+
+def average_gradients(tower_grads_li):
+    '''
+    Averages gradients of model replicas sharing the same variables
+
+    Args:
+        tower_grads_li: list of list of (gradient, variable) pairs,
+            as returned by Optimizer.compute_gradients for each replica
+
+    Returns:
+        list of (gradient, variable) pairs
+    '''
+    if len(tower_grads_li) == 1:
+        return tower_grads_li[0]
+    r_grads = []
+    for gv_li in zip(*tower_grads_li):
+        v = gv_li[0][1]
+        g_li = [g for g, _ in gv_li if g is not None]
+        if not g_li:
+            r_grads.append((None, v))
+            continue
+        with tf.name_scope('average_gradients'):
+            s_grad = tf.add_n([tf.convert_to_tensor(g) for g in g_li])
+            s_grad /= len(g_li)
+        r_grads.append((s_grad, v))
+    return r_grads
@@ -0,0 +1,148 @@
+'''
+Op-level profiling of selected session runs, with cost attributed to
+model scopes built in Model.build_tower
+'''
+import os
+import re
+import json
+from collections import OrderedDict
+
+import tensorflow as tf
+from tensorflow.python.client import timeline
+
+
+# variable scopes created by Model.build_tower
+MODEL_SCOPES = (
+    'encoder', 'train_estimator', 'infer_estimator', 'separator', 'pit_loss')
+# scopes of ops created when applying gradients
+OPTIMIZER_SCOPES = (
+    'average_gradients', 'clip_by_value', 'grad_accum', 'sync_replicas')
+
+
+def parse_steps(spec):
+    '''
+    Args:
+        spec: string such as "10,20-22", or None
+
+    Returns:
+        set of int
+    '''
+    steps = set()
+    if not spec:
+        return steps
+    for part in spec.split(','):
+        if '-' in part:
+            beg, end = part.split('-')
+            steps.update(range(int(beg), int(end)+1))
+        else:
+            steps.add(int(part))
+    return steps
+
+
+def scope_of(node_name, optimizer_name):
+    '''
+    Attributes a node of step stats to a model scope
+
+    Args:
+        node_name: string, such as "gradients/global_1/encoder/..."
+        optimizer_name: string, as Optimizer.get_name()
+
+    Returns:
+        string, a name in MODEL_SCOPES, with "/backward" appended for
+        gradient ops, or "optimizer", "other", "other/backward"
+    '''
+    parts = node_name.split('/')
+    is_backward = bool(re.fullmatch(r'gradients(_\d+)?', parts[0]))
+    if is_backward:
+        parts = parts[1:]
+    if parts and re.fullmatch(r'global(_\d+)?', parts[0]):
+        parts = parts[1:]
+    suffix = '/backward' if is_backward else ''
+    if parts and parts[0] in MODEL_SCOPES:
+        return parts[0] + suffix
+    if not is_backward and parts:
+        base = re.sub(r'_\d+$', '', parts[0])
+        if base.startswith(optimizer_name) or base in OPTIMIZER_SCOPES:
+            return 'optimizer'
+    return 'other' + suffix
+
+
+class Profiler(object):
+    '''
+    Runs session with full tracing on selected steps, writes a Chrome
+    trace per traced step, and a report of time and memory per scope.
+
+    Steps are counted by calls to `run()`.
+
+    Args:
+        steps: set of int, steps to trace
+        out_dir: string, directory for traces and report
+        optimizer_name: string, as Optimizer.get_name()
+    '''
+    def __init__(self, steps, out_dir, optimizer_name):
+        self.steps = steps
+        self.out_dir = out_dir
+        self.optimizer_name = optimizer_name
+        self.step = 0
+        self.num_traced = 0
+        self.costs = OrderedDict()
+
+    def run(self, sess, fetches, feed_dict=None):
+        step = self.step
+        self.step += 1
+        if step not in self.steps:
+            return sess.run(fetches, feed_dict)
+        run_metadata = tf.RunMetadata()
+        results = sess.run(
+            fetches, feed_dict,
+            options=tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE),
+            run_metadata=run_metadata)
+        self.record(step, run_metadata)
+        return results
+
+    def record(self, step, run_metadata):
+        if not os.path.exists(self.out_dir):
+            os.makedirs(self.out_dir)
+        trace = timeline.Timeline(run_metadata.step_stats)
+        with open(os.path.join(
+                self.out_dir, 'timeline_step%d.json' % step), 'w') as f:
+            f.write(trace.generate_chrome_trace_format(show_memory=True))
+
+        for dev_stats in run_metadata.step_stats.dev_stats:
+            for node_stats in dev_stats.node_stats:
+                scope = scope_of(node_stats.node_name, self.optimizer_name)
+                cost = self.costs.setdefault(
+                    scope, dict(time_ms=0., bytes=0, num_ops=0))
+                cost['time_ms'] += node_stats.all_end_rel_micros / 1e3
+                cost['bytes'] += sum(
+                    o.tensor_description.allocation_description.requested_bytes
+                    for o in node_stats.output)
+                cost['num_ops'] += 1
+        self.num_traced += 1
+        self.write_report()
+
+    def write_report(self):
+        '''
+        Writes per-step average cost of each scope as JSON,
+        returns it as string table
+        '''
+        if not self.num_traced:
+            return ''
+        total_ms = sum(c['time_ms'] for c in self.costs.values())
+        report = OrderedDict()
+        for scope, cost in sorted(
+                self.costs.items(), key=lambda kv: -kv[1]['time_ms']):
+            report[scope] = dict(
+                time_ms=cost['time_ms'] / self.num_traced,
+                time_ratio=cost['time_ms'] / max(total_ms, 1e-9),
+                bytes=cost['bytes'] // self.num_traced,
+                num_ops=cost['num_ops'] // self.num_traced)
+        with open(os.path.join(self.out_dir, 'profile_report.json'), 'w') as f:
+            json.dump(dict(num_steps=self.num_traced, scopes=report), f, indent=2)
+        lines = ['%-24s %10s %6s %12s %8s' % (
+            'scope', 'ms/step', '%', 'bytes/step', 'ops')]
+        for scope, r in report.items():
+            lines.append('%-24s %10.2f %6.1f %12d %8d' % (
+                scope, r['time_ms'], 100. * r['time_ratio'],
+                r['bytes'], r['num_ops']))
+        return '\n'.join(lines)
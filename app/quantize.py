@@ -0,0 +1,192 @@
+'''
+Post-training int8 quantization of encoder linear layers, for CPU inference
+
+Weights of every `ops.lyr_linear` within an "encoder" scope (gates of
+LSTM layers, output projection) are quantized symmetrically per output
+channel: W[:, j] ~= scale[j] * q[:, j], with q in [-127, 127]. Inputs of
+those layers are quantized per tensor to 8 bits, over a range found by
+calibration on validation data. Products are accumulated in int32 by
+QuantizedMatMul, then scaled back to float.
+
+QuantizedMatMul only takes unsigned 8 bit operands, so q is stored
+offset by 128, and given range [-128, 127] makes 128 its zero point.
+'''
+import re
+from contextlib import contextmanager
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.python.ops import gen_math_ops
+
+from app.hparams import hparams
+
+
+# weights of linear layers to quantize, matched against variable name
+TARGET_RE = re.compile(r'(^|/)encoder/(.*/)?W$')
+
+# fields of one layer in a quantization table
+TABLE_FIELDS = ('q', 'scale', 'x_min', 'x_max')
+
+_scope = dict(mode=None, table=None)
+# weight name -> (v_min, v_max), input range seen during calibration
+_observers = {}
+
+
+@contextmanager
+def quant_scope(mode, table=None):
+    '''
+    Changes encoder linear layers built within, by `mode`:
+
+    None does nothing.
+    "calibrate" records range of their inputs, see `calibrated_table()`.
+    "int8" runs them with quantized weights from `table`.
+    '''
+    assert mode in (None, 'calibrate', 'int8')
+    assert _scope['mode'] is None, 'quant_scope can\'t be nested'
+    if mode == 'int8' and table is None:
+        raise ValueError('"int8" quantization needs a table')
+    _scope.update(mode=mode, table=table)
+    try:
+        yield
+    finally:
+        _scope.update(mode=None, table=None)
+
+
+def get_matmul(v_w):
+    '''
+    Args:
+        v_w: weight variable of shape [idim, odim]
+
+    Returns:
+        function (s_x, v_w) -> s_y, matmul to use with `v_w`,
+        s_x being of shape [batch_size, idim]
+    '''
+    name = v_w.op.name
+    mode = _scope['mode']
+    if mode is None or not TARGET_RE.search(name):
+        return tf.matmul
+    if mode == 'calibrate':
+        return lambda s_x, v_w: _observed_matmul(name, s_x, v_w)
+    if name not in _scope['table']:
+        raise ValueError(
+            'Layer "%s" is missing from quantization table' % name)
+    return lambda s_x, v_w: _int8_matmul(_scope['table'][name], s_x)
+
+
+def _observed_matmul(name, s_x, v_w):
+    # AUTO_REUSE, as inference path is built within a reusing scope
+    with tf.variable_scope(tf.get_variable_scope(), reuse=tf.AUTO_REUSE):
+        v_min, v_max = [tf.get_variable(
+            var_name, [], dtype=hparams.FLOATX,
+            initializer=tf.constant_initializer(value),
+            trainable=False, collections=[tf.GraphKeys.LOCAL_VARIABLES])
+            for var_name, value in [
+                ('calib_min', np.inf), ('calib_max', -np.inf)]]
+    _observers[name] = (v_min, v_max)
+    with tf.control_dependencies([
+            tf.assign(v_min, tf.minimum(v_min, tf.reduce_min(s_x))),
+            tf.assign(v_max, tf.maximum(v_max, tf.reduce_max(s_x)))]):
+        return tf.matmul(s_x, v_w)
+
+
+def _int8_matmul(layer, s_x):
+    s_xq, s_xmin, s_xmax = tf.quantize_v2(
+        s_x, layer['x_min'], layer['x_max'], tf.quint8, mode='MIN_FIRST')
+    s_wq = tf.bitcast(tf.constant(layer['q']), tf.quint8)
+    s_acc, _, _ = gen_math_ops.quantized_mat_mul(
+        s_xq, s_wq, s_xmin, s_xmax, -128., 127., Toutput=tf.qint32)
+    s_acc = tf.cast(tf.bitcast(s_acc, tf.int32), hparams.FLOATX)
+    # QuantizeV2 may widen range to include zero, so use the one returned
+    s_x_step = (s_xmax - s_xmin) / 255.
+    return s_acc * s_x_step * tf.constant(layer['scale'], hparams.FLOATX)
+
+
+def observer_variables():
+    '''
+    Returns:
+        list of calibration variables, to initialize once built
+    '''
+    return [v for pair in _observers.values() for v in pair]
+
+
+def quantize_layer(w, x_min, x_max):
+    '''
+    Args:
+        w: float array of shape [idim, odim]
+        x_min: float, smallest input seen
+        x_max: float, largest input seen
+
+    Returns:
+        dict of TABLE_FIELDS
+    '''
+    scale = np.max(np.abs(w), axis=0) / 127.
+    scale[scale == 0.] = 1.
+    q = np.clip(np.round(w / scale), -127, 127).astype(np.int16) + 128
+    return dict(
+        q=q.astype(np.uint8), scale=scale.astype(np.float32),
+        x_min=float(x_min), x_max=float(x_max))
+
+
+def calibrated_table(sess):
+    '''
+    Quantizes weights of layers seen by "calibrate" scope,
+    with input ranges recorded so far
+
+    Args:
+        sess: tf.Session
+
+    Returns:
+        dict, weight name -> dict of TABLE_FIELDS
+    '''
+    names = sorted(_observers)
+    v_w_di = {v.op.name: v for v in tf.global_variables()}
+    results = sess.run([(v_w_di[name],) + _observers[name] for name in names])
+    table = {}
+    for name, (w, x_min, x_max) in zip(names, results):
+        if not x_min <= x_max:
+            raise ValueError(
+                'Layer "%s" was not run during calibration' % name)
+        table[name] = quantize_layer(w, x_min, x_max)
+    return table
+
+
+def save_table(filename, table):
+    np.savez(filename, **{
+        name + ':' + field: table[name][field]
+        for name in table for field in TABLE_FIELDS})
+
+
+def load_table(filename):
+    '''
+    Returns:
+        dict, as returned by `calibrated_table()`
+    '''
+    table = {}
+    with np.load(filename) as data:
+        for key in data.files:
+            name, field = key.rsplit(':', 1)
+            value = data[key]
+            table.setdefault(name, {})[field] = (
+                value if value.ndim else float(value))
+    return table
+
+
+def size_report(table, float_itemsize=4):
+    '''
+    Args:
+        table: dict, as returned by `calibrated_table()`
+        float_itemsize: integer, bytes of a float weight
+
+    Returns:
+        dict, bytes of quantized layers in float and in int8,
+        including scales and ranges
+    '''
+    num_weights = sum(layer['q'].size for layer in table.values())
+    int8_bytes = sum(
+        layer['q'].nbytes + layer['scale'].nbytes + 8
+        for layer in table.values())
+    return dict(
+        num_layers=len(table),
+        num_weights=num_weights,
+        float_bytes=num_weights * float_itemsize,
+        int8_bytes=int8_bytes)
@@ -0,0 +1,140 @@
+'''
+Runtime configuration: session config from hparams, XLA JIT scopes,
+thread-pool autotuner
+'''
+import os
+import json
+from contextlib import contextmanager
+
+import tensorflow as tf
+
+from app.hparams import hparams
+
+
+def session_config():
+    '''
+    Makes tf.ConfigProto from hyperparameters
+
+    Returns:
+        tf.ConfigProto
+    '''
+    opt_level = dict(
+        L0=tf.OptimizerOptions.L0,
+        L1=tf.OptimizerOptions.L1)[hparams.GRAPH_OPT_LEVEL]
+    jit_level = tf.OptimizerOptions.OFF
+    if hparams.XLA_JIT == 'global':
+        jit_level = tf.OptimizerOptions.ON_1
+    return tf.ConfigProto(
+        # each data-parallel replica gets its own CPU device
+        device_count={'CPU': hparams.NUM_REPLICA},
+        intra_op_parallelism_threads=hparams.INTRA_OP_THREADS,
+        inter_op_parallelism_threads=hparams.INTER_OP_THREADS,
+        allow_soft_placement=hparams.ALLOW_SOFT_PLACEMENT,
+        log_device_placement=hparams.LOG_DEVICE_PLACEMENT,
+        graph_options=tf.GraphOptions(
+            optimizer_options=tf.OptimizerOptions(
+                opt_level=opt_level, global_jit_level=jit_level)))
+
+
+# model scopes which can be XLA compiled on their own, see Model.build_tower
+JIT_SCOPES = (
+    'encoder', 'train_estimator', 'infer_estimator', 'separator', 'pit_loss')
+
+
+def jit_scope_names():
+    '''
+    Returns:
+        set of model scopes to be compiled with XLA, by hparams.XLA_JIT
+
+    Notes:
+        hparams.XLA_JIT can be None, "global", or comma separated
+        names in JIT_SCOPES. "global" is handled by session_config()
+    '''
+    if hparams.XLA_JIT in (None, 'global'):
+        return set()
+    return set(hparams.XLA_JIT.split(','))
+
+
+@contextmanager
+def jit_scope(name):
+    '''
+    Clusters ops created within into XLA compiled kernels,
+    if `name` is enabled by hparams.XLA_JIT. Otherwise does nothing.
+    '''
+    assert name in JIT_SCOPES
+    if name in jit_scope_names():
+        from tensorflow.contrib.compiler import jit
+        with jit.experimental_jit_scope(compile_ops=True):
+            yield
+    else:
+        yield
+
+
+def thread_candidates(num_cpu=None):
+    '''
+    Grid of (intra_op, inter_op) thread counts worth trying
+
+    Args:
+        num_cpu: integer, defaults to os.cpu_count()
+
+    Returns:
+        list of 2-tuple of int, (0, 0) being tensorflow defaults
+    '''
+    if num_cpu is None:
+        num_cpu = os.cpu_count() or 1
+    intra_li = []
+    n = 1
+    while n < num_cpu:
+        intra_li.append(n)
+        n *= 2
+    intra_li.append(num_cpu)
+    inter_li = [n for n in (1, 2, 4) if n <= num_cpu]
+    return [(0, 0)] + [(a, b) for a in intra_li for b in inter_li]
+
+
+def autotune(fn_time, candidates, log=None):
+    '''
+    Times each thread configuration, picks the fastest
+
+    Args:
+        fn_time: function (intra_op, inter_op) -> seconds per step
+        candidates: list of (intra_op, inter_op)
+        log: None or function taking a string, for progress report
+
+    Returns:
+        (best, results)
+        best is a dict of hyperparameters,
+        results is a list of dict, one per candidate
+    '''
+    results = []
+    for intra_op, inter_op in candidates:
+        sec_per_step = fn_time(intra_op, inter_op)
+        results.append(dict(
+            INTRA_OP_THREADS=intra_op,
+            INTER_OP_THREADS=inter_op,
+            sec_per_step=sec_per_step))
+        if log is not None:
+            log('intra=%d inter=%d %.4fs/step' % (
+                intra_op, inter_op, sec_per_step))
+    best = min(results, key=lambda r: r['sec_per_step'])
+    best = dict(
+        INTRA_OP_THREADS=best['INTRA_OP_THREADS'],
+        INTER_OP_THREADS=best['INTER_OP_THREADS'])
+    return best, results
+
+
+def write_config(filename, di):
+    '''
+    Merges hyperparameters into a JSON file, creating it if needed
+
+    Args:
+        filename: string
+        di: dict of hyperparameters
+    '''
+    config = {}
+    if os.path.exists(filename):
+        with open(filename, 'r') as f:
+            config = json.load(f)
+    config.update(di)
+    with open(filename, 'w') as f:
+        json.dump(config, f, indent=4, sort_keys=True)
@@ -0,0 +1,376 @@
+'''
+Long-running local inference server, see "serve" mode
+
+Requests are handled in threads. Each one is queued to a single batching
+thread, which gathers concurrent requests of similar length into one
+padded batch, runs it, then hands each request its own result.
+
+HTTP API:
+    POST /separate  body is a WAV file, response is a WAV file with one
+                    channel per separated signal
+    GET /metrics    JSON of queue depth, batch sizes and latencies
+    GET /health     "ok"
+'''
+import io
+import os
+import json
+import time
+import socket
+import threading
+from collections import deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+import numpy as np
+import scipy.io.wavfile
+
+import app.batch_infer as batch_infer
+
+
+class ServerMetrics(object):
+    '''
+    Thread-safe counters and recent latencies of a server
+
+    Args:
+        window: integer, latencies of this many last requests are kept
+            for percentiles
+    '''
+    def __init__(self, window=1000):
+        self.lock = threading.Lock()
+        self.t_start = time.time()
+        self.num_requests = 0
+        self.num_errors = 0
+        self.num_batches = 0
+        self.num_batched_requests = 0
+        self.num_padded_frames = 0
+        self.num_frames = 0
+        self.latency_sec = deque(maxlen=window)
+        self.queue_sec = deque(maxlen=window)
+        self.run_sec = deque(maxlen=window)
+
+    def add_batch(self, queue_sec_li, num_frames, padded_frames, run_sec):
+        '''
+        Args:
+            queue_sec_li: list of float, waiting time of each request
+                of batch
+            num_frames: integer, sum of request lengths
+            padded_frames: integer, size of padded batch
+            run_sec: float
+        '''
+        with self.lock:
+            self.num_batches += 1
+            self.num_batched_requests += len(queue_sec_li)
+            self.num_frames += num_frames
+            self.num_padded_frames += padded_frames
+            self.queue_sec.extend(queue_sec_li)
+            self.run_sec.append(run_sec)
+
+    def add_request(self, latency_sec, error=False):
+        with self.lock:
+            self.num_requests += 1
+            self.num_errors += int(error)
+            self.latency_sec.append(latency_sec)
+
+    def report(self, queue_depth):
+        '''
+        Returns:
+            dict, JSON serializable
+        '''
+        def percentiles(values):
+            if not values:
+                return {}
+            values = 1e3 * np.asarray(values)
+            return dict(
+                mean=float(np.mean(values)),
+                p50=float(np.percentile(values, 50)),
+                p95=float(np.percentile(values, 95)),
+                p99=float(np.percentile(values, 99)),
+                max=float(np.max(values)))
+        with self.lock:
+            return dict(
+                uptime_sec=time.time() - self.t_start,
+                queue_depth=queue_depth,
+                num_requests=self.num_requests,
+                num_errors=self.num_errors,
+                num_batches=self.num_batches,
+                mean_batch_size=(
+                    self.num_batched_requests / max(1, self.num_batches)),
+                padding_ratio=(
+                    1. - self.num_frames / max(1, self.num_padded_frames)),
+                latency_ms=percentiles(self.latency_sec),
+                queue_ms=percentiles(self.queue_sec),
+                batch_run_ms=percentiles(self.run_sec))
+
+
+class DynamicBatcher(object):
+    '''
+    Runs requests in batches, from a single thread
+
+    A batch is started once `batch_size` requests are waiting, or the
+    oldest waiting request has waited `max_wait_sec`. It holds the oldest
+    request, along with the waiting ones closest to it in length, as long
+    as padded size stays within `max_batch_frames`.
+
+    Args:
+        run_batch: function, takes mixture batch of shape
+            [batch_size, length, feature_size] and valid frames of each
+            row, as given by `batch_infer.batch_lengths`, returns
+            separated batch of shape
+            [batch_size, num_signals, length, feature_size]
+        batch_size: integer
+        length_align: integer, see `batch_infer.pad_batch`
+        max_wait_sec: float
+        max_batch_frames: None or integer, limit of
+            batch_size * padded length, bounds memory of a run
+        metrics: None or ServerMetrics
+    '''
+    def __init__(
+            self, run_batch, batch_size, length_align,
+            max_wait_sec=0.01, max_batch_frames=None, metrics=None):
+        self.run_batch = run_batch
+        self.batch_size = batch_size
+        self.length_align = length_align
+        self.max_wait_sec = max_wait_sec
+        self.max_batch_frames = max_batch_frames
+        self.metrics = metrics
+        self.cond = threading.Condition()
+        self.queue = []
+        self.stopped = False
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def queue_depth(self):
+        with self.cond:
+            return len(self.queue)
+
+    def submit(self, spectra):
+        '''
+        Args:
+            spectra: complex array of shape [length, feature_size]
+
+        Returns:
+            concurrent.futures.Future, result is complex array of shape
+            [num_signals, length, feature_size]
+        '''
+        future = Future()
+        with self.cond:
+            if self.stopped:
+                raise RuntimeError('Batcher is stopped')
+            self.queue.append((time.perf_counter(), spectra, future))
+            self.cond.notify()
+        return future
+
+    def stop(self):
+        '''
+        Stops batching thread, requests still waiting fail
+        '''
+        with self.cond:
+            self.stopped = True
+            self.cond.notify()
+        self.thread.join()
+        for _, _, future in self.queue:
+            future.set_exception(RuntimeError('Batcher is stopped'))
+        self.queue = []
+
+    def _padded_frames(self, length):
+        return self.batch_size * (length + (-length) % self.length_align)
+
+    def _take_batch(self):
+        '''
+        Waits for, then removes requests of next batch from queue
+        '''
+        with self.cond:
+            while True:
+                if self.stopped:
+                    return None
+                if self.queue:
+                    t_wait = self.queue[0][0] + self.max_wait_sec - (
+                        time.perf_counter())
+                    if len(self.queue) >= self.batch_size or t_wait <= 0.:
+                        break
+                    self.cond.wait(t_wait)
+                else:
+                    self.cond.wait()
+            oldest_len = len(self.queue[0][1])
+            order = sorted(
+                range(len(self.queue)),
+                key=lambda i: (abs(len(self.queue[i][1]) - oldest_len), i))
+            chosen = []
+            max_len = 0
+            for i in order[:self.batch_size]:
+                new_max_len = max(max_len, len(self.queue[i][1]))
+                if chosen and self.max_batch_frames is not None and (
+                        self._padded_frames(new_max_len) >
+                        self.max_batch_frames):
+                    continue
+                chosen.append(i)
+                max_len = new_max_len
+            chosen_set = set(chosen)
+            batch = [self.queue[i] for i in sorted(chosen)]
+            self.queue = [
+                x for i, x in enumerate(self.queue) if i not in chosen_set]
+            return batch
+
+    def _run(self):
+        while True:
+            items = self._take_batch()
+            if items is None:
+                break
+            # any error fails requests of this batch only, this thread
+            # must keep serving later ones
+            try:
+                self._run_batch(items)
+            except Exception as e:
+                for _, _, future in items:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _run_batch(self, items):
+        spectra_li = [spectra for _, spectra, _ in items]
+        batch = batch_infer.pad_batch(
+            spectra_li, self.batch_size, self.length_align)
+        t_beg = time.perf_counter()
+        signals = self.run_batch(
+            batch, batch_infer.batch_lengths(spectra_li, batch))
+        run_sec = time.perf_counter() - t_beg
+        if self.metrics is not None:
+            self.metrics.add_batch(
+                [t_beg - t_submit for t_submit, _, _ in items],
+                sum(len(x) for x in spectra_li),
+                batch.shape[0] * batch.shape[1], run_sec)
+        for i, (_, spectra, future) in enumerate(items):
+            future.set_result(signals[i, :, :len(spectra)])
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    # set by make_server
+    app = None
+
+    def address_string(self):
+        # client address of unix socket is empty
+        return str(self.client_address[0]) if self.client_address else '-'
+
+    def log_message(self, format, *args):
+        if self.app.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def _reply(self, code, body, content_type):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _reply_json(self, code, obj):
+        self._reply(code, json.dumps(obj).encode('utf-8'), 'application/json')
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            report = self.app.metrics.report(self.app.batcher.queue_depth())
+            if self.app.cache is not None:
+                report['cache'] = self.app.cache.report()
+            self._reply_json(200, report)
+        elif self.path == '/health':
+            self._reply(200, b'ok', 'text/plain')
+        else:
+            self._reply_json(404, dict(error='Unknown path "%s"' % self.path))
+
+    def do_POST(self):
+        if self.path != '/separate':
+            self._reply_json(404, dict(error='Unknown path "%s"' % self.path))
+            return
+        t_beg = time.perf_counter()
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            smprate, data = scipy.io.wavfile.read(
+                io.BytesIO(self.rfile.read(length)))
+            if data.ndim != 1:
+                raise ValueError('Expects mono WAV file')
+            spectra = self.app.preprocess(smprate, data)
+        except Exception as e:
+            self.app.metrics.add_request(
+                time.perf_counter() - t_beg, error=True)
+            self._reply_json(400, dict(error=str(e)))
+            return
+        try:
+            cache = self.app.cache
+            key = signals = None
+            if cache is not None:
+                key = cache.key(spectra)
+                signals = cache.get(key)
+            if signals is None:
+                signals = self.app.batcher.submit(spectra).result()
+                if cache is not None:
+                    cache.put(key, signals)
+            out = io.BytesIO()
+            scipy.io.wavfile.write(
+                out, self.app.smprate, self.app.postprocess(signals).T)
+        except Exception as e:
+            self.app.metrics.add_request(
+                time.perf_counter() - t_beg, error=True)
+            self._reply_json(500, dict(error=str(e)))
+            return
+        self.app.metrics.add_request(time.perf_counter() - t_beg)
+        self._reply(200, out.getvalue(), 'audio/wav')
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _ThreadingUnixHTTPServer(_ThreadingHTTPServer):
+    address_family = socket.AF_UNIX
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        HTTPServer.server_bind(self)
+        self.server_name = self.server_address
+        self.server_port = 0
+
+
+class ServerApp(object):
+    '''
+    What request handlers need
+
+    Args:
+        batcher: DynamicBatcher
+        metrics: ServerMetrics
+        preprocess: function (smprate, data) -> spectra,
+            such as `utils.preprocess_wav`
+        postprocess: function, separated spectra of shape
+            [num_signals, length, feature_size] -> waveforms of shape
+            [num_signals, num_samples]
+        smprate: integer, of output waveforms
+        verbose: bool, log every request
+        cache: None or InferenceCache, of separated spectra
+    '''
+    def __init__(
+            self, batcher, metrics, preprocess, postprocess, smprate,
+            verbose=False, cache=None):
+        self.cache = cache
+        self.batcher = batcher
+        self.metrics = metrics
+        self.preprocess = preprocess
+        self.postprocess = postprocess
+        self.smprate = smprate
+        self.verbose = verbose
+
+
+def make_server(server_app, port=8000, host='127.0.0.1', unix_socket=None):
+    '''
+    Args:
+        server_app: ServerApp
+        port: integer, TCP port, unless unix_socket is given
+        host: string
+        unix_socket: None or string, path of unix socket to listen on
+
+    Returns:
+        HTTPServer, call its `serve_forever()`
+    '''
+    handler = type(
+        'RequestHandler', (_RequestHandler,), dict(app=server_app))
+    if unix_socket is not None:
+        return _ThreadingUnixHTTPServer(unix_socket, handler)
+    return _ThreadingHTTPServer((host, port), handler)
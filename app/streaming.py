@@ -0,0 +1,83 @@
+'''
+Stateful streaming separation, frame block by frame block
+'''
+import numpy as np
+
+
+class StreamSession(object):
+    '''
+    Separates up to BATCH_SIZE concurrent streams with the streaming
+    inference graph, needs hparams.STREAM_INFER
+
+    Each stream owns one batch row of the graph. Encoder RNN state,
+    normalization statistics and attractor estimates of a stream are
+    kept in that row between calls, so each block is separated using
+    all past frames of the stream, but no future one. Algorithmic
+    latency is thus one block plus one STFT window.
+
+    Args:
+        model: Model instance, built with hparams.STREAM_INFER
+        sess: tf.Session holding model variables
+    '''
+    def __init__(self, model, sess):
+        self.model = model
+        self.sess = sess
+        self.batch_size = model.s_stream_active.get_shape().as_list()[0]
+        self.free_rows = list(range(self.batch_size))
+        self.feature_size = model.stream_feed_keys[0].get_shape(
+            ).as_list()[-1]
+        self.dtype = model.stream_feed_keys[0].dtype.as_numpy_dtype
+
+    def open(self):
+        '''
+        Starts a new stream with zero state
+
+        Returns:
+            integer, stream id
+        '''
+        if not self.free_rows:
+            raise RuntimeError(
+                'All %d streams are open' % self.batch_size)
+        row = self.free_rows.pop(0)
+        reset = np.zeros([self.batch_size], dtype=bool)
+        reset[row] = True
+        self.sess.run(
+            self.model.op_reset_stream,
+            {self.model.s_stream_reset: reset})
+        return row
+
+    def close(self, stream):
+        assert stream not in self.free_rows
+        self.free_rows.append(stream)
+
+    def push(self, blocks):
+        '''
+        Separates next block of some streams, in one run
+
+        Args:
+            blocks: dict, stream id -> complex array of shape
+                [length, FEATURE_SIZE], mixture STFT frames,
+                all blocks must have the same length
+
+        Returns:
+            dict, stream id -> complex array of shape
+            [MAX_N_SIGNAL, length, FEATURE_SIZE], separated frames,
+            signals keep their order from block to block
+        '''
+        lengths = set(len(x) for x in blocks.values())
+        if len(lengths) != 1:
+            raise ValueError(
+                'Blocks pushed at once must have same length, got %s' % (
+                    sorted(lengths)))
+        length, = lengths
+        batch = np.zeros(
+            [self.batch_size, length, self.feature_size], dtype=self.dtype)
+        active = np.zeros([self.batch_size], dtype=bool)
+        for stream, x in blocks.items():
+            assert stream not in self.free_rows
+            batch[stream] = x
+            active[stream] = True
+        signals = self.sess.run(
+            self.model.stream_fetches,
+            dict(zip(self.model.stream_feed_keys, (batch, active))))['signals']
+        return {stream: signals[stream] for stream in blocks}
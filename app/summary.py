@@ -0,0 +1,64 @@
+'''
+Summary writing off the training loop
+'''
+import threading
+from queue import Queue, Full
+
+import tensorflow as tf
+
+
+class AsyncSummaryWriter(object):
+    '''
+    Wraps tf.summary.FileWriter, so parsing and writing summaries happen
+    in a background thread.
+
+    Summaries are dropped when the queue is full,
+    so writing never blocks the caller. An error of the background
+    thread is raised by next `add_summary()` or `close()`.
+
+    Args:
+        logdir: string
+        graph: tf.Graph or None, graph to write into event file
+        max_queue: integer, bounded size of pending summary queue
+    '''
+    def __init__(self, logdir, graph=None, max_queue=64):
+        self.writer = tf.summary.FileWriter(logdir, graph)
+        self.queue = Queue(maxsize=max_queue)
+        self.num_dropped = 0
+        self.error = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            try:
+                self.writer.add_summary(*item)
+            except Exception as e:
+                self.error = e
+        self.writer.flush()
+
+    def add_summary(self, summary, global_step=None):
+        '''
+        Args:
+            summary: serialized Summary protobuf (as fetched), or tf.Summary
+            global_step: integer
+        '''
+        if self.error is not None:
+            raise self.error
+        try:
+            self.queue.put_nowait((summary, global_step))
+        except Full:
+            self.num_dropped += 1
+
+    def close(self):
+        '''
+        Writes pending summaries, then closes event file
+        '''
+        self.queue.put(None)
+        self.thread.join()
+        self.writer.close()
+        if self.error is not None:
+            raise self.error
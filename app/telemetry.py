@@ -0,0 +1,120 @@
+'''
+Throughput telemetry of training / test loops
+'''
+import json
+import time
+from collections import OrderedDict
+
+import numpy as np
+import tensorflow as tf
+
+
+class StepTelemetry(object):
+    '''
+    Splits wall time of loop steps into phases, reports throughput
+
+    Phases are delimited by calls to `mark()`, each call charges
+    time elapsed since previous call to the given phase. Time spent
+    waiting for the data iterator is charged to "data".
+
+    Every `interval` steps, averages are written as a JSON line into
+    `jsonl_file` (if given) and as scalars to `writer`.
+
+    Args:
+        name: string, prefix of TensorBoard tags, also put in JSON records
+        writer: summary writer
+        interval: integer, number of steps per report
+        jsonl_file: None or string, file to append JSON records to
+
+    Example:
+        telemetry = StepTelemetry('train', writer, 100)
+        for data_pt in telemetry.iterate(dataset.epoch(...)):
+            ... # prepare feed dict
+            telemetry.mark('feed')
+            ... # g_sess.run
+            telemetry.mark('run')
+            telemetry.end_step(spectra)
+    '''
+    def __init__(self, name, writer, interval, jsonl_file=None):
+        self.name = name
+        self.writer = writer
+        self.interval = interval
+        self.jsonl = None
+        if jsonl_file is not None:
+            self.jsonl = open(jsonl_file, 'a')
+        self.step = 0
+        self._reset()
+        self.t_last = time.perf_counter()
+
+    def _reset(self):
+        self.phase_time = OrderedDict()
+        self.num_step = 0
+        self.num_utt = 0
+        self.num_bins = 0
+        self.num_frames = 0
+        self.num_pad_frames = 0
+
+    def iterate(self, iterable):
+        '''
+        Wraps data iterator, charging time waited on it to "data" phase
+        '''
+        self.t_last = time.perf_counter()
+        for item in iterable:
+            self.mark('data')
+            yield item
+
+    def mark(self, phase):
+        t_now = time.perf_counter()
+        self.phase_time[phase] = (
+            self.phase_time.get(phase, 0.) + t_now - self.t_last)
+        self.t_last = t_now
+
+    def end_step(self, spectra):
+        '''
+        Finishes a step, remaining time is charged to "bookkeeping"
+
+        Args:
+            spectra: array of shape [batch_size, num_signals, length, feature_size]
+                batch processed in this step, zero frames count as padding
+        '''
+        self.mark('bookkeeping')
+        batch_size, _, length, feature_size = spectra.shape
+        self.num_utt += batch_size
+        self.num_bins += batch_size * length * feature_size
+        self.num_frames += batch_size * length
+        self.num_pad_frames += np.count_nonzero(
+            ~np.any(spectra, axis=(1, 3)))
+        self.num_step += 1
+        self.step += 1
+        if self.num_step == self.interval:
+            self.flush()
+
+    def flush(self):
+        '''
+        Writes report of steps since last flush
+        '''
+        if not self.num_step:
+            return
+        wall_time = sum(self.phase_time.values())
+        record = OrderedDict(name=self.name, step=self.step)
+        for phase, t in self.phase_time.items():
+            record[phase + '_sec'] = t / self.num_step
+        record['step_sec'] = wall_time / self.num_step
+        record['utt_per_sec'] = self.num_utt / wall_time
+        record['bins_per_sec'] = self.num_bins / wall_time
+        record['padding_ratio'] = self.num_pad_frames / max(self.num_frames, 1)
+        self._reset()
+
+        if self.jsonl is not None:
+            self.jsonl.write(json.dumps(record) + '\n')
+            self.jsonl.flush()
+        self.writer.add_summary(tf.Summary(value=[
+            tf.Summary.Value(
+                tag='telemetry_%s/%s' % (self.name, k), simple_value=v)
+            for k, v in record.items() if k not in ('name', 'step')]),
+            self.step)
+
+    def close(self):
+        self.flush()
+        if self.jsonl is not None:
+            self.jsonl.close()
@@ -50,31 +50,146 @@ def prompt_overwrite(filename_):
         savfile.close()
 
 
+def _window_sum(num_samples, num_frames, stride, window):
+    '''
+    Overlap-added squared window, cached as it only depends on shapes
+    '''
+    key = (num_samples, num_frames, stride, window.tobytes())
+    wsum = _window_sum_cache.get(key)
+    if wsum is None:
+        wsum = _overlap_add(
+            np.broadcast_to(window ** 2., (num_frames, len(window))),
+            num_samples, stride)
+        if len(_window_sum_cache) >= 64:
+            _window_sum_cache.clear()
+        _window_sum_cache[key] = wsum
+    return wsum
+_window_sum_cache = {}
+
+
+def _overlap_add(frames, num_samples, stride):
+    '''
+    Args:
+        frames: array of shape [..., num_frames, frame_size]
+        num_samples: integer, length of output
+        stride: integer
+
+    Returns:
+        array of shape [..., num_samples]
+    '''
+    num_frames, frame_size = frames.shape[-2:]
+    batch_shape = frames.shape[:-2]
+    if frame_size % stride == 0 and num_samples % stride == 0:
+        # sum frame_size // stride shifted copies, each one strided
+        # write over all frames
+        x = np.zeros(batch_shape + (num_samples // stride, stride))
+        for j in range(frame_size // stride):
+            x[..., j:j+num_frames, :] += frames[
+                ..., j*stride:(j+1)*stride].reshape(
+                    batch_shape + (num_frames, stride))
+        return x.reshape(batch_shape + (num_samples,))
+    x = np.zeros(batch_shape + (num_samples,))
+    idx = (np.arange(num_frames)[:, None] * stride
+        + np.arange(frame_size)[None, :])
+    frames = frames.reshape((-1, num_frames, frame_size))
+    x = x.reshape((-1, num_samples))
+    for x_, f_ in zip(x, frames):
+        np.add.at(x_, idx, f_)
+    return x.reshape(batch_shape + (num_samples,))
+
+
 def istft(X, stride, window):
     """
     Inverse short-time fourier transform.
 
     Args:
-        X: complex matrix of shape (length, 1 + fft_size//2)
+        X: complex array of shape (length, 1 + fft_size//2),
+            or (num_signals, length, 1 + fft_size//2) to invert
+            several signals at once
 
         stride: integer
 
-        window: 1D array, should be (X.shape[1] - 1) * 2
+        window: 1D array, should be (X.shape[-1] - 1) * 2
 
     Returns:
-        floating-point waveform samples (1D array)
+        floating-point waveform samples,
+        1D array, or 2D array of shape (num_signals, length*stride)
     """
-    fftsize = (X.shape[1] - 1) * 2
-    x = np.zeros(X.shape[0]*stride)
-    wsum = np.zeros(X.shape[0]*stride)
-    for n, i in enumerate(range(0, len(x)-fftsize, stride)):
-        x[i:i+fftsize] += np.real(np.fft.irfft(X[n])) * window   # overlap-add
-        wsum[i:i+fftsize] += window ** 2.
+    fftsize = (X.shape[-1] - 1) * 2
+    num_samples = X.shape[-2] * stride
+    # frames starting within [0, num_samples - fftsize) are used
+    num_frames = max(0, -(-(num_samples - fftsize) // stride))
+    frames = np.real(np.fft.irfft(X[..., :num_frames, :], axis=-1)) * window
+    x = _overlap_add(frames, num_samples, stride)
+    wsum = _window_sum(num_samples, num_frames, stride, window)
     pos = wsum != 0
-    x[pos] /= wsum[pos]
+    x[..., pos] /= wsum[pos]
     return x
 
 
+class StreamingIstft(object):
+    '''
+    Inverse STFT of frames given block by block, gives the same samples
+    as `istft` of all frames at once
+
+    Args:
+        num_frames: integer, total number of frames to come
+        stride: integer
+        window: 1D array
+    '''
+    def __init__(self, num_frames, stride, window):
+        self.stride = stride
+        self.window = window
+        fft_size = len(window)
+        self.num_samples = num_frames * stride
+        # same frames as used by istft
+        self.num_used = max(0, -(-(self.num_samples - fft_size) // stride))
+        self.frame_pos = 0
+        self.acc = None
+        self.wacc = np.zeros(0)
+
+    def push(self, X):
+        '''
+        Args:
+            X: complex array of shape (..., length, 1 + fft_size//2),
+                next frames
+
+        Returns:
+            array of shape (..., length*stride), samples no later frame
+            contributes to
+        '''
+        stride = self.stride
+        if self.acc is None:
+            self.acc = np.zeros(X.shape[:-2] + (0,))
+        num_frames = min(X.shape[-2], max(0, self.num_used - self.frame_pos))
+        if num_frames:
+            seg_len = (num_frames - 1) * stride + len(self.window)
+            frames = np.real(np.fft.irfft(
+                X[..., :num_frames, :], axis=-1)) * self.window
+            seg = _overlap_add(frames, seg_len, stride)
+            wseg = _window_sum(seg_len, num_frames, stride, self.window)
+            pad = max(0, seg_len - self.acc.shape[-1])
+            self.acc = np.pad(
+                self.acc, [(0, 0)] * (self.acc.ndim - 1) + [(0, pad)],
+                mode='constant')
+            self.wacc = np.pad(self.wacc, [(0, pad)], mode='constant')
+            self.acc[..., :seg_len] += seg
+            self.wacc[:seg_len] += wseg
+        self.frame_pos += X.shape[-2]
+        # later frames start at or after frame_pos * stride
+        num_done = X.shape[-2] * stride
+        pad = max(0, num_done - self.acc.shape[-1])
+        x = np.pad(
+            self.acc, [(0, 0)] * (self.acc.ndim - 1) + [(0, pad)],
+            mode='constant')
+        wsum = np.pad(self.wacc, [(0, pad)], mode='constant')
+        x, self.acc = x[..., :num_done], x[..., num_done:]
+        wsum, self.wacc = wsum[:num_done], wsum[num_done:]
+        pos = wsum != 0
+        x[..., pos] /= wsum[pos]
+        return x
+
+
 def random_zeropad(X, padlen, axis=-1):
     '''
     This randomly do zero padding in both directions, on specified axis
@@ -109,6 +224,20 @@ def load_wavfile(filename):
                 'WAV file not specified, '
                 'please specify via --input-file argument.')
     smprate, data = scipy.io.wavfile.read(filename)
+    return preprocess_wav(smprate, data)
+
+
+def preprocess_wav(smprate, data):
+    '''
+    Resamples waveform to hparams.SMPRATE, then takes STFT, as load_wavfile
+
+    Args:
+        smprate: integer
+        data: 1D array
+
+    Returns:
+        numpy array of shape [time, FEATURE_SIZE]
+    '''
     fft_size = hparams.FFT_SIZE
     fft_stride = hparams.FFT_STRIDE
     if smprate != hparams.SMPRATE:
@@ -122,9 +251,114 @@ def load_wavfile(filename):
     return Zxx.astype(hparams.COMPLEXX).T
 
 
+def _resampled_chunks(data, smprate, new_smprate, chunk_size):
+    '''
+    Resamples a long signal chunk by chunk with `scipy.signal.resample_poly`,
+    chunks overlap by enough context so the result equals resampling
+    the whole signal at once
+
+    Args:
+        data: 1D array, may be memory-mapped
+        smprate: integer, sampling rate of data
+        new_smprate: integer
+        chunk_size: integer, approximate input samples per chunk
+
+    Yields:
+        1D float arrays, consecutive pieces of the resampled signal
+    '''
+    if smprate == new_smprate:
+        for beg in range(0, len(data), chunk_size):
+            yield np.asarray(data[beg:beg+chunk_size], dtype=np.float64)
+        return
+    gcd = np.gcd(smprate, new_smprate)
+    up, down = new_smprate // gcd, smprate // gcd
+    out_len = int(ceil(len(data) * up / down))
+    # support of resample_poly default FIR filter, in input samples,
+    # rounded to multiple of `down` to keep output grid aligned
+    context = int(ceil(10 * max(up, down) / up)) + 1
+    context += (-context) % down
+    chunk_size += (-chunk_size) % down
+    for beg in range(0, len(data), chunk_size):
+        ctx_beg = max(0, beg - context)
+        piece = np.asarray(
+            data[ctx_beg:beg+chunk_size+context], dtype=np.float64)
+        out = scipy.signal.resample_poly(piece, up, down)
+        out_beg = (beg - ctx_beg) * up // down
+        out_end = out_beg + min(
+            chunk_size * up // down, out_len - beg * up // down)
+        yield out[out_beg:out_end]
+
+
+def wav_num_frames(filename):
+    '''
+    Returns:
+        integer, number of STFT frames of a WAV file after resampling,
+        as given by `stream_wavfile`, read from header only
+    '''
+    smprate, data = scipy.io.wavfile.read(filename, mmap=True)
+    num_samples = len(data)
+    if smprate != hparams.SMPRATE:
+        num_samples = int(ceil(num_samples * hparams.SMPRATE / smprate))
+    # as scipy.signal.stft, half frame of zeros at boundary,
+    # then zeros at end so frames fit
+    return -(-num_samples // hparams.FFT_STRIDE) + 1
+
+
+def stream_wavfile(filename, block_frames=1024, read_samples=1 << 18):
+    '''
+    Streaming version of load_wavfile, for arbitrarily long files
+
+    The WAV file is memory-mapped, read, resampled and transformed
+    piece by piece. Frames are the same as those of `scipy.signal.stft`
+    over the whole file, overlapping samples are carried across blocks.
+    If the file needs resampling, `scipy.signal.resample_poly` is used
+    instead of `scipy.signal.resample`.
+
+    Args:
+        filename: string
+        block_frames: integer, number of STFT frames per yielded block
+        read_samples: integer, approximate samples read from file at once
+
+    Yields:
+        complex arrays of shape [block_frames, FEATURE_SIZE],
+        last one may be shorter
+    '''
+    smprate, data = scipy.io.wavfile.read(filename, mmap=True)
+    fft_size = hparams.FFT_SIZE
+    fft_stride = hparams.FFT_STRIDE
+    window = hparams.FFT_WND
+    scale = np.sum(window)
+    num_frames = wav_num_frames(filename)
+
+    def frames_of(buf, n):
+        frames = np.lib.stride_tricks.as_strided(
+            buf, shape=(n, fft_size),
+            strides=(buf.strides[0] * fft_stride, buf.strides[0]))
+        return (np.fft.rfft(frames * window, axis=-1) / scale).astype(
+            hparams.COMPLEXX)
+
+    buf = np.zeros(fft_size // 2)
+    num_done = 0
+    block_samples = block_frames * fft_stride
+    for chunk in _resampled_chunks(
+            data, smprate, hparams.SMPRATE, read_samples):
+        buf = np.concatenate([buf, chunk])
+        while len(buf) >= block_samples - fft_stride + fft_size:
+            yield frames_of(buf, block_frames)
+            buf = buf[block_samples:]
+            num_done += block_frames
+    buf = np.concatenate([buf, np.zeros(
+        (num_frames - num_done - 1) * fft_stride + fft_size - len(buf))])
+    while num_done < num_frames:
+        n = min(block_frames, num_frames - num_done)
+        yield frames_of(buf, n)
+        buf = buf[n * fft_stride:]
+        num_done += n
+
+
 def save_wavfile(filename, feature):
     '''
-    Saves time series of features into a WAV file
+    Saves time series of features into a float32 WAV file
 
     Args:
         filename: string
@@ -132,6 +366,7 @@ def save_wavfile(filename, feature):
     '''
     data = istft(
         feature, stride=hparams.FFT_STRIDE, window=hparams.FFT_WND)
-    scipy.io.wavfile.write(filename, hparams.SMPRATE, data)
+    scipy.io.wavfile.write(
+        filename, hparams.SMPRATE, data.astype(np.float32))
 
 
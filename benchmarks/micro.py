@@ -0,0 +1,276 @@
+'''
+Micro-benchmarks of building blocks in app.ops and app.modules
+
+Times forward and forward+backward pass of each op / sub-module on CPU,
+over a grid of batch size, length, number of speakers and embedding size.
+
+Usage, from root directory of this repo:
+
+    # write new baseline
+    python -m benchmarks.micro -o baseline.json
+
+    # compare against baseline, exit with status 1 on regression
+    python -m benchmarks.micro -o new.json --compare baseline.json
+
+    # compare against reference run in this repo, written with --quick
+    python -m benchmarks.micro --quick --compare benchmarks/baseline.json
+'''
+from __future__ import print_function
+from __future__ import division
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import itertools
+from collections import OrderedDict
+
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
+
+import numpy as np
+import tensorflow as tf
+
+import app.ops as ops
+import app.modules  # registers estimators and separators
+from app.hparams import hparams
+
+
+GRID = OrderedDict(
+    B=[1, 8, 32],
+    T=[128, 512],
+    C=[2, 3],
+    E=[20, 40])
+QUICK_GRID = OrderedDict(
+    B=[8],
+    T=[128],
+    C=[2],
+    E=[20])
+
+
+def _rand_var(name, shape, dtype=None):
+    '''
+    random input as variable, so constant folding won't remove any work
+    '''
+    value = np.random.rand(*shape).astype(dtype or hparams.FLOATX)
+    return tf.Variable(value, name=name, trainable=True)
+
+
+def bench_lyr_linear(axis_mode):
+    def build(B, T, **_):
+        nf = hparams.FEATURE_SIZE
+        if axis_mode == 'last':
+            return ops.lyr_linear('linear', _rand_var('x', [B, T, nf]), 600)
+        elif axis_mode == 'middle':
+            # tensordot puts output axis last, where bias of shape
+            # [odim, 1] doesn't broadcast, so this times matmul alone
+            return ops.lyr_linear(
+                'linear', _rand_var('x', [B, nf, T]), 600, axis=1,
+                bias=False)
+        elif axis_mode == '2d':
+            return ops.lyr_linear('linear', _rand_var('x', [B*T, nf]), 600)
+    return build
+
+
+def bench_rnn(cell):
+    def build(B, T, **_):
+        hdim = 300
+        s_x = _rand_var('x', [T, B, hparams.FEATURE_SIZE])
+        s_zeros = tf.zeros([B, hdim], dtype=hparams.FLOATX)
+        if cell == 'lstm':
+            fn_step = lambda h, x: ops.lyr_lstm_flat(
+                'LSTM', x, h[0], h[1], axis=-1)
+            s_init = (s_zeros, s_zeros)
+        else:
+            fn_step = lambda h, x: ops.lyr_gru_flat(
+                'GRU', x, h[0], axis=-1)
+            s_init = (s_zeros,)
+        return tf.scan(fn_step, s_x, initializer=s_init)[-1]
+    return build
+
+
+def bench_pit_mse_loss(B, T, C, **_):
+    shp = [B, C, T, hparams.FEATURE_SIZE]
+    return ops.pit_mse_loss(_rand_var('x', shp), _rand_var('y', shp))[0]
+
+
+def bench_batch_snr(B, T, C, **_):
+    shp = [B, C, T, hparams.FEATURE_SIZE]
+    return ops.batch_snr(_rand_var('x', shp), _rand_var('y', shp))
+
+
+def bench_batch_cross_snr(B, T, C, **_):
+    shp = [B, C, T, hparams.FEATURE_SIZE]
+    return ops.batch_cross_snr(_rand_var('x', shp), _rand_var('y', shp))
+
+
+def bench_estimator(name):
+    def build(B, T, C, E):
+        nf = hparams.FEATURE_SIZE
+        estimator = hparams.get_estimator(name)(None, 'estimator')
+        return estimator(
+            _rand_var('embed', [B, T, nf, E]),
+            s_src_pwr=_rand_var('src_pwr', [B, C, T, nf]),
+            s_mix_pwr=_rand_var('mix_pwr', [B, T, nf]))
+    return build
+
+
+def bench_separator(name):
+    def build(B, T, C, E):
+        nf = hparams.FEATURE_SIZE
+        separator = hparams.get_separator(name)(None, 'separator')
+        return separator(
+            _rand_var('mix_pwr', [B, T, nf]),
+            _rand_var('attractors', [B, C, E]),
+            _rand_var('embed_flat', [B, T*nf, E]))
+    return build
+
+
+def all_benchmarks():
+    '''
+    Returns:
+        OrderedDict, name -> (build function, list of grid axes it uses)
+    '''
+    benches = OrderedDict()
+    for axis_mode in ['last', 'middle', '2d']:
+        benches['lyr_linear_' + axis_mode] = (
+            bench_lyr_linear(axis_mode), 'BT')
+    benches['lyr_lstm_flat'] = (bench_rnn('lstm'), 'BT')
+    benches['lyr_gru_flat'] = (bench_rnn('gru'), 'BT')
+    benches['pit_mse_loss'] = (bench_pit_mse_loss, 'BTC')
+    benches['batch_snr'] = (bench_batch_snr, 'BTC')
+    benches['batch_cross_snr'] = (bench_batch_cross_snr, 'BTC')
+    for name in sorted(hparams.estimator_registry):
+        benches['estimator_' + name] = (bench_estimator(name), 'BTCE')
+    for name in sorted(hparams.separator_registry):
+        benches['separator_' + name] = (bench_separator(name), 'BTCE')
+    return benches
+
+
+def time_case(fn_build, dims, n_repeat, n_warmup=2):
+    '''
+    Returns:
+        dict, median milliseconds of forward, and forward+backward pass
+    '''
+    hparams.BATCH_SIZE = dims['B']
+    hparams.MAX_N_SIGNAL = dims['C']
+    hparams.EMBED_SIZE = dims['E']
+    with tf.Graph().as_default():
+        s_out = fn_build(**dims)
+        s_out = tf.reduce_sum(s_out)
+        v_params_li = tf.trainable_variables()
+        s_grads = [g for g in tf.gradients(s_out, v_params_li) if g is not None]
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer())
+            result = OrderedDict()
+            for key, fetches in [('fwd_ms', s_out), ('fwd_bwd_ms', s_grads)]:
+                for _ in range(n_warmup):
+                    sess.run(fetches)
+                t_li = []
+                for _ in range(n_repeat):
+                    t_beg = time.perf_counter()
+                    sess.run(fetches)
+                    t_li.append(time.perf_counter() - t_beg)
+                result[key] = 1e3 * float(np.median(t_li))
+    return result
+
+
+def run(grid, pattern, n_repeat):
+    results = OrderedDict()
+    for name, (fn_build, axes) in all_benchmarks().items():
+        if pattern is not None and not re.search(pattern, name):
+            continue
+        for values in itertools.product(*[grid[a] for a in axes]):
+            dims = OrderedDict((a, li[0]) for a, li in grid.items())
+            dims.update(zip(axes, values))
+            key = '%s/%s' % (name, ','.join(
+                '%s=%d' % (a, v) for a, v in zip(axes, values)))
+            results[key] = time_case(fn_build, dims, n_repeat)
+            print('%-56s fwd %9.3fms  fwd+bwd %9.3fms' % (
+                key, results[key]['fwd_ms'], results[key]['fwd_bwd_ms']),
+                flush=True)
+    return results
+
+
+def compare(results, baseline, threshold):
+    '''
+    Returns:
+        (regressions, missing, new), each list of string:
+        regressions above threshold, cases or metrics of baseline not in
+        results, and ones of results not in baseline
+    '''
+    regressions = []
+    missing = []
+    new = []
+    for key, result in results.items():
+        if key not in baseline:
+            new.append(key)
+            continue
+        for metric, value in result.items():
+            if metric not in baseline[key]:
+                new.append('%s %s' % (key, metric))
+                continue
+            base = baseline[key][metric]
+            if value > base * (1. + threshold):
+                regressions.append('%s %s: %.3fms -> %.3fms (+%.1f%%)' % (
+                    key, metric, base, value, 100. * (value / base - 1.)))
+        missing.extend(
+            '%s %s' % (key, metric)
+            for metric in baseline[key] if metric not in result)
+    missing.extend(key for key in baseline if key not in results)
+    return regressions, missing, new
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='micro-benchmarks of app.ops and app.modules')
+    parser.add_argument('-c', '--hparams-file',
+        help='path to hyperparameters (or config) file')
+    parser.add_argument('-k', '--filter',
+        help='only run benchmarks whose name matches this regex')
+    parser.add_argument('-o', '--output',
+        help='write results as JSON to this file')
+    parser.add_argument('--compare',
+        help='baseline JSON file to compare results against')
+    parser.add_argument('--threshold',
+        type=float, default=0.1,
+        help='relative slowdown reported as regression, default 0.1')
+    parser.add_argument('-r', '--repeat',
+        type=int, default=10, help='number of timed runs per case')
+    parser.add_argument('--quick',
+        action='store_true', help='only run smallest grid')
+    args = parser.parse_args()
+
+    hparams.load_json('default.json')
+    if args.hparams_file is not None:
+        hparams.load_json(args.hparams_file)
+    hparams.digest()
+
+    results = run(
+        QUICK_GRID if args.quick else GRID, args.filter, args.repeat)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare is not None:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+        if args.filter is not None:
+            # cases not selected by -k aren't missing
+            baseline = OrderedDict(
+                (key, value) for key, value in baseline.items()
+                if re.search(args.filter, key.split('/')[0]))
+        regressions, missing, new = compare(
+            results, baseline, args.threshold)
+        for r in missing:
+            print('MISSING ' + r)
+        for r in new:
+            print('NEW ' + r)
+        for r in regressions:
+            print('REGRESSION ' + r)
+        if regressions:
+            sys.exit(1)
+        print('No regression above %.0f%%' % (100. * args.threshold))
+
+
+if __name__ == '__main__':
+    main()
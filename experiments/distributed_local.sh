@@ -0,0 +1,15 @@
+#!/bin/bash
+# 1 parameter server + 2 workers on localhost, synchronous updates
+# pass extra arguments to main.py, e.g. ./experiments/distributed_local.sh -ds=timit
+PS_HOSTS='localhost:2222'
+WORKER_HOSTS='localhost:2223,localhost:2224'
+CLUSTER="--ps-hosts=$PS_HOSTS --worker-hosts=$WORKER_HOSTS --sync-replicas"
+
+python main.py $CLUSTER --job-name=ps --task-index=0 "$@" &
+PS_PID=$!
+python main.py $CLUSTER --job-name=worker --task-index=1 "$@" &
+WORKER_PID=$!
+python main.py $CLUSTER --job-name=worker --task-index=0 "$@"
+
+wait $WORKER_PID
+kill $PS_PID
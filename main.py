@@ -10,12 +10,20 @@ from math import sqrt, isnan
 from random import randint
 import argparse
 from sys import stdout
-from collections import OrderedDict
+from collections import OrderedDict, deque
 from functools import reduce
 from colorsys import hsv_to_rgb
 import sys
 import os
 import copy
+import signal
+import csv
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import json
+import time
+import resource
+import subprocess
 import datetime as datetime
 
 
@@ -26,17 +34,30 @@ import tensorflow as tf
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
 
 
+import app.batch_infer as batch_infer
+import app.bss_eval as bss_eval
+import app.checkpoint as checkpoint
+import app.infer_cache as infer_cache
+import app.chunked_infer as chunked_infer
 import app.datasets as datasets
+import app.distributed as distributed
 from app.hparams import hparams
 # import app.hparams as hparams
 import app.modules as modules
 import app.ops as ops
 import app.ozers as ozers
+import app.quantize as quantize
+import app.runtime as runtime
+import app.server as server
+import app.streaming as streaming
+import app.summary as summary
+import app.telemetry as telemetry
+import app.profiling as profiling
 import app.utils as utils
 
 
 # Global vars
-g_sess = tf.Session()
+g_sess = None
 g_args = None
 g_model = None
 g_dataset = None
@@ -58,26 +79,86 @@ def _dict_format(di):
     return ' '.join('='.join((k, str(v))) for k,v in di.items())
 
 
+class _NullSummaryWriter(object):
+    '''
+    Stands in for tf.summary.FileWriter on non-chief workers
+    '''
+    def add_summary(self, *args, **kwargs):
+        pass
+
+    def close(self):
+        pass
+
+
+def _summary_due(step):
+    return step % hparams.SUMMARY_STEPS == 0
+
+
 class Model(object):
     '''
     Base class for a fully trainable model
 
     Should be singleton
+
+    Args:
+        name: string
+        is_chief: bool, only chief writes summaries and checkpoints
+        sync_workers: None or integer, number of workers whose gradients
+            are aggregated synchronously in distributed mode
+        worker_device: None or string, device for per-worker variables
     '''
-    def __init__(self, name='BaseModel'):
+    def __init__(
+            self, name='BaseModel',
+            is_chief=True, sync_workers=None, worker_device=None):
         self.name = name
+        self.is_chief = is_chief
+        self.sync_workers = sync_workers
+        self.worker_device = worker_device
         self.s_states_di = {}
+        # per-stream state of streaming inference, see build_stream
+        self.s_stream_states_di = {}
         self.v_learn_rate = tf.Variable(
             hparams.LR,
             trainable=False,
             dtype=hparams.FLOATX,
             name='learn_rate')
+        self.s_new_learn_rate = tf.placeholder(
+            hparams.FLOATX, [], name='new_learn_rate')
+        self.op_set_learn_rate = tf.assign(
+            self.v_learn_rate, self.s_new_learn_rate)
+
+    def stream_state(self, name, shape):
+        '''
+        Creates a variable holding state of streaming inference,
+        zero at start of each stream
+
+        Args:
+            name: string
+            shape: list of int, first axis is batch, one stream per row
+
+        Returns:
+            tf.Variable
+        '''
+        v_state = tf.Variable(
+            tf.zeros(shape, dtype=hparams.FLOATX),
+            trainable=False, name=name,
+            collections=[tf.GraphKeys.LOCAL_VARIABLES])
+        self.s_stream_states_di[v_state.name] = v_state
+        return v_state
+
+    def update_stream_state(self, v_state, s_new):
+        '''
+        Returns:
+            op assigning `s_new` to rows of `v_state` of active streams
+        '''
+        return tf.assign(
+            v_state, tf.where(self.s_stream_active, s_new, v_state))
 
     def lyr_lstm(
             self, name, s_x, hdim,
             axis=-1, t_axis=0,
             op_linear=ops.lyr_linear,
-            w_init=None, b_init=None):
+            w_init=None, b_init=None, stream=False):
         '''
         Args:
             name: string
@@ -86,6 +167,8 @@ class Model(object):
             axis: which axis will RNN op get performed on
             t_axis: which axis would be the timeframe
             op_rnn: RNN layer function, defaults to ops.lyr_lstm
+            stream: bool, start from state left by previous block of
+                each stream, instead of zero state
         '''
         x_shp = s_x.get_shape().as_list()
         ndim = len(x_shp)
@@ -108,19 +191,23 @@ class Model(object):
         h_shp = copy.copy(x_shp[1:])
         h_shp[axis-1] = hdim
         with tf.variable_scope(name):
-            zero_init = tf.constant_initializer(0.)
-            v_cell = tf.get_variable(
-                dtype=hparams.FLOATX,
-                shape=h_shp, name='cell',
-                trainable=False,
-                initializer=zero_init)
-            v_hid = tf.get_variable(
-                dtype=hparams.FLOATX,
-                shape=h_shp, name='hid',
-                trainable=False,
-                initializer=zero_init)
-            self.s_states_di[v_cell.name] = v_cell
-            self.s_states_di[v_hid.name] = v_hid
+            if stream:
+                v_cell = self.stream_state('stream_cell', h_shp)
+                v_hid = self.stream_state('stream_hid', h_shp)
+            else:
+                zero_init = tf.constant_initializer(0.)
+                v_cell = tf.get_variable(
+                    dtype=hparams.FLOATX,
+                    shape=h_shp, name='cell',
+                    trainable=False,
+                    initializer=zero_init)
+                v_hid = tf.get_variable(
+                    dtype=hparams.FLOATX,
+                    shape=h_shp, name='hid',
+                    trainable=False,
+                    initializer=zero_init)
+                self.s_states_di[v_cell.name] = v_cell
+                self.s_states_di[v_hid.name] = v_hid
 
             op_lstm = lambda _h, _x: ops.lyr_lstm_flat(
                 name='LSTM',
@@ -129,6 +216,11 @@ class Model(object):
                 w_init=w_init, b_init=b_init)
             s_cell_seq, s_hid_seq = tf.scan(
                 op_lstm, s_x, initializer=(v_cell, v_hid))
+            if stream:
+                with tf.control_dependencies([
+                        self.update_stream_state(v_cell, s_cell_seq[-1]),
+                        self.update_stream_state(v_hid, s_hid_seq[-1])]):
+                    s_hid_seq = tf.identity(s_hid_seq)
         return s_hid_seq if t_axis == 0 else tf.transpose(s_hid_seq, perm)
 
     def lyr_gru(
@@ -184,7 +276,8 @@ class Model(object):
 
     def set_learn_rate(self, lr):
         global g_sess
-        g_sess.run(tf.assign(self.v_learn_rate, lr))
+        g_sess.run(
+            self.op_set_learn_rate, {self.s_new_learn_rate: lr})
 
     def get_learn_rate(self):
         return g_sess.run(self.v_learn_rate)
@@ -205,137 +298,405 @@ class Model(object):
         self.saver.restore(g_sess, filename)
         return True
 
-    def build(self):
+    def export_infer(self, export_dir):
+        '''
+        Writes waveform-to-waveform inference graph with current
+        parameters as SavedModel, needs hparams.WAVEFORM_INFER
+
+        Args:
+            export_dir: string, must not exist yet
+        '''
+        tf.saved_model.simple_save(
+            g_sess, export_dir,
+            inputs=dict(mixed_wav=self.wav_infer_feed_keys[0]),
+            outputs=self.wav_infer_fetches)
+
+    def load_state(self, filename):
+        '''
+        Restores full training state from a checkpoint saved by train()
+
+        Only chief restores variables, other distributed workers share
+        them through parameter servers and only load loop state.
+
+        Returns:
+            dict, training loop state to pass to train()
+        '''
+        state = checkpoint.load_state(filename)
+        if state is None:
+            raise ValueError(
+                'Checkpoint "%s" has no training state' % filename)
+        if self.is_chief:
+            self.state_saver.restore(g_sess, filename)
+        return state
+
+    def build_tower(
+            self, s_src_signals, s_mixed_signals, s_dropout_keep,
+            s_lengths=None):
+        '''
+        Builds one replica of the model, working on a shard of the batch
+
+        Args:
+            s_src_signals: complex tensor of shape
+                [BATCH_SIZE, MAX_N_SIGNAL, length, FEATURE_SIZE]
+            s_mixed_signals: complex tensor of shape
+                [BATCH_SIZE, length, FEATURE_SIZE]
+            s_dropout_keep: scalar tensor
+            s_lengths: None or int tensor of shape [BATCH_SIZE], valid
+                frames of each row, passed to modules which CAN_MASK
+
+        Returns:
+            dict of tensors
+        '''
         # create sub-modules
         encoder = hparams.get_encoder()(
             self, 'encoder')
-        # ===================
-        # build the model
 
-        input_shape = [
-            hparams.BATCH_SIZE,
-            hparams.MAX_N_SIGNAL,
-            None,
-            hparams.FEATURE_SIZE]
-
-        s_src_signals = tf.placeholder(
-            hparams.COMPLEXX,
-            input_shape,
-            name='source_signal')
-        s_dropout_keep = tf.placeholder(
-            hparams.FLOATX,
-            [], name='dropout_keep')
-        reger = hparams.get_regularizer()
-        with tf.variable_scope('global', regularizer=reger):
-            # TODO add mixing coeff ?
-
-            # get mixed signal
-            s_mixed_signals = tf.reduce_sum(
-                s_src_signals, axis=1)
-
-            s_src_signals_pwr = tf.abs(s_src_signals)
-            s_mixed_signals_phase = tf.atan2(
-                tf.imag(s_mixed_signals), tf.real(s_mixed_signals))
-            s_mixed_signals_power = tf.abs(s_mixed_signals)
-            s_mixed_signals_log = tf.log1p(s_mixed_signals_power)
-            # int[B, T, F]
-            # float[B, T, F, E]
-            s_embed = encoder(s_mixed_signals_log)
-            s_embed_flat = tf.reshape(
-                s_embed,
-                [hparams.BATCH_SIZE, -1, hparams.EMBED_SIZE])
-
-            # TODO make attractor estimator a submodule ?
-            estimator = hparams.get_estimator(
-                hparams.TRAIN_ESTIMATOR_METHOD)(self, 'train_estimator')
+        s_src_signals_pwr = tf.abs(s_src_signals)
+        s_mixed_signals_power = tf.abs(s_mixed_signals)
+        s_mixed_signals_log = tf.log1p(s_mixed_signals_power)
+        # int[B, T, F]
+        # float[B, T, F, E]
+        fn_mask_kwargs = lambda module: (
+            dict(s_lengths=s_lengths)
+            if s_lengths is not None and module.CAN_MASK else {})
+        with runtime.jit_scope('encoder'):
+            s_embed = encoder(s_mixed_signals_log, **fn_mask_kwargs(encoder))
+        s_embed_flat = tf.reshape(
+            s_embed,
+            [hparams.BATCH_SIZE, -1, hparams.EMBED_SIZE])
+
+        # TODO make attractor estimator a submodule ?
+        estimator = hparams.get_estimator(
+            hparams.TRAIN_ESTIMATOR_METHOD)(self, 'train_estimator')
+        with runtime.jit_scope('train_estimator'):
             s_attractors = estimator(
                 s_embed,
                 s_src_pwr=s_src_signals_pwr,
-                s_mix_pwr=s_mixed_signals_power)
+                s_mix_pwr=s_mixed_signals_power,
+                **fn_mask_kwargs(estimator))
 
-            using_same_method = (
-                hparams.INFER_ESTIMATOR_METHOD ==
-                hparams.TRAIN_ESTIMATOR_METHOD)
+        using_same_method = (
+            hparams.INFER_ESTIMATOR_METHOD ==
+            hparams.TRAIN_ESTIMATOR_METHOD)
 
-            if using_same_method:
-                s_valid_attractors = s_attractors
-            else:
-                valid_estimator = hparams.get_estimator(
-                    hparams.INFER_ESTIMATOR_METHOD
-                )(self, 'infer_estimator')
-                assert not valid_estimator.USE_TRUTH
-                s_valid_attractors = valid_estimator(s_embed)
-
-            separator = hparams.get_separator(
-                hparams.SEPARATOR_TYPE)(self, 'separator')
-            s_separated_signals_pwr = separator(
-                s_mixed_signals_power, s_attractors, s_embed_flat)
+        if using_same_method:
+            s_valid_attractors = s_attractors
+        else:
+            valid_estimator = hparams.get_estimator(
+                hparams.INFER_ESTIMATOR_METHOD
+            )(self, 'infer_estimator')
+            assert not valid_estimator.USE_TRUTH
+            with runtime.jit_scope('infer_estimator'):
+                s_valid_attractors = valid_estimator(
+                    s_embed, **fn_mask_kwargs(valid_estimator))
+
+        separator = hparams.get_separator(
+            hparams.SEPARATOR_TYPE)(self, 'separator')
+        # separator outputs are either masks or separated power spectra,
+        # of shape [B, C, T, F]
+        masks_only = separator.CAN_RETURN_MASKS
+        separator_kwargs = dict(masks_only=True) if masks_only else {}
+        with runtime.jit_scope('separator'):
+            s_separated_out = separator(
+                s_mixed_signals_power, s_attractors, s_embed_flat,
+                **separator_kwargs)
 
             if using_same_method:
-                s_separated_signals_pwr_valid = s_separated_signals_pwr
+                s_separated_out_valid = s_separated_out
             else:
-                s_separated_signals_pwr_valid = separator(
-                    s_mixed_signals_power, s_valid_attractors, s_embed_flat)
-
+                s_separated_out_valid = separator(
+                    s_mixed_signals_power, s_valid_attractors, s_embed_flat,
+                    **separator_kwargs)
+
+        if masks_only:
+            # separated signal is just masked mixture
+            s_mixed_signals_parts = (
+                tf.expand_dims(tf.real(s_mixed_signals), 1),
+                tf.expand_dims(tf.imag(s_mixed_signals), 1))
+            s_mixed_signals_power_x = tf.expand_dims(s_mixed_signals_power, 1)
+            fn_to_complex = lambda s_masks: ops.apply_phasor(
+                s_masks, s_mixed_signals_parts)
+            fn_to_pwr = lambda s_masks: s_masks * s_mixed_signals_power_x
+        else:
             # use mixture phase and estimated power to get separated signal
-            s_mixed_signals_phase = tf.expand_dims(s_mixed_signals_phase, 1)
-            s_separated_signals = tf.complex(
-                tf.cos(s_mixed_signals_phase) * s_separated_signals_pwr,
-                tf.sin(s_mixed_signals_phase) * s_separated_signals_pwr)
-
-            # loss and SNR for training
-            # s_train_loss, v_perms, s_perm_sets = ops.pit_mse_loss(
-                # s_src_signals_pwr, s_separated_signals_pwr)
+            s_mixed_signals_phasor, _ = ops.unit_phasor(s_mixed_signals)
+            s_mixed_signals_phasor = [
+                tf.expand_dims(s, 1) for s in s_mixed_signals_phasor]
+            fn_to_complex = lambda s_pwr: ops.apply_phasor(
+                s_pwr, s_mixed_signals_phasor)
+            fn_to_pwr = lambda s_pwr: s_pwr
+        s_separated_signals = fn_to_complex(s_separated_out)
+
+        # loss and SNR for training
+        # s_train_loss, v_perms, s_perm_sets = ops.pit_mse_loss(
+            # s_src_signals_pwr, s_separated_signals_pwr)
+        with runtime.jit_scope('pit_loss'):
             s_train_loss, v_perms, s_perm_sets = ops.pit_mse_loss(
                 s_src_signals, s_separated_signals)
 
-            # resolve permutation
-            s_perm_idxs = tf.stack([
-                tf.tile(
-                    tf.expand_dims(tf.range(hparams.BATCH_SIZE), 1),
-                    [1, hparams.MAX_N_SIGNAL]),
-                tf.gather(v_perms, s_perm_sets)], axis=2)
-            s_perm_idxs = tf.reshape(
-                s_perm_idxs, [hparams.BATCH_SIZE*hparams.MAX_N_SIGNAL, 2])
-            s_separated_signals = tf.gather_nd(
-                s_separated_signals, s_perm_idxs)
-            s_separated_signals = tf.reshape(
-                s_separated_signals, [
-                    hparams.BATCH_SIZE,
-                    hparams.MAX_N_SIGNAL,
-                    -1, hparams.FEATURE_SIZE])
+        # resolve permutation
+        s_perm_idxs = tf.stack([
+            tf.tile(
+                tf.expand_dims(tf.range(hparams.BATCH_SIZE), 1),
+                [1, hparams.MAX_N_SIGNAL]),
+            tf.gather(v_perms, s_perm_sets)], axis=2)
+        s_perm_idxs = tf.reshape(
+            s_perm_idxs, [hparams.BATCH_SIZE*hparams.MAX_N_SIGNAL, 2])
+        s_separated_signals = tf.gather_nd(
+            s_separated_signals, s_perm_idxs)
+        s_separated_signals = tf.reshape(
+            s_separated_signals, [
+                hparams.BATCH_SIZE,
+                hparams.MAX_N_SIGNAL,
+                -1, hparams.FEATURE_SIZE])
+
+        s_train_snr = tf.reduce_mean(ops.batch_snr(
+            s_src_signals, s_separated_signals))
+
+        # ^ for validation / inference
+        with runtime.jit_scope('pit_loss'):
+            s_valid_loss, v_perms, s_perm_sets = ops.pit_mse_loss(
+                s_src_signals_pwr, fn_to_pwr(s_separated_out_valid))
+        s_perm_idxs = tf.stack([
+            tf.tile(
+                tf.expand_dims(tf.range(hparams.BATCH_SIZE), 1),
+                [1, hparams.MAX_N_SIGNAL]),
+            tf.gather(v_perms, s_perm_sets)],
+            axis=2)
+        s_perm_idxs = tf.reshape(
+            s_perm_idxs, [hparams.BATCH_SIZE*hparams.MAX_N_SIGNAL, 2])
+        s_separated_out_valid_pit = tf.gather_nd(
+            s_separated_out_valid, s_perm_idxs)
+        s_separated_out_valid_pit = tf.reshape(
+            s_separated_out_valid_pit, [
+                hparams.BATCH_SIZE,
+                hparams.MAX_N_SIGNAL,
+                -1, hparams.FEATURE_SIZE])
+
+        s_separated_signals_valid = fn_to_complex(s_separated_out_valid_pit)
+        s_separated_signals_infer = fn_to_complex(s_separated_out_valid)
+        s_valid_snr = tf.reduce_mean(ops.batch_snr(
+            s_src_signals, s_separated_signals_valid))
+
+        tower = dict(
+            train_loss=s_train_loss,
+            train_snr=s_train_snr,
+            valid_loss=s_valid_loss,
+            valid_snr=s_valid_snr,
+            separated_signals_valid=s_separated_signals_valid,
+            separated_signals_infer=s_separated_signals_infer)
+        if hparams.DEBUG:
+            tower['debug_fetches'] = dict(
+                embed=s_embed,
+                attrs=s_attractors,
+                output=s_separated_signals)
+            tower['debug_fetches'].update(encoder.debug_fetches)
+            tower['debug_fetches'].update(separator.debug_fetches)
+            tower['debug_fetches'].update(estimator.debug_fetches)
+        return tower
 
-            s_train_snr = tf.reduce_mean(ops.batch_snr(
-                s_src_signals, s_separated_signals))
+    def build_infer(self, s_mixed_signals, stream=False, s_lengths=None):
+        '''
+        Builds inference path alone, for mixture not derived from
+        sources. Variables are shared with build_tower, so this must be
+        called within a reusing variable scope.
 
-            # ^ for validation / inference
-            s_valid_loss, v_perms, s_perm_sets = ops.pit_mse_loss(
-                s_src_signals_pwr, s_separated_signals_pwr_valid)
-            s_perm_idxs = tf.stack([
-                tf.tile(
-                    tf.expand_dims(tf.range(hparams.BATCH_SIZE), 1),
-                    [1, hparams.MAX_N_SIGNAL]),
-                tf.gather(v_perms, s_perm_sets)],
-                axis=2)
-            s_perm_idxs = tf.reshape(
-                s_perm_idxs, [hparams.BATCH_SIZE*hparams.MAX_N_SIGNAL, 2])
-            s_separated_signals_pwr_valid_pit = tf.gather_nd(
-                s_separated_signals_pwr_valid, s_perm_idxs)
-            s_separated_signals_pwr_valid_pit = tf.reshape(
-                s_separated_signals_pwr_valid_pit, [
-                    hparams.BATCH_SIZE,
-                    hparams.MAX_N_SIGNAL,
-                    -1, hparams.FEATURE_SIZE])
+        Args:
+            s_mixed_signals: complex tensor of shape
+                [BATCH_SIZE, length, FEATURE_SIZE]
+            stream: bool, each row of s_mixed_signals is next block of
+                a stream, encoder and estimator state is carried over
+                blocks, only for rows in self.s_stream_active
+            s_lengths: None or int tensor of shape [BATCH_SIZE], valid
+                frames of each row, passed to modules which CAN_MASK,
+                not used with stream
+
+        Returns:
+            complex tensor of shape
+            [BATCH_SIZE, MAX_N_SIGNAL, length, FEATURE_SIZE]
+        '''
+        assert not (stream and s_lengths is not None)
+        encoder = hparams.get_encoder()(self, 'encoder')
+        stream_kwargs = dict(stream=True) if stream else {}
+        fn_mask_kwargs = lambda module: (
+            dict(s_lengths=s_lengths)
+            if s_lengths is not None and module.CAN_MASK else {})
+        if stream and not encoder.CAN_STREAM:
+            raise ValueError(
+                'Encoder "%s" can\'t do streaming inference' % (
+                    hparams.ENCODER_TYPE))
+        s_mixed_signals_power = tf.abs(s_mixed_signals)
+        with runtime.jit_scope('encoder'):
+            s_embed = encoder(
+                tf.log1p(s_mixed_signals_power),
+                **dict(stream_kwargs, **fn_mask_kwargs(encoder)))
+        s_embed_flat = tf.reshape(
+            s_embed,
+            [hparams.BATCH_SIZE, -1, hparams.EMBED_SIZE])
+
+        if hparams.INFER_ESTIMATOR_METHOD == hparams.TRAIN_ESTIMATOR_METHOD:
+            estimator_name = 'train_estimator'
+        else:
+            estimator_name = 'infer_estimator'
+        estimator = hparams.get_estimator(
+            hparams.INFER_ESTIMATOR_METHOD)(self, estimator_name)
+        if estimator.USE_TRUTH:
+            raise ValueError(
+                'Inference estimator "%s" needs ground truth' % (
+                    hparams.INFER_ESTIMATOR_METHOD))
+        if stream and not estimator.CAN_STREAM:
+            raise ValueError(
+                'Inference estimator "%s" can\'t do streaming inference' % (
+                    hparams.INFER_ESTIMATOR_METHOD))
+        with runtime.jit_scope(estimator_name):
+            s_attractors = estimator(
+                s_embed, **dict(stream_kwargs, **fn_mask_kwargs(estimator)))
+
+        separator = hparams.get_separator(
+            hparams.SEPARATOR_TYPE)(self, 'separator')
+        with runtime.jit_scope('separator'):
+            if separator.CAN_RETURN_MASKS:
+                s_masks = separator(
+                    s_mixed_signals_power, s_attractors, s_embed_flat,
+                    masks_only=True)
+                return ops.apply_phasor(s_masks, (
+                    tf.expand_dims(tf.real(s_mixed_signals), 1),
+                    tf.expand_dims(tf.imag(s_mixed_signals), 1)))
+            s_separated_pwr = separator(
+                s_mixed_signals_power, s_attractors, s_embed_flat)
+        s_mixed_signals_phasor, _ = ops.unit_phasor(s_mixed_signals)
+        return ops.apply_phasor(s_separated_pwr, [
+            tf.expand_dims(s, 1) for s in s_mixed_signals_phasor])
+
+    def build_quant_infer(self, mode, table=None):
+        '''
+        Builds inference path like infer_fetches, with encoder linear
+        layers changed by `mode`, see quantize.quant_scope. Variables
+        are shared, so this can be called once session is running.
+
+        Args:
+            mode: string, "calibrate" or "int8"
+            table: dict, quantization table needed by "int8"
+
+        Returns:
+            (feed_keys, fetches), same form as infer_feed_keys
+            and infer_fetches
+        '''
+        s_mixed_signals = tf.placeholder(
+            hparams.COMPLEXX,
+            [self.batch_size, None, hparams.FEATURE_SIZE],
+            name='%s_mixed_signals' % mode)
+        s_dropout_keep = tf.placeholder(
+            hparams.FLOATX, [], name='%s_dropout_keep' % mode)
+        s_lengths = self._lengths_placeholder(
+            s_mixed_signals, name='%s_lengths' % mode)
+        if hparams.NUM_REPLICA == 1:
+            s_mixed_signals_li = [s_mixed_signals]
+            s_lengths_li = [s_lengths]
+        else:
+            s_mixed_signals_li = tf.split(
+                s_mixed_signals, hparams.NUM_REPLICA, axis=0)
+            s_lengths_li = tf.split(s_lengths, hparams.NUM_REPLICA, axis=0)
+        s_separated_li = []
+        for i_tower in range(hparams.NUM_REPLICA):
+            with tf.device('/cpu:%d' % i_tower), tf.variable_scope(
+                    'global', reuse=True), quantize.quant_scope(mode, table):
+                s_separated_li.append(self.build_infer(
+                    s_mixed_signals_li[i_tower],
+                    s_lengths=s_lengths_li[i_tower]))
+        return [s_mixed_signals, s_dropout_keep, s_lengths], dict(
+            signals=tf.concat(s_separated_li, axis=0))
+
+    def _lengths_placeholder(self, s_signals, name):
+        '''
+        Args:
+            s_signals: tensor of shape [batch_size, length, ...]
+            name: string
+
+        Returns:
+            int tensor of shape [batch_size], valid frames of each row
+            of s_signals, all of them unless fed
+        '''
+        return tf.placeholder_with_default(
+            tf.fill([self.batch_size], tf.shape(s_signals)[1]),
+            [self.batch_size], name=name)
+
+    def build(self):
+        # ===================
+        # build the model
+
+        # each replica gets BATCH_SIZE samples
+        self.batch_size = hparams.BATCH_SIZE * hparams.NUM_REPLICA
+        input_shape = [
+            self.batch_size,
+            hparams.MAX_N_SIGNAL,
+            None,
+            hparams.FEATURE_SIZE]
+
+        s_src_signals = tf.placeholder(
+            hparams.COMPLEXX,
+            input_shape,
+            name='source_signal')
+        s_dropout_keep = tf.placeholder(
+            hparams.FLOATX,
+            [], name='dropout_keep')
+        # TODO add mixing coeff ?
+        # get mixed signal
+        s_mixed_signals = tf.reduce_sum(
+            s_src_signals, axis=1)
+        # only fed for inference on padded batches
+        s_lengths = self._lengths_placeholder(s_mixed_signals, 'lengths')
+
+        if hparams.NUM_REPLICA == 1:
+            s_src_signals_li = [s_src_signals]
+            s_mixed_signals_li = [s_mixed_signals]
+            s_lengths_li = [s_lengths]
+        else:
+            s_src_signals_li = tf.split(
+                s_src_signals, hparams.NUM_REPLICA, axis=0)
+            s_mixed_signals_li = tf.split(
+                s_mixed_signals, hparams.NUM_REPLICA, axis=0)
+            s_lengths_li = tf.split(s_lengths, hparams.NUM_REPLICA, axis=0)
 
-            s_separated_signals_valid = tf.complex(
-                tf.cos(s_mixed_signals_phase) * s_separated_signals_pwr_valid_pit,
-                tf.sin(s_mixed_signals_phase) * s_separated_signals_pwr_valid_pit)
-            s_separated_signals_infer = tf.complex(
-                tf.cos(s_mixed_signals_phase) * s_separated_signals_pwr_valid,
-                tf.sin(s_mixed_signals_phase) * s_separated_signals_pwr_valid)
-            s_valid_snr = tf.reduce_mean(ops.batch_snr(
-                s_src_signals, s_separated_signals_valid))
+        self.v_global_step = tf.train.get_or_create_global_step()
+        ozer = hparams.get_optimizer()(
+            learn_rate=self.v_learn_rate, lr_decay=hparams.LR_DECAY)
+        if self.sync_workers is not None:
+            ozer = tf.train.SyncReplicasOptimizer(
+                ozer,
+                replicas_to_aggregate=self.sync_workers,
+                total_num_replicas=self.sync_workers)
+        self.ozer = ozer
 
+        reger = hparams.get_regularizer()
+        towers = []
+        r_tower_grads_li = []
+        for i_tower in range(hparams.NUM_REPLICA):
+            with tf.device('/cpu:%d' % i_tower), tf.variable_scope(
+                    'global', regularizer=reger, reuse=bool(i_tower)):
+                tower = self.build_tower(
+                    s_src_signals_li[i_tower],
+                    s_mixed_signals_li[i_tower],
+                    s_dropout_keep,
+                    s_lengths_li[i_tower])
+                towers.append(tower)
+                v_params_li = tf.trainable_variables()
+                r_tower_grads_li.append(ozer.compute_gradients(
+                    tower['train_loss'], v_params_li))
+
+        def _tower_mean(key):
+            if hparams.NUM_REPLICA == 1:
+                return towers[0][key]
+            return tf.reduce_mean(tf.stack([t[key] for t in towers]))
+
+        s_train_loss = _tower_mean('train_loss')
+        s_train_snr = _tower_mean('train_snr')
+        s_valid_loss = _tower_mean('valid_loss')
+        s_valid_snr = _tower_mean('valid_snr')
+        s_separated_signals_valid = tf.concat(
+            [t['separated_signals_valid'] for t in towers], axis=0)
+        s_separated_signals_infer = tf.concat(
+            [t['separated_signals_infer'] for t in towers], axis=0)
 
         # ===============
         # prepare summary
@@ -351,16 +712,101 @@ class Model(object):
             s_lr_summary_v = tf.summary.scalar('LR', self.v_learn_rate)
 
         # apply optimizer
-        ozer = hparams.get_optimizer()(
-            learn_rate=self.v_learn_rate, lr_decay=hparams.LR_DECAY)
-
-        v_params_li = tf.trainable_variables()
-        r_apply_grads = ozer.compute_gradients(s_train_loss, v_params_li)
+        # all-reduce gradients of replicas, all of them share variables
+        r_apply_grads = ops.average_gradients(r_tower_grads_li)
         if hparams.GRAD_CLIP_THRES is not None:
             r_apply_grads = [(tf.clip_by_value(
                 g, -hparams.GRAD_CLIP_THRES, hparams.GRAD_CLIP_THRES), v)
                 for g, v in r_apply_grads if g is not None]
-        self.op_sgd_step = ozer.apply_gradients(r_apply_grads)
+        if hparams.GRAD_ACCUM_STEPS == 1:
+            self.op_sgd_step = ozer.apply_gradients(
+                r_apply_grads, global_step=self.v_global_step)
+        else:
+            # sum clipped gradients over micro-batches, then apply their
+            # mean once, so LR has the same meaning as with a single
+            # batch of size BATCH_SIZE * GRAD_ACCUM_STEPS
+            r_apply_grads = [
+                (tf.convert_to_tensor(g), v)
+                for g, v in r_apply_grads if g is not None]
+            # accumulators are local to each worker process
+            zero_init = tf.constant_initializer(0.)
+            local_vars = [tf.GraphKeys.LOCAL_VARIABLES]
+            with tf.device(self.worker_device), \
+                    tf.variable_scope('grad_accum'):
+                v_accum_cnt = tf.get_variable(
+                    'count', [], dtype=hparams.FLOATX,
+                    trainable=False, initializer=zero_init,
+                    collections=local_vars)
+                v_accum_li = [tf.get_variable(
+                    v.op.name, v.get_shape(), dtype=hparams.FLOATX,
+                    trainable=False, initializer=zero_init,
+                    collections=local_vars)
+                    for _, v in r_apply_grads]
+            self.op_accum_grads = tf.group(
+                tf.assign_add(v_accum_cnt, 1.),
+                *[tf.assign_add(a, g)
+                    for a, (g, _) in zip(v_accum_li, r_apply_grads)])
+            op_apply_accum = ozer.apply_gradients([
+                (a / tf.maximum(v_accum_cnt, 1.), v)
+                for a, (_, v) in zip(v_accum_li, r_apply_grads)],
+                global_step=self.v_global_step)
+            with tf.control_dependencies([op_apply_accum]):
+                self.op_sgd_step = tf.group(*[
+                    tf.assign(a, tf.zeros_like(a))
+                    for a in v_accum_li + [v_accum_cnt]])
+
+        # inference graphs use int8 encoder, if given a quantization table
+        quant_table = None
+        if hparams.QUANT_TABLE is not None:
+            quant_table = quantize.load_table(hparams.QUANT_TABLE)
+        quant_mode = None if quant_table is None else 'int8'
+
+        if hparams.WAVEFORM_INFER:
+            # raw waveform in, separated waveforms out, STFT in graph
+            s_mixed_wav = tf.placeholder(
+                hparams.FLOATX, [self.batch_size, None], name='mixed_wav')
+            s_wav_len = tf.shape(s_mixed_wav)[1]
+            s_wav_spectra = ops.stft(s_mixed_wav)
+            if hparams.NUM_REPLICA == 1:
+                s_wav_spectra_li = [s_wav_spectra]
+            else:
+                s_wav_spectra_li = tf.split(
+                    s_wav_spectra, hparams.NUM_REPLICA, axis=0)
+            s_separated_li = []
+            for i_tower in range(hparams.NUM_REPLICA):
+                with tf.device('/cpu:%d' % i_tower), tf.variable_scope(
+                        'global', reuse=True), quantize.quant_scope(
+                            quant_mode, quant_table):
+                    s_separated_li.append(
+                        self.build_infer(s_wav_spectra_li[i_tower]))
+            s_separated_wav = ops.istft(
+                tf.concat(s_separated_li, axis=0), s_wav_len)
+            self.wav_infer_feed_keys = [s_mixed_wav]
+            self.wav_infer_fetches = dict(signals=s_separated_wav)
+
+        if hparams.STREAM_INFER:
+            # one stream per batch row, only rows marked active are
+            # advanced by a run
+            s_stream_signals = tf.placeholder(
+                hparams.COMPLEXX,
+                [hparams.BATCH_SIZE, None, hparams.FEATURE_SIZE],
+                name='stream_signals')
+            self.s_stream_active = tf.placeholder(
+                tf.bool, [hparams.BATCH_SIZE], name='stream_active')
+            with tf.device('/cpu:0'), tf.variable_scope(
+                    'global', reuse=True), quantize.quant_scope(
+                        quant_mode, quant_table):
+                s_stream_separated = self.build_infer(
+                    s_stream_signals, stream=True)
+            self.stream_feed_keys = [s_stream_signals, self.s_stream_active]
+            self.stream_fetches = dict(signals=s_stream_separated)
+            # zeroes state of streams marked in s_stream_reset
+            self.s_stream_reset = tf.placeholder(
+                tf.bool, [hparams.BATCH_SIZE], name='stream_reset')
+            self.op_reset_stream = tf.group(*[
+                tf.assign(v, tf.where(
+                    self.s_stream_reset, tf.zeros_like(v), v))
+                for v in self.s_stream_states_di.values()])
 
         self.op_init_params = tf.variables_initializer(v_params_li)
         self.op_init_states = tf.variables_initializer(
@@ -374,49 +820,181 @@ class Model(object):
             train_summary,
             dict(loss=s_train_loss, SNR=s_train_snr, LR=self.v_learn_rate),
             self.op_sgd_step]
+        if hparams.GRAD_ACCUM_STEPS > 1:
+            # summary is written per optimizer update, see apply_accum_grads
+            self.accum_fetches = [
+                self.train_fetches[1], self.op_accum_grads]
 
         self.valid_feed_keys = self.train_feed_keys
         valid_summary = tf.summary.merge([s_loss_summary_v, s_snr_summary_v, s_lr_summary_v])
         self.valid_fetches = [
             valid_summary,
             dict(loss=s_valid_loss, SNR=s_valid_snr)]
-
-        self.infer_feed_keys = [s_mixed_signals, s_dropout_keep]
+        # separated signals in PIT order of sources, for BSS-eval
+        self.s_separated_signals_valid = s_separated_signals_valid
+
+        self.infer_feed_keys = [s_mixed_signals, s_dropout_keep, s_lengths]
+        # whether inference on padded batches matches unpadded one
+        self.infer_masks_padding = (
+            hparams.get_encoder().CAN_MASK and hparams.get_estimator(
+                hparams.INFER_ESTIMATOR_METHOD).CAN_MASK)
         self.infer_fetches = dict(signals=s_separated_signals_infer)
+        if quant_table is not None:
+            self.infer_feed_keys, self.infer_fetches = (
+                self.build_quant_infer('int8', quant_table))
 
         if hparams.DEBUG:
             self.debug_feed_keys = [s_src_signals, s_dropout_keep]
-            self.debug_fetches = dict(
-                embed=s_embed,
-                attrs=s_attractors,
-                input=s_src_signals,
-                output=s_separated_signals)
-            self.debug_fetches.update(encoder.debug_fetches)
-            self.debug_fetches.update(separator.debug_fetches)
-            if estimator is not None:
-                self.debug_fetches.update(estimator.debug_fetches)
+            self.debug_fetches = dict(input=s_src_signals)
+            self.debug_fetches.update(towers[0]['debug_fetches'])
 
+        self.v_params_li = v_params_li
         self.saver = tf.train.Saver(var_list=v_params_li)
+        # parameters, optimizer slots, learn rate and global step
+        self.v_state_li = tf.global_variables()
+        self.state_saver = tf.train.Saver(var_list=self.v_state_li)
 
 
-    def train(self, n_epoch, dataset):
+    def apply_accum_grads(self, writer, report, step):
+        '''
+        Applies accumulated gradients, writes summary averaged
+        over accumulated micro-batches
+
+        Args:
+            writer: summary writer
+            report: dict, summed fetches of micro-batches, with key "count"
+            step: integer, number of optimizer updates so far
+        '''
+        self.profiler.run(g_sess, self.op_sgd_step)
+        if not _summary_due(step):
+            return
+        count = report.pop('count')
+        step_summary = tf.Summary(value=[
+            tf.Summary.Value(
+                tag='train_summary/' + k, simple_value=float(v / count))
+            for k, v in report.items()])
+        writer.add_summary(step_summary, step)
+
+    def make_summary_writer(self, logdir=None):
+        '''
+        Args:
+            logdir: string, defaults to a new directory
+                under hparams.SUMMARY_DIR
+
+        Returns:
+            summary.AsyncSummaryWriter, or a no-op writer if not chief
+        '''
+        if not self.is_chief:
+            return _NullSummaryWriter()
+        if logdir is None:
+            logdir = os.path.join(
+                hparams.SUMMARY_DIR,
+                str(datetime.datetime.now().strftime("%m%d_%H%M%S")) + ' ' + hparams.SUMMARY_TITLE)
+        self.summary_logdir = logdir
+        return summary.AsyncSummaryWriter(
+            logdir,
+            tf.get_default_graph() if hparams.SUMMARY_GRAPH else None,
+            max_queue=hparams.SUMMARY_QUEUE_SIZE)
+
+    def make_telemetry(self, name, writer):
+        return telemetry.StepTelemetry(
+            name, writer, hparams.TELEMETRY_STEPS,
+            jsonl_file=(hparams.TELEMETRY_FILE if self.is_chief else None))
+
+    def train(self, n_epoch, dataset, resume_state=None):
+        '''
+        Args:
+            n_epoch: integer, total number of epochs
+            dataset: Dataset instance
+            resume_state: None or dict, as returned by load_state(),
+                continues training exactly from where it was saved
+        '''
         global g_args
-        train_writer = tf.summary.FileWriter(os.path.join(hparams.SUMMARY_DIR, str(datetime.datetime.now().strftime("%m%d_%H%M%S")) + ' ' + hparams.SUMMARY_TITLE), g_sess.graph)
+        train_writer = self.make_summary_writer()
+        train_telemetry = self.make_telemetry('train', train_writer)
+        valid_telemetry = self.make_telemetry('valid', train_writer)
+        # traces selected training session runs
+        self.profiler = profiling.Profiler(
+            profiling.parse_steps(g_args.profile_steps),
+            g_args.profile_dir, self.ozer.get_name())
         best_loss = float('+inf')
         best_loss_time = 0
-        self.set_learn_rate(hparams.LR)
-        print('Set learning rate to %f' % hparams.LR)
+        checkpointer = None
+        evaluator = None
+        if self.is_chief and (
+                not g_args.no_save_on_epoch or hparams.SAVE_STEPS):
+            protect = None
+            if g_args.valid_process:
+                # keep epoch checkpoints until evaluator is done with them
+                protect = lambda name: (
+                    checkpoint.EPOCH_CHECKPOINT_RE.match(name) and
+                    name not in checkpoint.read_evaluated(hparams.SAVE_DIR))
+            checkpointer = checkpoint.AsyncCheckpointer(
+                self.v_state_li, hparams.SAVE_DIR,
+                keep_last=hparams.SAVE_KEEP_LAST,
+                keep_best=hparams.SAVE_KEEP_BEST,
+                protect=protect)
+        if g_args.valid_process and self.is_chief:
+            if g_args.no_save_on_epoch:
+                raise ValueError(
+                    '--valid-process validates epoch checkpoints,'
+                    ' it can\'t be used with --no-save-on-epoch')
+            done_file = os.path.join(hparams.SAVE_DIR, checkpoint.DONE_FILE)
+            if os.path.exists(done_file):
+                os.remove(done_file)
+            evaluator = _spawn_evaluator(self.summary_logdir)
         train_step = 0
         valid_step = 0
-        for i_epoch in range(n_epoch):
+        start_epoch = 0
+        if resume_state is not None:
+            best_loss = resume_state['best_loss']
+            best_loss_time = resume_state['best_loss_time']
+            train_step = resume_state['train_step']
+            valid_step = resume_state['valid_step']
+            start_epoch = resume_state['i_epoch']
+            print('Resuming from epoch %d, batch %d, step %d' % (
+                start_epoch+1, resume_state['i_batch'], train_step))
+        elif self.is_chief:
+            self.set_learn_rate(hparams.LR)
+            print('Set learning rate to %f' % hparams.LR)
+
+        def training_state(i_epoch, i_batch, rng, cli_report):
+            # RNG state is the one epoch `i_epoch` starts from,
+            # its first `i_batch` batches are done
+            return dict(
+                i_epoch=i_epoch,
+                i_batch=i_batch,
+                rng=rng,
+                cli_report={k: float(v) for k, v in cli_report.items()},
+                train_step=train_step,
+                valid_step=valid_step,
+                best_loss=float(best_loss),
+                best_loss_time=best_loss_time)
+
+        # on SIGTERM, save a checkpoint after current step, then stop
+        self.stop_requested = False
+        def on_sigterm(signum, frame):
+            self.stop_requested = True
+        old_sigterm = signal.signal(signal.SIGTERM, on_sigterm)
+
+        for i_epoch in range(start_epoch, n_epoch):
             cli_report = OrderedDict()
+            accum_report = OrderedDict()
+            skip_batch = 0
+            if resume_state is not None and i_epoch == start_epoch:
+                checkpoint.set_rng_state(resume_state['rng'])
+                cli_report.update(resume_state['cli_report'])
+                skip_batch = resume_state['i_batch']
+            epoch_rng = checkpoint.get_rng_state()
             i_batch=0
-            for i_batch, data_pt in enumerate(dataset.epoch(
-                    'train',
-                    hparams.BATCH_SIZE * hparams.MAX_N_SIGNAL, shuffle=True)):
+            for i_batch, data_pt in enumerate(train_telemetry.iterate(
+                    dataset.epoch(
+                        'train',
+                        self.batch_size * hparams.MAX_N_SIGNAL,
+                        shuffle=True))):
                 spectra = np.reshape(
                     data_pt[0], [
-                        hparams.BATCH_SIZE,
+                        self.batch_size,
                         hparams.MAX_N_SIGNAL,
                         -1, hparams.FEATURE_SIZE])
                 if hparams.MAX_TRAIN_LEN is not None:
@@ -424,17 +1002,69 @@ class Model(object):
                         beg = randint(
                             0, spectra.shape[2] - hparams.MAX_TRAIN_LEN-1)
                         spectra = spectra[:, :, beg:beg+hparams.MAX_TRAIN_LEN]
+                if i_batch < skip_batch:
+                    # already trained on before resuming, replays
+                    # data and RNG only
+                    continue
                 to_feed = dict(
                     zip(self.train_feed_keys, (
                         spectra, hparams.DROPOUT_KEEP_PROB)))
-                step_summary, step_fetch = g_sess.run(
-                    self.train_fetches, to_feed)[:2]
-                self.reset_state()
-                train_writer.add_summary(step_summary, train_step)
-                train_step += 1
+                train_telemetry.mark('feed')
+                if hparams.GRAD_ACCUM_STEPS == 1:
+                    if _summary_due(train_step):
+                        step_summary, step_fetch = self.profiler.run(
+                            g_sess, self.train_fetches, to_feed)[:2]
+                        train_telemetry.mark('run')
+                        train_writer.add_summary(step_summary, train_step)
+                    else:
+                        step_fetch = self.profiler.run(
+                            g_sess, self.train_fetches[1:], to_feed)[0]
+                        train_telemetry.mark('run')
+                    self.reset_state()
+                    train_telemetry.mark('reset')
+                    train_step += 1
+                else:
+                    step_fetch = self.profiler.run(
+                        g_sess, self.accum_fetches, to_feed)[0]
+                    train_telemetry.mark('run')
+                    self.reset_state()
+                    train_telemetry.mark('reset')
+                    _dict_add(accum_report, step_fetch)
+                    _dict_add(accum_report, dict(count=1))
+                    if accum_report['count'] == hparams.GRAD_ACCUM_STEPS:
+                        self.apply_accum_grads(
+                            train_writer, accum_report, train_step)
+                        train_telemetry.mark('run')
+                        accum_report = OrderedDict()
+                        train_step += 1
                 stdout.write(':')
                 stdout.flush()
                 _dict_add(cli_report, step_fetch)
+                train_telemetry.end_step(spectra)
+                if accum_report:
+                    # only checkpoint between optimizer updates
+                    continue
+                if checkpointer is not None and (self.stop_requested or (
+                        hparams.SAVE_STEPS and
+                        train_step % hparams.SAVE_STEPS == 0)):
+                    checkpointer.save(
+                        g_sess, self.name + ('_s%d' % train_step),
+                        state=training_state(
+                            i_epoch, i_batch+1, epoch_rng, cli_report))
+                    stdout.write('s')
+                if self.stop_requested:
+                    break
+            if self.stop_requested:
+                stdout.write(
+                    '\nStopped at epoch %d/%d, step %d\n' % (
+                        i_epoch+1, n_epoch, train_step))
+                stdout.flush()
+                break
+            if accum_report:
+                # leftover micro-batches at end of epoch
+                self.apply_accum_grads(
+                    train_writer, accum_report, train_step)
+                train_step += 1
             _dict_mul(cli_report, 1. / (i_batch+1))
             if hparams.LR_DECAY_TYPE == 'adaptive':
                 if cli_report['loss'] < best_loss:
@@ -450,7 +1080,7 @@ class Model(object):
                 raise ValueError(
                     'Unknown LR_DECAY_TYPE "%s"' % hparams.LR_DECAY_TYPE)
 
-            if best_loss_time == hparams.NUM_EPOCH_PER_LR_DECAY:
+            if best_loss_time == hparams.NUM_EPOCH_PER_LR_DECAY and self.is_chief:
                 best_loss_time = 0
                 old_lr = self.get_learn_rate()
                 new_lr = old_lr * hparams.LR_DECAY
@@ -458,82 +1088,359 @@ class Model(object):
                 stdout.write('[LR %f -> %f]' % (old_lr, new_lr))
                 stdout.flush()
 
-            if not g_args.no_save_on_epoch:
+            if checkpointer is not None:
                 if any(map(isnan, cli_report.values())):
-                    if i_epoch:
+                    # step checkpoints of this epoch may hold NaN already
+                    last_save = checkpointer.latest(
+                        checkpoint.EPOCH_CHECKPOINT_RE)
+                    if last_save is not None:
                         stdout.write(
-                            '\nEpoch %d/%d got NAN values, restoring last checkpoint ... ')
+                            '\nEpoch %d/%d got NAN values, restoring %s ... ' % (
+                                i_epoch+1, n_epoch, last_save))
                         stdout.flush()
-                        i_epoch -= 1
-                        # FIXME: this path don't work windows
-                        self.load_params(
-                            'saves/' + self.name + ('_e%d' % (i_epoch+1)))
+                        # optimizer slots and LR diverged too
+                        self.state_saver.restore(g_sess, last_save)
                         stdout.write('done')
                         stdout.flush()
                         continue
                     else:
-                        stdout.write('\nRun into NAN during 1st epoch, exiting ...')
+                        stdout.write(
+                            '\nRun into NAN without epoch checkpoint'
+                            ' to restore, exiting ...')
+                        checkpointer.close()
                         sys.exit(-1)
-                self.save_params('saves/' + self.name + ('_e%d' % (i_epoch+1)))
-                stdout.write('S')
+                if not g_args.no_save_on_epoch:
+                    checkpointer.save(
+                        g_sess, self.name + ('_e%d' % (i_epoch+1)),
+                        metric=cli_report.get('loss'),
+                        state=training_state(
+                            i_epoch+1, 0,
+                            checkpoint.get_rng_state(), OrderedDict()))
+                    stdout.write('S')
             stdout.write('\nEpoch %d/%d %s\n' % (
                 i_epoch+1, n_epoch, _dict_format(cli_report)))
             stdout.flush()
-            if g_args.no_valid_on_epoch:
+            if g_args.no_valid_on_epoch or g_args.valid_process:
                 continue
-            cli_report = OrderedDict()
-            i_batch = 0
-            for i_batch, data_pt in enumerate(dataset.epoch(
+            cli_report, valid_step = self.run_valid(
+                dataset, train_writer, valid_telemetry, valid_step)
+            stdout.write('\nValid  %d/%d %s\n' % (
+                i_epoch+1, n_epoch, _dict_format(cli_report)))
+            stdout.flush()
+        signal.signal(signal.SIGTERM, old_sigterm)
+        if checkpointer is not None:
+            checkpointer.close()
+        if evaluator is not None:
+            open(done_file, 'w').close()
+            stdout.write('Waiting for evaluator to finish ... ')
+            stdout.flush()
+            evaluator.wait()
+            stdout.write('done\n')
+        train_telemetry.close()
+        valid_telemetry.close()
+        train_writer.close()
+        if self.profiler.num_traced:
+            print('Profile of %d steps, written to %s' % (
+                self.profiler.num_traced, g_args.profile_dir))
+            print(self.profiler.write_report())
+
+    def run_valid(self, dataset, writer, valid_telemetry, valid_step):
+        '''
+        Sweeps validation set
+
+        Args:
+            dataset: Dataset instance
+            writer: summary writer
+            valid_telemetry: StepTelemetry instance
+            valid_step: integer, summary step of first batch
+
+        Returns:
+            (cli_report, valid_step)
+            cli_report is a dict of averaged metrics,
+            valid_step is summary step after last batch
+        '''
+        cli_report = OrderedDict()
+        i_batch = 0
+        for i_batch, data_pt in enumerate(valid_telemetry.iterate(
+                dataset.epoch(
                     'valid',
-                    hparams.BATCH_SIZE * hparams.MAX_N_SIGNAL,
-                    shuffle=False)):
-                # note: this disables dropout during validation
-                to_feed = dict(
-                    zip(self.train_feed_keys, (
-                        np.reshape(
-                            data_pt[0], [
-                                hparams.BATCH_SIZE,
-                                hparams.MAX_N_SIGNAL,
-                                -1, hparams.FEATURE_SIZE]),
-                        1.)))
+                    self.batch_size * hparams.MAX_N_SIGNAL,
+                    shuffle=False))):
+            # note: this disables dropout during validation
+            spectra = np.reshape(
+                data_pt[0], [
+                    self.batch_size,
+                    hparams.MAX_N_SIGNAL,
+                    -1, hparams.FEATURE_SIZE])
+            to_feed = dict(
+                zip(self.train_feed_keys, (spectra, 1.)))
+            valid_telemetry.mark('feed')
+            if _summary_due(valid_step):
                 step_summary, step_fetch = g_sess.run(
                     self.valid_fetches, to_feed)[:2]
-                self.reset_state()
-                train_writer.add_summary(step_summary, valid_step)
-                valid_step+=1
-                stdout.write('.')
-                stdout.flush()
-                _dict_add(cli_report, step_fetch)
-            _dict_mul(cli_report, 1. / (i_batch+1))
-            stdout.write('\nValid  %d/%d %s\n' % (
-                i_epoch+1, n_epoch, _dict_format(cli_report)))
+                valid_telemetry.mark('run')
+                writer.add_summary(step_summary, valid_step)
+            else:
+                step_fetch = g_sess.run(
+                    self.valid_fetches[1:], to_feed)[0]
+                valid_telemetry.mark('run')
+            self.reset_state()
+            valid_telemetry.mark('reset')
+            valid_step+=1
+            stdout.write('.')
+            stdout.flush()
+            _dict_add(cli_report, step_fetch)
+            valid_telemetry.end_step(spectra)
+        _dict_mul(cli_report, 1. / (i_batch+1))
+        return cli_report, valid_step
+
+    def evaluate_checkpoints(
+            self, dataset, save_dir, poll_sec=10., trainer_pid=None):
+        '''
+        Validates each epoch checkpoint training writes into `save_dir`,
+        until training is over
+
+        Args:
+            dataset: Dataset instance
+            save_dir: string, checkpoint directory of training
+            poll_sec: float, seconds between looking for new checkpoints
+            trainer_pid: None or integer, process id of training, stops
+                once it's gone without finishing, e.g. killed
+        '''
+        global g_args
+        writer = self.make_summary_writer(g_args.summary_logdir)
+        valid_telemetry = self.make_telemetry('valid', writer)
+        done_file = os.path.join(save_dir, checkpoint.DONE_FILE)
+        valid_step = 0
+        while True:
+            is_done = os.path.exists(done_file)
+            pending = checkpoint.pending_evaluation(save_dir)
+            if not pending:
+                if is_done:
+                    break
+                if trainer_pid is not None and not _process_alive(
+                        trainer_pid):
+                    print('Training process %d is gone, stopping' % (
+                        trainer_pid))
+                    break
+                time.sleep(poll_sec)
+                continue
+            name = pending[0]
+            prefix = os.path.join(save_dir, name)
+            try:
+                self.load_params(prefix)
+            except tf.errors.NotFoundError:
+                print('Checkpoint %s was deleted before validation' % name)
+                checkpoint.mark_evaluated(save_dir, name)
+                continue
+            state = checkpoint.load_state(prefix) or {}
+            cli_report, valid_step = self.run_valid(
+                dataset, writer, valid_telemetry, valid_step)
+            writer.add_summary(tf.Summary(value=[
+                tf.Summary.Value(tag='valid_checkpoint/' + k, simple_value=v)
+                for k, v in cli_report.items()]),
+                state.get('train_step', valid_step))
+            stdout.write('\nValid  %s %s\n' % (
+                name, _dict_format(cli_report)))
             stdout.flush()
+            checkpoint.mark_evaluated(save_dir, name)
+        valid_telemetry.close()
+        writer.close()
 
     def test(self, dataset, subset='test', name='Test'):
+        '''
+        Sweeps `subset`, prints averaged loss and SNR
+
+        If --bss-eval is given, also writes SDR / SIR / SAR / SI-SNR
+        of each utterance and source into that CSV file. Those are
+        computed by a process pool while the sweep goes on.
+        '''
         global g_args
-        train_writer = tf.summary.FileWriter(
-            os.path.join(hparams.SUMMARY_DIR,
-                         str(datetime.datetime.now().strftime("%m%d_%H%M%S")) + ' ' + hparams.SUMMARY_TITLE), g_sess.graph)
+        train_writer = self.make_summary_writer()
+        test_telemetry = self.make_telemetry(subset, train_writer)
         cli_report = {}
-        for data_pt in dataset.epoch(
-                subset, hparams.BATCH_SIZE * hparams.MAX_N_SIGNAL):
+        bss_fetch = []
+        if g_args.bss_eval is not None:
+            bss_fetch = [self.s_separated_signals_valid]
+            num_workers = g_args.eval_workers or os.cpu_count() or 1
+            # spawn, as forking a process running TF session is unsafe
+            pool = multiprocessing.get_context('spawn').Pool(num_workers)
+            pending = deque()
+            bss_rows = []
+            csv_file = open(g_args.bss_eval, 'w', newline='')
+            csv_writer = csv.DictWriter(
+                csv_file, fieldnames=('utt', 'src') + bss_eval.METRICS)
+            csv_writer.writeheader()
+            def write_rows(result):
+                rows = result.get()
+                csv_writer.writerows(rows)
+                bss_rows.extend(rows)
+        i_batch = 0
+        for i_batch, data_pt in enumerate(test_telemetry.iterate(
+                dataset.epoch(
+                    subset, self.batch_size * hparams.MAX_N_SIGNAL))):
             # note: this disables dropout during test
+            spectra = np.reshape(data_pt[0], [self.batch_size, hparams.MAX_N_SIGNAL, -1, hparams.FEATURE_SIZE])
             to_feed = dict(
-                zip(self.train_feed_keys, (
-                    np.reshape(data_pt[0], [hparams.BATCH_SIZE, hparams.MAX_N_SIGNAL, -1, hparams.FEATURE_SIZE]),
-                    1.)))
-            step_summary, step_fetch = g_sess.run(
-                self.valid_fetches, to_feed)[:2]
-            train_writer.add_summary(step_summary)
+                zip(self.train_feed_keys, (spectra, 1.)))
+            test_telemetry.mark('feed')
+            if _summary_due(i_batch):
+                results = g_sess.run(self.valid_fetches + bss_fetch, to_feed)
+                step_summary, step_fetch = results[:2]
+                test_telemetry.mark('run')
+                train_writer.add_summary(step_summary, i_batch)
+            else:
+                results = g_sess.run(
+                    self.valid_fetches[1:] + bss_fetch, to_feed)
+                step_fetch = results[0]
+                test_telemetry.mark('run')
+            if bss_fetch:
+                pending.append(pool.apply_async(
+                    bss_eval.evaluate_batch, (
+                        spectra, results[-1], i_batch * self.batch_size,
+                        hparams.FFT_STRIDE, hparams.FFT_WND,
+                        g_args.bss_filter_len)))
+                # bounds memory held by queued batches
+                while len(pending) > 2 * num_workers:
+                    write_rows(pending.popleft())
+                test_telemetry.mark('bss_eval')
             stdout.write('.')
             stdout.flush()
             _dict_add(cli_report, step_fetch)
+            test_telemetry.end_step(spectra)
+        _dict_mul(cli_report, 1. / (i_batch+1))
+        test_telemetry.close()
+        train_writer.close()
         stdout.write(name + ': %s\n' % (
             _dict_format(cli_report)))
+        if bss_fetch:
+            while pending:
+                write_rows(pending.popleft())
+            pool.close()
+            pool.join()
+            csv_file.close()
+            aggregates = bss_eval.aggregate(bss_rows)
+            with open(os.path.splitext(
+                    g_args.bss_eval)[0] + '_summary.json', 'w') as f:
+                json.dump(aggregates, f, indent=2)
+            stdout.write(name + ' BSS-eval: %s\n' % (
+                _dict_format(aggregates)))
+
+    def train_batches(self, dataset):
+        '''
+        Endless training batches, as fed by time_steps, raises
+        ValueError if train subset has none
+
+        Args:
+            dataset: Dataset instance
+
+        Yields:
+            array of shape [batch_size, num_signals, length, feature_size]
+        '''
+        while True:
+            num_batches = 0
+            for data_pt in dataset.epoch(
+                    'train',
+                    self.batch_size * hparams.MAX_N_SIGNAL, shuffle=True):
+                num_batches += 1
+                spectra = np.reshape(
+                    data_pt[0], [
+                        self.batch_size,
+                        hparams.MAX_N_SIGNAL,
+                        -1, hparams.FEATURE_SIZE])
+                if hparams.MAX_TRAIN_LEN is not None:
+                    spectra = spectra[:, :, :hparams.MAX_TRAIN_LEN]
+                yield spectra
+            if not num_batches:
+                raise ValueError(
+                    'Train subset has no batch of %d utterances' % (
+                        self.batch_size * hparams.MAX_N_SIGNAL))
+
+    def synthetic_batches(self, length=None):
+        '''
+        Endless random batches, so timing doesn't need a dataset
+
+        Args:
+            length: integer, number of frames,
+                defaults to hparams.MAX_TRAIN_LEN or 128
+
+        Yields:
+            array of shape [batch_size, num_signals, length, feature_size]
+        '''
+        if length is None:
+            length = hparams.MAX_TRAIN_LEN or 128
+        shape = [
+            self.batch_size, hparams.MAX_N_SIGNAL,
+            length, hparams.FEATURE_SIZE]
+        while True:
+            spectra = np.random.randn(*shape) + 1j * np.random.randn(*shape)
+            yield spectra.astype(hparams.COMPLEXX)
+
+    def time_steps(self, batches, n_step, n_warmup=1, mode='train'):
+        '''
+        Measures throughput
+
+        Args:
+            batches: iterator of spectra, see train_batches
+            n_step: integer, number of timed steps
+            n_warmup: integer, number of untimed steps before timing
+            mode: string, "train" times optimizer steps,
+                "infer" times separation of mixtures
+
+        Returns:
+            dict, with wall time per step, utterances per second,
+            and real-time factor (seconds of audio per wall second)
+
+        Notes:
+            With hparams.GRAD_ACCUM_STEPS > 1, a training step is one
+            optimizer update, as in train(): that many micro-batches
+            accumulated, then applied
+        '''
+        if mode not in ('train', 'infer'):
+            raise ValueError('Unknown mode "%s"' % mode)
+        num_micro = hparams.GRAD_ACCUM_STEPS if mode == 'train' else 1
+        num_frames = 0
+        t_beg = None
+        for i_step in range(n_warmup + n_step):
+            if i_step == n_warmup:
+                t_beg = time.perf_counter()
+            for i_micro in range(num_micro):
+                spectra = next(batches)
+                if i_step >= n_warmup:
+                    num_frames += spectra.shape[0] * spectra.shape[2]
+                if mode == 'infer':
+                    g_sess.run(
+                        self.infer_fetches,
+                        dict(zip(self.infer_feed_keys, (
+                            np.sum(spectra, axis=1), 1.))))
+                else:
+                    to_feed = dict(zip(self.train_feed_keys, (
+                        spectra, hparams.DROPOUT_KEEP_PROB)))
+                    if num_micro == 1:
+                        g_sess.run(self.op_sgd_step, to_feed)
+                    else:
+                        g_sess.run(self.accum_fetches, to_feed)
+                self.reset_state()
+            if num_micro > 1:
+                g_sess.run(self.op_sgd_step)
+        t_total = time.perf_counter() - t_beg
+        t_step = t_total / n_step
+        audio_sec = num_frames * hparams.FFT_STRIDE / hparams.SMPRATE
+        return dict(
+            mode=mode,
+            replicas=hparams.NUM_REPLICA,
+            intra_op_threads=hparams.INTRA_OP_THREADS,
+            inter_op_threads=hparams.INTER_OP_THREADS,
+            sec_per_step=t_step,
+            steps_per_sec=1. / t_step,
+            utt_per_sec=self.batch_size * num_micro / t_step,
+            real_time_factor=audio_sec / t_total)
 
     def reset(self):
         '''re-initialize parameters, resets timestep'''
-        g_sess.run(tf.global_variables_initializer())
+        g_sess.run([
+            tf.global_variables_initializer(),
+            tf.local_variables_initializer()])
 
     def reset_state(self):
         '''reset RNN states'''
@@ -548,14 +1455,508 @@ class Model(object):
             reduce(int.__mul__, v.get_shape().as_list()) for v in v_vars_li)
 
 
+def _run_throughput(*args):
+    '''
+    Runs "throughput" mode in a fresh local process, with current CLI
+    arguments plus `args`
+
+    Returns:
+        dict, result of Model.time_steps
+    '''
+    proc = subprocess.run(
+        [sys.executable, __file__] + sys.argv[1:] + [
+            '-m', 'throughput'] + list(args),
+        stdout=subprocess.PIPE, check=True, universal_newlines=True)
+    return json.loads(proc.stdout.strip().split('\n')[-1])
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _spawn_evaluator(logdir):
+    '''
+    Starts "evaluator" mode in a local process, with current CLI
+    arguments, writing summaries into `logdir`
+
+    Returns:
+        subprocess.Popen
+    '''
+    return subprocess.Popen(
+        [sys.executable, __file__] + sys.argv[1:] + [
+            '-m', 'evaluator',
+            '--summary-logdir', logdir,
+            '--trainer-pid', str(os.getpid()),
+            '--intra-op-threads', str(g_args.evaluator_threads),
+            '--inter-op-threads', '1'])
+
+
+def _separate_long(model, filename, out_names):
+    '''
+    Separates one WAV file in overlapping chunks of --chunk-frames,
+    separated signals are written as they come, so memory doesn't grow
+    with file length
+
+    Returns:
+        OrderedDict, timing of this file
+    '''
+    t_beg = time.perf_counter()
+    num_frames = utils.wav_num_frames(filename)
+    istft = utils.StreamingIstft(
+        num_frames, hparams.FFT_STRIDE, hparams.FFT_WND)
+
+    def run_batch(batch, lengths):
+        signals = g_sess.run(
+            model.infer_fetches,
+            dict(zip(model.infer_feed_keys, (batch, 1., lengths))))['signals']
+        model.reset_state()
+        return signals
+
+    writers = []
+    for out_name in out_names:
+        out_dir = os.path.dirname(out_name)
+        if out_dir and not os.path.exists(out_dir):
+            os.makedirs(out_dir, exist_ok=True)
+        writers.append(chunked_infer.WavWriter(out_name, hparams.SMPRATE))
+    first_output_sec = None
+    for signals in chunked_infer.separate_stream(
+            run_batch,
+            utils.stream_wavfile(filename, g_args.chunk_frames),
+            g_args.chunk_frames, g_args.chunk_overlap,
+            model.batch_size, hparams.LENGTH_ALIGN):
+        for writer, data in zip(writers, istft.push(signals)):
+            writer.write(data)
+        if first_output_sec is None:
+            first_output_sec = time.perf_counter() - t_beg
+    for writer in writers:
+        writer.close()
+    wall_sec = time.perf_counter() - t_beg
+    audio_sec = num_frames * hparams.FFT_STRIDE / hparams.SMPRATE
+    return OrderedDict(
+        audio_sec=audio_sec,
+        wall_sec=wall_sec,
+        first_output_sec=first_output_sec,
+        real_time_factor=audio_sec / wall_sec)
+
+
+def _make_infer_cache(model):
+    '''
+    Returns:
+        InferenceCache in hparams.INFER_CACHE_DIR, or None if disabled
+    '''
+    if hparams.INFER_CACHE_DIR is None:
+        return None
+    if g_args.input_pfile is None:
+        print('Warning: no parameters loaded via -i, inference cache disabled')
+        return None
+    if not model.infer_masks_padding:
+        # results would depend on what else was in the batch
+        print('Warning: padding can\'t be masked, inference cache disabled')
+        return None
+    return infer_cache.InferenceCache(
+        hparams.INFER_CACHE_DIR,
+        infer_cache.model_key(g_args.input_pfile, hparams),
+        max_disk_bytes=int(hparams.INFER_CACHE_MAX_MB * (1 << 20)),
+        max_memory_bytes=int(hparams.INFER_CACHE_MEMORY_MB * (1 << 20)))
+
+
+def _serve(model):
+    '''
+    Serves separation requests until interrupted, model is built and
+    loaded only once, concurrent requests are batched together
+    '''
+    def run_batch(batch, lengths):
+        signals = g_sess.run(
+            model.infer_fetches,
+            dict(zip(model.infer_feed_keys, (batch, 1., lengths))))['signals']
+        model.reset_state()
+        return signals
+
+    if not model.infer_masks_padding:
+        print('Warning: encoder or estimator can\'t mask padding, '
+              'separation of a request depends on others in its batch')
+    metrics = server.ServerMetrics()
+    batcher = server.DynamicBatcher(
+        run_batch, model.batch_size, hparams.LENGTH_ALIGN,
+        max_wait_sec=g_args.max_wait_ms / 1e3,
+        max_batch_frames=g_args.max_batch_frames,
+        metrics=metrics)
+    httpd = server.make_server(
+        server.ServerApp(
+            batcher, metrics, utils.preprocess_wav,
+            lambda signals: utils.istft(
+                signals, hparams.FFT_STRIDE, hparams.FFT_WND).astype(
+                    hparams.FLOATX),
+            hparams.SMPRATE, cache=_make_infer_cache(model)),
+        port=g_args.port, unix_socket=g_args.unix_socket)
+    print('Serving on %s' % (
+        g_args.unix_socket or 'http://127.0.0.1:%d' % g_args.port))
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    httpd.server_close()
+    batcher.stop()
+
+
+def _stream_file(model):
+    '''
+    Separates --input-file block by block with a StreamSession, as
+    live audio would be, prints per-block compute time and latency
+    '''
+    if g_args.input_file is None:
+        raise ValueError('"stream" mode needs input file via -if')
+    session = streaming.StreamSession(model, g_sess)
+    stream = session.open()
+    istft = utils.StreamingIstft(
+        utils.wav_num_frames(g_args.input_file),
+        hparams.FFT_STRIDE, hparams.FFT_WND)
+    filename, fileext = os.path.splitext(g_args.input_file)
+    writers = [
+        chunked_infer.WavWriter(
+            filename + ('_separated_%d' % (i+1)) + fileext, hparams.SMPRATE)
+        for i in range(hparams.MAX_N_SIGNAL)]
+    block_sec = g_args.stream_block * hparams.FFT_STRIDE / hparams.SMPRATE
+    run_sec = []
+    for block in utils.stream_wavfile(g_args.input_file, g_args.stream_block):
+        t_beg = time.perf_counter()
+        signals = session.push({stream: block})[stream]
+        run_sec.append(time.perf_counter() - t_beg)
+        for writer, data in zip(writers, istft.push(signals)):
+            writer.write(data)
+    for writer in writers:
+        writer.close()
+    session.close(stream)
+    run_sec = np.asarray(run_sec)
+    result = OrderedDict(
+        num_blocks=len(run_sec),
+        block_ms=1e3 * block_sec,
+        latency_ms=1e3 * (block_sec + hparams.FFT_SIZE / hparams.SMPRATE),
+        compute_ms_mean=1e3 * float(np.mean(run_sec)),
+        compute_ms_p95=1e3 * float(np.percentile(run_sec, 95)),
+        compute_ms_max=1e3 * float(np.max(run_sec)),
+        real_time_factor=block_sec * len(run_sec) / float(np.sum(run_sec)))
+    print(json.dumps(result))
+
+
+def _separate_files(model):
+    '''
+    Separates WAV files given by --input-dir / --manifest, in batches
+    of similar length. Loading of next batch, and writing of separated
+    signals on a process pool, overlap with model execution.
+    '''
+    filenames = batch_infer.list_inputs(g_args.input_dir, g_args.manifest)
+    todo = []
+    for filename in filenames:
+        out_names = batch_infer.output_names(
+            filename, g_args.input_dir, g_args.output_dir,
+            hparams.MAX_N_SIGNAL)
+        if all(map(os.path.exists, out_names)):
+            continue
+        todo.append((filename, out_names))
+    print('%d input files, %d to separate' % (len(filenames), len(todo)))
+    num_files = len(todo)
+    num_skipped = len(filenames) - len(todo)
+    if not todo:
+        return
+    lengths = [utils.wav_num_frames(filename) for filename, _ in todo]
+    audio_sec = 0.
+    t_beg = time.perf_counter()
+    if g_args.chunk_frames is not None:
+        # files longer than a chunk are separated one by one in chunks
+        is_long = [l > g_args.chunk_frames for l in lengths]
+        long_todo = [x for x, y in zip(todo, is_long) if y]
+        lengths = [l for l, y in zip(lengths, is_long) if not y]
+        todo = [x for x, y in zip(todo, is_long) if not y]
+        for filename, out_names in long_todo:
+            long_result = _separate_long(model, filename, out_names)
+            audio_sec += long_result['audio_sec']
+            print(json.dumps(long_result))
+    num_batches = 0
+    cache = None
+    if todo:
+        cache = _make_infer_cache(model)
+        batches_audio_sec, num_batches = _separate_batches(
+            model, todo, lengths, cache)
+        audio_sec += batches_audio_sec
+    wall_sec = time.perf_counter() - t_beg
+    result = OrderedDict(
+        num_files=num_files,
+        num_skipped=num_skipped,
+        num_batches=num_batches,
+        wall_sec=wall_sec,
+        files_per_sec=num_files / wall_sec,
+        real_time_factor=audio_sec / wall_sec)
+    if cache is not None:
+        result['cache'] = cache.report()
+    stdout.write('\n')
+    print(json.dumps(result))
+
+
+def _separate_batches(model, todo, lengths, cache):
+    '''
+    Separates files of `_separate_files` short enough to be batched
+
+    Args:
+        todo: list of (filename, output names)
+        lengths: list of integer, STFT frames of each file
+        cache: None or InferenceCache
+
+    Returns:
+        (audio_sec, num_batches), seconds of audio written per source
+    '''
+    buckets = batch_infer.make_buckets(lengths, model.batch_size)
+    if not model.infer_masks_padding:
+        print('Warning: encoder or estimator can\'t mask padding, '
+              'separation of a file depends on others in its batch')
+
+    num_workers = g_args.write_workers or os.cpu_count() or 1
+    # spawn, as forking a process running TF session is unsafe
+    pool = multiprocessing.get_context('spawn').Pool(num_workers)
+    loader = ThreadPool(1)
+    load_bucket = lambda idx_li: [
+        utils.load_wavfile(todo[i][0]) for i in idx_li]
+    pending = deque()
+    audio_sec = 0.
+    next_load = loader.apply_async(load_bucket, (buckets[0],))
+    for i_bucket, idx_li in enumerate(buckets):
+        spectra_li = next_load.get()
+        if i_bucket + 1 < len(buckets):
+            next_load = loader.apply_async(
+                load_bucket, (buckets[i_bucket + 1],))
+        signals_li = [None] * len(spectra_li)
+        if cache is not None:
+            keys = [cache.key(x) for x in spectra_li]
+            signals_li = [cache.get(k) for k in keys]
+        misses = [j for j, x in enumerate(signals_li) if x is None]
+        if misses:
+            miss_spectra_li = [spectra_li[j] for j in misses]
+            batch = batch_infer.pad_batch(
+                miss_spectra_li, model.batch_size, hparams.LENGTH_ALIGN)
+            signals = g_sess.run(
+                model.infer_fetches,
+                dict(zip(model.infer_feed_keys, (
+                    batch, 1.,
+                    batch_infer.batch_lengths(miss_spectra_li, batch)))))[
+                        'signals']
+            model.reset_state()
+            for k, j in enumerate(misses):
+                signals_li[j] = signals[k, :, :len(spectra_li[j])]
+                if cache is not None:
+                    cache.put(keys[j], signals_li[j])
+        pending.append(pool.apply_async(
+            batch_infer.write_separated, (
+                [todo[i][1] for i in idx_li], signals_li,
+                hparams.FFT_STRIDE, hparams.FFT_WND, hparams.SMPRATE)))
+        # bounds memory held by queued batches
+        while len(pending) > 2 * num_workers:
+            audio_sec += pending.popleft().get()
+        stdout.write('.')
+        stdout.flush()
+    while pending:
+        audio_sec += pending.popleft().get()
+    pool.close()
+    pool.join()
+    loader.close()
+    return audio_sec, len(buckets)
+
+
+def _quantize(model, dataset):
+    '''
+    Post-training int8 quantization of encoder linear layers
+
+    Input ranges are calibrated over --calib-batches validation batches,
+    quantization table is written into -o. Then float and int8 inference
+    are compared over --quant-eval-batches test batches: SDR, run time
+    and model size are printed as JSON, also written next to the table.
+    '''
+    if g_args.input_pfile is None:
+        raise ValueError('"quantize" mode needs trained parameters via -i')
+    if g_args.output_pfile is None:
+        raise ValueError('"quantize" mode needs output file via -o')
+    def batches(subset, num_batches):
+        for i_batch, data_pt in enumerate(dataset.epoch(
+                subset, model.batch_size * hparams.MAX_N_SIGNAL)):
+            if i_batch == num_batches:
+                break
+            yield np.reshape(data_pt[0], [
+                model.batch_size, hparams.MAX_N_SIGNAL,
+                -1, hparams.FEATURE_SIZE])
+
+    calib_feed_keys, calib_fetches = model.build_quant_infer('calibrate')
+    g_sess.run(tf.variables_initializer(quantize.observer_variables()))
+    num_calib = 0
+    for spectra in batches('valid', g_args.calib_batches):
+        g_sess.run(calib_fetches, dict(zip(
+            calib_feed_keys, (np.sum(spectra, axis=1), 1.))))
+        model.reset_state()
+        num_calib += 1
+    table = quantize.calibrated_table(g_sess)
+    table_file = g_args.output_pfile
+    if not table_file.endswith('.npz'):
+        table_file += '.npz'
+    quantize.save_table(table_file, table)
+
+    int8_feed_keys, int8_fetches = model.build_quant_infer('int8', table)
+    paths = OrderedDict(
+        float=(model.infer_feed_keys, model.infer_fetches),
+        int8=(int8_feed_keys, int8_fetches))
+    bss_rows = {key: [] for key in paths}
+    run_sec = {key: [] for key in paths}
+    utt_offset = 0
+    for spectra in batches('test', g_args.quant_eval_batches):
+        for key, (feed_keys, fetches) in paths.items():
+            t_beg = time.perf_counter()
+            signals = g_sess.run(fetches, dict(zip(
+                feed_keys, (np.sum(spectra, axis=1), 1.))))['signals']
+            run_sec[key].append(time.perf_counter() - t_beg)
+            model.reset_state()
+            # separated signals are in arbitrary order
+            signals = np.stack([
+                x[chunked_infer.align_permutation(src, x)]
+                for src, x in zip(spectra, signals)])
+            bss_rows[key].extend(bss_eval.evaluate_batch(
+                spectra, signals, utt_offset,
+                hparams.FFT_STRIDE, hparams.FFT_WND))
+        utt_offset += len(spectra)
+    if not utt_offset:
+        raise ValueError('Test set is empty')
+
+    itemsize = np.dtype(hparams.FLOATX).itemsize
+    size = quantize.size_report(table, itemsize)
+    model_bytes = itemsize * sum(
+        v.get_shape().num_elements() for v in model.v_params_li)
+    quant_model_bytes = model_bytes - size['float_bytes'] + size['int8_bytes']
+    result = OrderedDict(
+        table=table_file,
+        num_layers=size['num_layers'],
+        num_weights=size['num_weights'],
+        calib_batches=num_calib,
+        num_utt=utt_offset,
+        weights_mb_float=size['float_bytes'] / 2.**20,
+        weights_mb_int8=size['int8_bytes'] / 2.**20,
+        model_mb_float=model_bytes / 2.**20,
+        model_mb_int8=quant_model_bytes / 2.**20,
+        size_reduction=model_bytes / quant_model_bytes)
+    for key in paths:
+        aggregates = bss_eval.aggregate(bss_rows[key])
+        result['sdr_' + key] = aggregates['sdr_mean']
+        result['si_snr_' + key] = aggregates['si_snr_mean']
+        # first run includes one-time setup, such as weight packing
+        result['sec_per_batch_' + key] = float(
+            np.median(run_sec[key][1:] or run_sec[key]))
+    result['sdr_drop'] = result['sdr_float'] - result['sdr_int8']
+    result['si_snr_drop'] = result['si_snr_float'] - result['si_snr_int8']
+    result['speedup'] = (
+        result['sec_per_batch_float'] / result['sec_per_batch_int8'])
+    with open(os.path.splitext(table_file)[0] + '_report.json', 'w') as f:
+        json.dump(result, f, indent=2)
+    print(json.dumps(result))
+
+
+def _scaling_report():
+    '''
+    Runs training throughput measurement in local processes with 1 and
+    hparams.NUM_REPLICA replicas, prints scaling efficiency as JSON
+    '''
+    results = [
+        _run_throughput('-nr', str(num_replica))
+        for num_replica in sorted({1, hparams.NUM_REPLICA})]
+    base = results[0]['utt_per_sec']
+    for r in results:
+        r['speedup'] = r['utt_per_sec'] / base
+        r['efficiency'] = r['speedup'] / r['replicas']
+    print(json.dumps(results))
+
+
+def _autotune():
+    '''
+    Times training or inference steps over a grid of thread-pool
+    settings, each in a fresh process, writes the fastest one to JSON
+    '''
+    fn_time = lambda intra_op, inter_op: _run_throughput(
+        '--intra-op-threads', str(intra_op),
+        '--inter-op-threads', str(inter_op))['sec_per_step']
+    log = lambda msg: print(msg, flush=True)
+    best, _ = runtime.autotune(
+        fn_time, runtime.thread_candidates(), log=log)
+    runtime.write_config(g_args.autotune_output, best)
+    print('Best setting %s written to %s' % (
+        _dict_format(best), g_args.autotune_output))
+
+
+def _xla_report():
+    '''
+    For every registered encoder, times steps with and without XLA JIT,
+    each in a fresh process, prints results as JSON
+    '''
+    xla_jit = hparams.XLA_JIT or 'global'
+    results = []
+    for encoder_type in sorted(hparams.encoder_registry):
+        result = dict(encoder=encoder_type, xla_jit=xla_jit)
+        for key, jit_arg in [('base', 'none'), ('xla', xla_jit)]:
+            result[key + '_sec_per_step'] = _run_throughput(
+                '--encoder-type', encoder_type,
+                '--xla-jit', jit_arg)['sec_per_step']
+        result['speedup'] = (
+            result['base_sec_per_step'] / result['xla_sec_per_step'])
+        print(_dict_format(result), file=sys.stderr, flush=True)
+        results.append(result)
+    print(json.dumps(results))
+
+
+def _bench(model, dataset, build_sec):
+    '''
+    Times training steps and inference calls of built model,
+    prints results as JSON
+    '''
+    result = OrderedDict(
+        mode='bench',
+        hparams_file=g_args.hparams_file,
+        encoder=hparams.ENCODER_TYPE,
+        separator=hparams.SEPARATOR_TYPE,
+        batch_size=model.batch_size,
+        data='synthetic' if dataset is None else hparams.DATASET_TYPE,
+        num_steps=g_args.num_steps,
+        build_sec=build_sec)
+    for mode in ['train', 'infer']:
+        if dataset is None:
+            batches = model.synthetic_batches()
+        else:
+            batches = model.train_batches(dataset)
+        r = model.time_steps(
+            batches, g_args.num_steps, n_warmup=g_args.num_warmup, mode=mode)
+        for key in ['sec_per_step', 'steps_per_sec',
+                    'utt_per_sec', 'real_time_factor']:
+            result['%s_%s' % (mode, key)] = r[key]
+    # ru_maxrss is in KiB on Linux
+    result['peak_rss_mb'] = resource.getrusage(
+        resource.RUSAGE_SELF).ru_maxrss / 1024.
+    print(_dict_format(result), file=sys.stderr, flush=True)
+    if g_args.bench_output is not None:
+        with open(g_args.bench_output, 'a') as f:
+            f.write(json.dumps(result) + '\n')
+    print(json.dumps(result))
+
+
 def main():
-    global g_args, g_model, g_dataset
+    global g_sess, g_args, g_model, g_dataset
     parser = argparse.ArgumentParser()
     parser.add_argument('-n', '--name',
         default='UnnamedExperiment',
         help='name of experiment, affects checkpoint saves')
     parser.add_argument('-m', '--mode',
-        default='train', help='Mode, "train", "valid", "test", "demo" or "interactive"')
+        default='train',
+        help='Mode, "train", "valid", "test", "demo", "interactive",'
+        ' "throughput", "bench", "scaling", "autotune", "xla-bench"'
+        ' "evaluator", "separate", "export", "stream", "serve"'
+        ' or "quantize"')
     parser.add_argument('-i', '--input-pfile',
         help='path to input model parameter file')
     parser.add_argument('-o', '--output-pfile',
@@ -566,9 +1967,103 @@ def main():
         type=int, default=10, help='number of training epoch')
     parser.add_argument('--no-save-on-epoch',
         action='store_true', help="don't save parameter after each epoch")
+    parser.add_argument('--save-dir',
+        help='directory of checkpoints saved during training,'
+        ' overrides hparams.SAVE_DIR')
+    parser.add_argument('--save-steps',
+        help='also checkpoint full training state every this many'
+        ' optimizer steps, overrides hparams.SAVE_STEPS')
+    parser.add_argument('--resume',
+        help='checkpoint to resume training from,'
+        ' or "latest" for latest one in hparams.SAVE_DIR')
+    parser.add_argument('-ss', '--summary-steps',
+        help='write summary every this many steps,'
+        ' overrides hparams.SUMMARY_STEPS')
+    parser.add_argument('--no-summary-graph',
+        action='store_true',
+        help="don't write graph definition into summary,"
+        " sets hparams.SUMMARY_GRAPH to false")
+    parser.add_argument('--telemetry-file',
+        help='append step time / throughput reports to this JSONL file,'
+        ' overrides hparams.TELEMETRY_FILE')
+    parser.add_argument('--profile-steps',
+        help='training steps to trace, such as "10,20-22",'
+        ' counted by session runs from start of training')
+    parser.add_argument('--profile-dir',
+        default='profile',
+        help='directory to write timelines and profile report')
     parser.add_argument('--no-valid-on-epoch',
         action='store_true',
         help="don't sweep validation set after training epoch")
+    parser.add_argument('--valid-process',
+        action='store_true',
+        help='validate epoch checkpoints in a separate "evaluator"'
+        ' process, instead of pausing training')
+    parser.add_argument('--evaluator-threads',
+        type=int, default=1,
+        help='intra-op threads of evaluator process')
+    parser.add_argument('--summary-logdir',
+        help='"evaluator" mode, summary directory of training run')
+    parser.add_argument('--trainer-pid',
+        type=int,
+        help='"evaluator" mode, stop once this training process is gone')
+    parser.add_argument('--bss-eval',
+        help='"test" / "valid" mode, write per-utterance SDR, SIR, SAR'
+        ' and SI-SNR to this CSV file, aggregates to *_summary.json')
+    parser.add_argument('--eval-workers',
+        type=int, default=0,
+        help='number of processes computing BSS-eval, 0 for all CPUs')
+    parser.add_argument('--bss-filter-len',
+        type=int, default=512,
+        help='length of BSS-eval distortion filters, in samples')
+    parser.add_argument('--input-dir',
+        help='"separate" mode, directory of WAV files, searched recursively')
+    parser.add_argument('--manifest',
+        help='"separate" mode, text file listing one WAV file per line')
+    parser.add_argument('--output-dir',
+        default='separated',
+        help='"separate" mode, directory to write separated signals into,'
+        ' files with all outputs present are skipped')
+    parser.add_argument('--write-workers',
+        type=int, default=0,
+        help='"separate" mode, number of processes writing outputs,'
+        ' 0 for all CPUs')
+    parser.add_argument('--chunk-frames',
+        type=int, default=None,
+        help='"separate" and "demo" modes, separate files longer than'
+        ' this many STFT frames in overlapping chunks of this size')
+    parser.add_argument('--chunk-overlap',
+        type=int, default=64,
+        help='frames shared by consecutive chunks, see --chunk-frames')
+    parser.add_argument('--infer-cache',
+        help='"separate" and "serve" modes, directory caching separated'
+        ' spectra by content hash, overrides hparams.INFER_CACHE_DIR')
+    parser.add_argument('--port',
+        type=int, default=8000,
+        help='"serve" mode, TCP port on localhost')
+    parser.add_argument('--unix-socket',
+        help='"serve" mode, listen on this unix socket instead of TCP')
+    parser.add_argument('--max-wait-ms',
+        type=float, default=10.,
+        help='"serve" mode, longest time a request waits for others'
+        ' to be batched with')
+    parser.add_argument('--max-batch-frames',
+        type=int, default=None,
+        help='"serve" mode, limit of batch size times padded length')
+    parser.add_argument('--calib-batches',
+        type=int, default=32,
+        help='"quantize" mode, number of validation batches'
+        ' to calibrate input ranges on')
+    parser.add_argument('--quant-eval-batches',
+        type=int, default=16,
+        help='"quantize" mode, number of test batches to compare'
+        ' float and int8 inference on')
+    parser.add_argument('--quant-table',
+        help='quantization table written by "quantize" mode, runs'
+        ' inference with int8 encoder, overrides hparams.QUANT_TABLE')
+    parser.add_argument('--stream-block',
+        type=int, default=16,
+        help='"stream" mode, number of STFT frames per block')
     parser.add_argument('-if', '--input-file',
         help='input WAV file for "demo" mode')
     parser.add_argument('-ds', '--dataset',
@@ -579,10 +2074,58 @@ def main():
         help='segment length during training, overrides hparams.MAX_TRAIN_LEN')
     parser.add_argument('-bs', '--batch-size',
         help='set batch size, overrides hparams.BATCH_SIZE')
+    parser.add_argument('-nr', '--num-replica',
+        help='number of data-parallel replicas on CPU,'
+        ' overrides hparams.NUM_REPLICA')
+    parser.add_argument('-ns', '--num-steps',
+        type=int, default=20,
+        help='number of timed steps for "throughput" and "bench" mode')
+    parser.add_argument('--num-warmup',
+        type=int, default=3,
+        help='number of untimed steps before timing in "bench" mode')
+    parser.add_argument('--synthetic',
+        action='store_true',
+        help='"bench" mode, time random batches instead of dataset')
+    parser.add_argument('--bench-output',
+        help='"bench" mode, append JSON result as a line to this file')
+    parser.add_argument('--throughput-of',
+        default='train', choices=['train', 'infer'],
+        help='what to time in "throughput" and "autotune" mode')
+    parser.add_argument('--intra-op-threads',
+        help='threads used within an op, 0 for auto,'
+        ' overrides hparams.INTRA_OP_THREADS')
+    parser.add_argument('--inter-op-threads',
+        help='threads used to run independent ops, 0 for auto,'
+        ' overrides hparams.INTER_OP_THREADS')
+    parser.add_argument('-et', '--encoder-type',
+        help='overrides hparams.ENCODER_TYPE')
+    parser.add_argument('--xla-jit',
+        help='"none", "global" or comma separated model scopes'
+        ' (%s) to compile with XLA, overrides hparams.XLA_JIT' % (
+            ', '.join(runtime.JIT_SCOPES)))
+    parser.add_argument('--autotune-output',
+        default='runtime.json',
+        help='JSON file "autotune" mode writes best setting into,'
+        ' use it with -c afterwards')
+    parser.add_argument('--job-name',
+        help='distributed mode, "ps" or "worker"')
+    parser.add_argument('--task-index',
+        type=int, default=0,
+        help='distributed mode, index of task within its job,'
+        ' worker 0 is chief')
+    parser.add_argument('--ps-hosts',
+        help='distributed mode, comma separated list of host:port')
+    parser.add_argument('--worker-hosts',
+        help='distributed mode, comma separated list of host:port')
+    parser.add_argument('--sync-replicas',
+        action='store_true',
+        help='distributed mode, aggregate gradients of all workers'
+        ' before each update, otherwise update asynchronously')
+    parser.add_argument('-ga', '--grad-accum-steps',
+        help='number of micro-batches per optimizer update,'
+        ' overrides hparams.GRAD_ACCUM_STEPS')
     g_args = parser.parse_args()
 
-    # TODO manage device
-
     # load hparams from default JSON file
     hparams.load_json('default.json')
 
@@ -602,15 +2145,84 @@ def main():
     if g_args.batch_size is not None:
         hparams.BATCH_SIZE = int(g_args.batch_size)
         assert hparams.BATCH_SIZE > 0
+    if g_args.grad_accum_steps is not None:
+        hparams.GRAD_ACCUM_STEPS = int(g_args.grad_accum_steps)
+    if g_args.num_replica is not None:
+        hparams.NUM_REPLICA = int(g_args.num_replica)
+    if g_args.save_dir is not None:
+        hparams.SAVE_DIR = g_args.save_dir
+    if g_args.infer_cache is not None:
+        hparams.INFER_CACHE_DIR = g_args.infer_cache
+    if g_args.quant_table is not None:
+        hparams.QUANT_TABLE = g_args.quant_table
+    if g_args.save_steps is not None:
+        hparams.SAVE_STEPS = int(g_args.save_steps)
+    if g_args.summary_steps is not None:
+        hparams.SUMMARY_STEPS = int(g_args.summary_steps)
+    if g_args.no_summary_graph:
+        hparams.SUMMARY_GRAPH = False
+    if g_args.telemetry_file is not None:
+        hparams.TELEMETRY_FILE = g_args.telemetry_file
+    if g_args.encoder_type is not None:
+        hparams.ENCODER_TYPE = g_args.encoder_type
+    if g_args.xla_jit is not None:
+        hparams.XLA_JIT = None if g_args.xla_jit == 'none' else g_args.xla_jit
+    if g_args.intra_op_threads is not None:
+        hparams.INTRA_OP_THREADS = int(g_args.intra_op_threads)
+    if g_args.inter_op_threads is not None:
+        hparams.INTER_OP_THREADS = int(g_args.inter_op_threads)
+    if g_args.chunk_frames is not None:
+        assert 0 < g_args.chunk_overlap < g_args.chunk_frames
 
     hparams.digest()
 
-    stdout.write('Preparing dataset "%s" ... ' % hparams.DATASET_TYPE)
-    stdout.flush()
-    g_dataset = hparams.get_dataset()()
-    g_dataset.install_and_load()
-    stdout.write('done\n')
-    stdout.flush()
+    if g_args.mode == 'scaling':
+        _scaling_report()
+        return
+    elif g_args.mode == 'autotune':
+        _autotune()
+        return
+    elif g_args.mode == 'xla-bench':
+        _xla_report()
+        return
+
+    sess_config = runtime.session_config()
+
+    cluster = None
+    is_chief = True
+    sync_workers = None
+    worker_device = None
+    device_setter = None
+    # evaluator is a local process, even if spawned by a cluster worker
+    if g_args.job_name is not None and g_args.mode != 'evaluator':
+        cluster = distributed.make_cluster(
+            g_args.ps_hosts, g_args.worker_hosts)
+        tf_server = tf.train.Server(
+            cluster,
+            job_name=g_args.job_name,
+            task_index=g_args.task_index,
+            config=sess_config)
+        if g_args.job_name == 'ps':
+            print('Parameter server %d started' % g_args.task_index)
+            tf_server.join()
+            return
+        elif g_args.job_name != 'worker':
+            raise ValueError('Unknown job name "%s"' % g_args.job_name)
+        is_chief = (g_args.task_index == 0)
+        if g_args.sync_replicas:
+            sync_workers = cluster.num_tasks('worker')
+        worker_device = distributed.worker_device(g_args.task_index)
+        device_setter = distributed.device_setter(cluster, g_args.task_index)
+
+    g_dataset = None
+    if not (g_args.mode == 'bench' and g_args.synthetic
+            or g_args.mode in ['separate', 'export', 'stream', 'serve']):
+        stdout.write('Preparing dataset "%s" ... ' % hparams.DATASET_TYPE)
+        stdout.flush()
+        g_dataset = hparams.get_dataset()()
+        g_dataset.install_and_load()
+        stdout.write('done\n')
+        stdout.flush()
 
     print('Encoder type: "%s"' % hparams.ENCODER_TYPE)
     print('Separator type: "%s"' % hparams.SEPARATOR_TYPE)
@@ -619,35 +2231,96 @@ def main():
 
     stdout.write('Building model ... ')
     stdout.flush()
-    g_model = Model(name=g_args.name)
     if g_args.mode in ['demo', 'debug']:
         hparams.BATCH_SIZE = 1
+        hparams.NUM_REPLICA = 1
         print(
             '\n  Warning: setting hparams.BATCH_SIZE to 1 for "demo" mode'
             '\n... ', end='')
         if g_args.mode == 'debug':
             hparams.DEBUG = True
-    g_model.build()
+    if g_args.mode == 'export':
+        hparams.WAVEFORM_INFER = True
+    if g_args.mode == 'stream':
+        hparams.STREAM_INFER = True
+    if g_args.mode == 'quantize':
+        # float inference is the baseline, calibration runs on one tower
+        hparams.QUANT_TABLE = None
+        hparams.NUM_REPLICA = 1
+    t_build = time.perf_counter()
+    with tf.device(device_setter):
+        g_model = Model(
+            name=g_args.name,
+            is_chief=is_chief,
+            sync_workers=sync_workers,
+            worker_device=worker_device)
+        g_model.build()
+    t_build = time.perf_counter() - t_build
     stdout.write('done\n')
 
-    g_model.reset()
-    if g_args.input_pfile is not None:
-        stdout.write('Loading paramters from %s ... ' % g_args.input_pfile)
-        g_model.load_params(g_args.input_pfile)
+    if cluster is not None:
+        stdout.write('Waiting for cluster session ... ')
+        stdout.flush()
+        g_sess = distributed.create_session(
+            tf_server, g_model, is_chief,
+            config=sess_config, restore_file=g_args.input_pfile)
         stdout.write('done\n')
+    else:
+        g_sess = tf.Session(config=sess_config)
+        g_model.reset()
+        if g_args.input_pfile is not None:
+            stdout.write('Loading paramters from %s ... ' % g_args.input_pfile)
+            g_model.load_params(g_args.input_pfile)
+            stdout.write('done\n')
     stdout.flush()
 
     if g_args.mode == 'interactive':
         print('Now in interactive mode, you should run this with python -i')
         return
     elif g_args.mode == 'train':
-        g_model.train(n_epoch=g_args.num_epoch, dataset=g_dataset)
-        if g_args.output_pfile is not None:
+        resume_state = None
+        if g_args.resume is not None:
+            resume_file = g_args.resume
+            if resume_file == 'latest':
+                resume_file = checkpoint.latest_checkpoint(hparams.SAVE_DIR)
+                if resume_file is None:
+                    raise ValueError(
+                        'No checkpoint in "%s" to resume' % hparams.SAVE_DIR)
+            stdout.write('Resuming training state from %s ... ' % resume_file)
+            stdout.flush()
+            resume_state = g_model.load_state(resume_file)
+            stdout.write('done\n')
+        g_model.train(
+            n_epoch=g_args.num_epoch, dataset=g_dataset,
+            resume_state=resume_state)
+        if g_args.output_pfile is not None and is_chief:
             stdout.write('Saving parameters into %s ... ' % g_args.output_pfile)
             stdout.flush()
             g_model.save_params(g_args.output_pfile)
             stdout.write('done\n')
             stdout.flush()
+    elif g_args.mode == 'throughput':
+        print(json.dumps(g_model.time_steps(
+            g_model.train_batches(g_dataset),
+            g_args.num_steps, mode=g_args.throughput_of)))
+    elif g_args.mode == 'bench':
+        _bench(g_model, g_dataset, t_build)
+    elif g_args.mode == 'export':
+        if g_args.output_pfile is None:
+            raise ValueError('"export" mode needs output directory via -o')
+        g_model.export_infer(g_args.output_pfile)
+        print('Inference graph exported to %s' % g_args.output_pfile)
+    elif g_args.mode == 'separate':
+        _separate_files(g_model)
+    elif g_args.mode == 'stream':
+        _stream_file(g_model)
+    elif g_args.mode == 'serve':
+        _serve(g_model)
+    elif g_args.mode == 'quantize':
+        _quantize(g_model, g_dataset)
+    elif g_args.mode == 'evaluator':
+        g_model.evaluate_checkpoints(
+            g_dataset, hparams.SAVE_DIR, trainer_pid=g_args.trainer_pid)
     elif g_args.mode == 'test':
         g_model.test(g_dataset)
     elif g_args.mode == 'valid':
@@ -676,6 +2349,13 @@ def main():
             true_mixture = - np.einsum(
                 'nwh,nc->whc', true_mixture, colors)
             true_mixture /= np.min(true_mixture)
+        elif g_args.chunk_frames is not None:
+            filename, fileext = os.path.splitext(g_args.input_file)
+            print(json.dumps(_separate_long(
+                g_model, g_args.input_file, [
+                    filename + ('_separated_%d' % (i+1)) + fileext
+                    for i in range(hparams.MAX_N_SIGNAL)])))
+            return
         else:
             filename = g_args.input_file
             raw_mixture = utils.load_wavfile(g_args.input_file)